@@ -0,0 +1,67 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from aiohttp import WSMsgType, web
+
+
+@dataclass
+class BraynsSettings:
+    frame_size: int = 256 * 1024
+    frame_rate: float = 30
+
+
+async def userinfo(request: web.Request) -> web.Response:
+    """Keycloak userinfo stand-in, any "Bearer <name>" token is valid."""
+    token = request.headers.get("Authorization", "")
+    scheme, _, name = token.partition(" ")
+    if scheme != "Bearer" or not name:
+        raise web.HTTPUnauthorized()
+    return web.json_response({"email": f"{name}@example.com"})
+
+
+def create_keycloak() -> web.Application:
+    application = web.Application()
+    application.router.add_get("/userinfo", userinfo)
+    return application
+
+
+def create_brayns(settings: BraynsSettings) -> web.Application:
+    """Brayns stand-in streaming binary frames and echoing text requests."""
+
+    async def healthcheck(request: web.Request) -> web.Response:
+        return web.HTTPOk()
+
+    async def websocket(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        streamer = asyncio.create_task(stream(ws, settings))
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.TEXT:
+                    await ws.send_str(message.data)
+        finally:
+            streamer.cancel()
+        return ws
+
+    application = web.Application()
+    application.router.add_get("/healthz", healthcheck)
+    application.router.add_get("/", websocket)
+    return application
+
+
+async def stream(ws: web.WebSocketResponse, settings: BraynsSettings) -> None:
+    frame = bytes(settings.frame_size)
+    period = 1 / settings.frame_rate
+    next_frame = time.monotonic()
+    while not ws.closed:
+        await ws.send_bytes(frame)
+        next_frame += period
+        await asyncio.sleep(max(0, next_frame - time.monotonic()))
+
+
+async def start_server(application: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(application)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
@@ -0,0 +1,336 @@
+"""Benchmark master and slave against local stand-ins of Keycloak, ECS and Brayns.
+
+The master and slave run as subprocesses with the TEST allocator. The DB is
+a fresh SQLite file unless VSM_DB_ENGINE selects another one.
+
+Example:
+    python benchmarks/run.py --sessions 200 --concurrency 50 --output results.json
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from aiohttp import ClientSession, ClientTimeout, WSMsgType
+from fakes import BraynsSettings, create_brayns, create_keycloak, start_server
+
+ROOT = Path(__file__).resolve().parent.parent
+MIB = 1024 * 1024
+
+
+@dataclass
+class Results:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    proxy_bytes: int = 0
+    proxy_seconds: float = 0
+    rss: dict[str, list[int]] = field(default_factory=lambda: defaultdict(list))
+
+    def record(self, operation: str, start: float) -> None:
+        self.latencies[operation].append(time.perf_counter() - start)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50, help="total user sessions")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at the same time")
+    parser.add_argument("--users", type=int, default=10, help="distinct users (tokens)")
+    parser.add_argument("--session-seconds", type=float, default=5, help="time spent streaming per session")
+    parser.add_argument("--status-interval", type=float, default=0.5, help="delay between /status polls")
+    parser.add_argument("--long-poll", action="store_true", help="wait with /status/{id}/wait instead of polling")
+    parser.add_argument("--frame-size", type=int, default=256 * 1024, help="Brayns frame size in bytes")
+    parser.add_argument("--frame-rate", type=float, default=30, help="Brayns frames per second")
+    parser.add_argument("--allocator-delay", type=float, default=0.2, help="job creation latency in seconds")
+    parser.add_argument("--boot-time", type=float, default=2, help="time for a job to become ready in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of master and slave")
+    parser.add_argument("--master-port", type=int, default=14444)
+    parser.add_argument("--slave-port", type=int, default=18888)
+    parser.add_argument("--keycloak-port", type=int, default=18080)
+    parser.add_argument("--brayns-port", type=int, default=15000)
+    parser.add_argument(
+        "--sqlite-path",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "vsm-benchmark.db",
+        help="SQLite file used when VSM_DB_ENGINE is not set",
+    )
+    parser.add_argument("--log-dir", type=Path, help="keep master and slave logs in this directory")
+    parser.add_argument("--output", type=Path, help="JSON file to save the results to")
+    return parser.parse_args()
+
+
+def create_environment(args: Namespace) -> dict[str, str]:
+    environment = dict(os.environ)
+    environment.update(
+        {
+            "VSM_JOB_ALLOCATOR": "TEST",
+            "VSM_FAKE_ALLOCATOR_DELAY_SECONDS": str(args.allocator_delay),
+            "VSM_FAKE_ALLOCATOR_BOOT_SECONDS": str(args.boot_time),
+            "VSM_USE_KEYCLOAK": "1",
+            "VSM_KEYCLOAK_URL": f"http://127.0.0.1:{args.keycloak_port}/userinfo",
+            "VSM_KEYCLOAK_HOST": f"127.0.0.1:{args.keycloak_port}",
+            "VSM_BRAYNS_PORT": str(args.brayns_port),
+            "VSM_PROXY_URL": f"127.0.0.1:{args.slave_port}",
+        }
+    )
+    if "VSM_DB_ENGINE" not in environment:
+        environment["VSM_DB_ENGINE"] = "sqlite"
+        environment["VSM_DB_SQLITE_PATH"] = str(args.sqlite_path)
+        environment["VSM_RECREATE_DB"] = "1"
+    # Defaults that keep the load generator from measuring its own throttling.
+    environment.setdefault("VSM_LOG_LEVEL", "WARNING")
+    environment.setdefault("VSM_ADMISSION_MAX_JOBS_PER_USER", "0")
+    environment.setdefault("VSM_ADMISSION_START_RATE_PER_SECOND", "0")
+    environment.setdefault("VSM_ADMISSION_MAX_IN_FLIGHT", "0")
+    environment.setdefault("VSM_WARM_POOL_MAX_SIZE", "0")
+    return environment
+
+
+def start_process(name: str, port: int, args: Namespace) -> subprocess.Popen:
+    output: Any = subprocess.DEVNULL
+    if args.log_dir is not None:
+        args.log_dir.mkdir(parents=True, exist_ok=True)
+        output = open(args.log_dir / f"{name}.log", "w")
+    return subprocess.Popen(
+        [sys.executable, str(ROOT / f"{name}.py"), "--port", str(port), "--workers", str(args.workers)],
+        cwd=ROOT,
+        env=create_environment(args),
+        stdout=output,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_healthy(session: ClientSession, process: subprocess.Popen, url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process {process.args!r} exited with code {process.returncode}")
+        try:
+            async with session.get(f"{url}/healthz") as response:
+                if response.ok:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} not healthy after {timeout}s")
+
+
+def read_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def read_children(pid: int) -> list[int]:
+    children = list[int]()
+    for path in Path(f"/proc/{pid}/task").glob("*/children"):
+        try:
+            children.extend(int(child) for child in path.read_text().split())
+        except OSError:
+            pass
+    return children
+
+
+def read_tree_rss(pid: int) -> int:
+    """RSS of the process and its descendants (workers forked by the supervisor)."""
+    return read_rss(pid) + sum(read_tree_rss(child) for child in read_children(pid))
+
+
+async def sample_rss(processes: dict[str, subprocess.Popen], results: Results) -> None:
+    while True:
+        for name, process in processes.items():
+            results.rss[name].append(read_tree_rss(process.pid))
+        await asyncio.sleep(0.5)
+
+
+async def run_session(index: int, session: ClientSession, args: Namespace, results: Results) -> None:
+    master = f"http://127.0.0.1:{args.master_port}"
+    headers = {"Authorization": f"Bearer bench-user-{index % args.users}"}
+
+    start = time.perf_counter()
+    async with session.post(f"{master}/start", json={"project": "bench"}, headers=headers) as response:
+        if not response.ok:
+            results.errors["start"] += 1
+            return
+        job_id = (await response.json(content_type=None))["job_id"]
+    results.record("start", start)
+
+    ready_start = time.perf_counter()
+    while True:
+        operation = "status_wait" if args.long_poll else "status"
+        url = f"{master}/status/{job_id}/wait" if args.long_poll else f"{master}/status/{job_id}"
+        start = time.perf_counter()
+        async with session.get(url, headers=headers) as response:
+            if not response.ok:
+                results.errors[operation] += 1
+                return
+            status = await response.json(content_type=None)
+        results.record(operation, start)
+        if status["ready"]:
+            break
+        if status.get("state") == "failed":
+            results.errors["ready"] += 1
+            return
+        if not args.long_poll:
+            await asyncio.sleep(args.status_interval)
+    results.record("time_to_ready", ready_start)
+
+    await stream(job_id, session, args, results)
+
+    start = time.perf_counter()
+    async with session.post(f"{master}/stop/{job_id}", headers=headers) as response:
+        if not response.ok:
+            results.errors["stop"] += 1
+            return
+    results.record("stop", start)
+
+
+async def stream(job_id: str, session: ClientSession, args: Namespace, results: Results) -> None:
+    start = time.perf_counter()
+    try:
+        ws = await session.ws_connect(f"ws://127.0.0.1:{args.slave_port}/{job_id}/renderer", max_msg_size=0)
+    except Exception:
+        results.errors["connect"] += 1
+        return
+    results.record("connect", start)
+
+    received = 0
+    echo_start: float | None = None
+    session_start = time.perf_counter()
+    next_echo = session_start
+    deadline = session_start + args.session_seconds
+
+    async with ws:
+        while (now := time.perf_counter()) < deadline:
+            # One text request per second, measured until its echo comes back.
+            if echo_start is None and now >= next_echo:
+                echo_start = now
+                next_echo = now + 1
+                await ws.send_str(json.dumps({"id": 1, "method": "get-version"}))
+            wake_up = deadline if echo_start is not None else min(deadline, next_echo)
+            try:
+                message = await ws.receive(timeout=max(wake_up - now, 0.001))
+            except asyncio.TimeoutError:
+                continue
+            if message.type == WSMsgType.BINARY:
+                received += len(message.data)
+            elif message.type == WSMsgType.TEXT and echo_start is not None:
+                results.record("echo", echo_start)
+                echo_start = None
+            else:
+                results.errors["stream"] += 1
+                break
+
+    results.proxy_bytes += received
+    results.proxy_seconds += time.perf_counter() - session_start
+
+
+def summarize(values: list[float], elapsed: float) -> dict[str, float]:
+    ordered = sorted(values)
+    percentiles = statistics.quantiles(ordered, n=100, method="inclusive") if len(ordered) > 1 else ordered * 99
+    return {
+        "count": len(ordered),
+        "requests_per_second": len(ordered) / elapsed,
+        "mean_ms": 1000 * statistics.fmean(ordered),
+        "p50_ms": 1000 * percentiles[49],
+        "p95_ms": 1000 * percentiles[94],
+        "p99_ms": 1000 * percentiles[98],
+        "max_ms": 1000 * ordered[-1],
+    }
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main() -> None:
+    args = parse_argv()
+    results = Results()
+
+    brayns_settings = BraynsSettings(args.frame_size, args.frame_rate)
+    servers = [
+        await start_server(create_keycloak(), args.keycloak_port),
+        await start_server(create_brayns(brayns_settings), args.brayns_port),
+    ]
+
+    processes = {
+        "master": start_process("master", args.master_port, args),
+        "slave": start_process("slave", args.slave_port, args),
+    }
+
+    timeout = ClientTimeout(total=None, sock_connect=10)
+
+    try:
+        async with ClientSession(timeout=timeout) as session:
+            await wait_healthy(session, processes["master"], f"http://127.0.0.1:{args.master_port}")
+            await wait_healthy(session, processes["slave"], f"http://127.0.0.1:{args.slave_port}")
+
+            sampler = asyncio.create_task(sample_rss(processes, results))
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(index: int) -> None:
+                async with semaphore:
+                    try:
+                        await run_session(index, session, args, results)
+                    except Exception as e:
+                        print(f"Session {index} failed: {e!r}", file=sys.stderr)
+                        results.errors["session"] += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(limited(index) for index in range(args.sessions)))
+            elapsed = time.perf_counter() - start
+
+            sampler.cancel()
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait(timeout=10)
+        for server in servers:
+            await server.cleanup()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": get_revision(),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "elapsed_seconds": elapsed,
+        "latency": {name: summarize(values, elapsed) for name, values in results.latencies.items() if values},
+        "errors": dict(results.errors),
+        "proxy": {
+            "bytes": results.proxy_bytes,
+            "total_mb_per_second": results.proxy_bytes / MIB / elapsed,
+            "session_mb_per_second": results.proxy_bytes / MIB / results.proxy_seconds if results.proxy_seconds else 0,
+        },
+        "rss_mb": {
+            name: {"peak": max(values, default=0) / MIB, "last": values[-1] / MIB if values else 0}
+            for name, values in results.rss.items()
+        },
+    }
+
+    text = json.dumps(report, indent=4)
+    print(text)
+
+    if args.output is not None:
+        args.output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,33 @@
 #!/bin/bash
-echo "Behold, fuse mounting S3"
-mkdir -p ${FUSE_MOUNT_POINT}
-/usr/bin/s3fs ${S3_BUCKET_PATH} ${FUSE_MOUNT_POINT} -o iam_role=viz_brayns-ecsTaskRole -o ecs
-ls /sbo/data/project
+mount_bucket() {
+    echo "Behold, fuse mounting S3"
+    mkdir -p "$2"
+    /usr/bin/s3fs "$1" "$2" -o iam_role=viz_brayns-ecsTaskRole -o ecs || return 1
+    ls /sbo/data/project
+}
+
+wait_for_assignment() {
+    # Warm pool task: Brayns starts right away and the bucket is mounted
+    # once the master writes "<bucket path>\n<mount point>\n" for this task.
+    TASK_ARN=$(curl -s "${ECS_CONTAINER_METADATA_URI_V4}/task" | grep -o '"TaskARN": *"[^"]*"' | sed 's/.*"\([^"]*\)"$/\1/')
+    TASK_ID=${TASK_ARN##*/}
+    echo "Waiting for assignment of task ${TASK_ID}"
+    until aws s3 cp "${VSM_ASSIGNMENT_URI}/${TASK_ID}" /tmp/assignment --quiet; do
+        sleep 1
+    done
+    { read -r BUCKET_PATH; read -r MOUNT_POINT; } < /tmp/assignment
+    mount_bucket "${BUCKET_PATH}" "${MOUNT_POINT}" || return 1
+    # The master only reports the job ready once this marker exists.
+    until aws s3 cp - "${VSM_ASSIGNMENT_URI}/${TASK_ID}.mounted" --quiet < /dev/null; do
+        sleep 1
+    done
+}
+
+if [ -z "${S3_BUCKET_PATH}" ] && [ -n "${VSM_ASSIGNMENT_URI}" ]; then
+    wait_for_assignment &
+else
+    mount_bucket "${S3_BUCKET_PATH}" "${FUSE_MOUNT_POINT}"
+fi
 
 echo Passed arguments: "$*"
 eval "$*"
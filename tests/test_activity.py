@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from vsm.activity import ActivityRecorder
+from vsm.db import Job
+from vsm.db_local import MemoryConnector
+
+
+def test_open_sessions_recorded_every_flush() -> None:
+    async def run() -> None:
+        connector = MemoryConnector()
+        now = datetime.now(timezone.utc)
+
+        async with await connector.connect() as connection:
+            await connection.insert_jobs([Job("open", "user", now, now), Job("closed", "user", now, now)])
+
+        recorder = ActivityRecorder(connector, logging.getLogger("test"))
+        recorder.open("open")
+        recorder.open("open")
+        recorder.open("closed")
+        recorder.close("closed")
+        recorder.close("open")
+
+        await recorder.flush()
+
+        async with await connector.connect() as connection:
+            first = await connection.get_job("open")
+            closed = await connection.get_job("closed")
+
+        assert first is not None and first.last_activity is not None
+        assert closed is not None and closed.last_activity is None
+
+        # No message since, the connection still counts.
+        await recorder.flush()
+
+        async with await connector.connect() as connection:
+            second = await connection.get_job("open")
+
+        assert second is not None and second.last_activity is not None
+        assert second.last_activity > first.last_activity
+
+    asyncio.run(run())
@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import os
+
+from aiohttp import WSMsgType, web
+
+from vsm.compression import (
+    COMPRESSED,
+    PRECOMPRESSED,
+    SMALL,
+    CompressingSender,
+    CompressionPolicy,
+    is_precompressed,
+)
+
+JPEG = b"\xff\xd8\xff" + bytes(1000)
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(1000)
+WEBP = b"RIFF\x00\x00\x00\x00WEBP" + bytes(1000)
+RAW = bytes(1000)
+
+
+def brayns_reply(binary: bytes) -> bytes:
+    header = b'{"id":1,"result":{}}'
+    return len(header).to_bytes(4, "little") + header + binary
+
+
+def test_is_precompressed() -> None:
+    assert is_precompressed(JPEG)
+    assert is_precompressed(PNG)
+    assert is_precompressed(WEBP)
+    assert not is_precompressed(RAW)
+
+
+def test_is_precompressed_after_brayns_header() -> None:
+    assert is_precompressed(brayns_reply(JPEG))
+    assert not is_precompressed(brayns_reply(RAW))
+
+
+def test_decide() -> None:
+    policy = CompressionPolicy(text_min_size=10, binary_min_size=100)
+
+    assert policy.decide(WSMsgType.TEXT, "short") == SMALL
+    assert policy.decide(WSMsgType.TEXT, "long enough text") == COMPRESSED
+    assert policy.decide(WSMsgType.BINARY, RAW[:50]) == SMALL
+    assert policy.decide(WSMsgType.BINARY, RAW) == COMPRESSED
+    assert policy.decide(WSMsgType.BINARY, JPEG) == PRECOMPRESSED
+    assert policy.decide(WSMsgType.BINARY, brayns_reply(JPEG)) == PRECOMPRESSED
+
+
+async def read_frames(port: int, count: int) -> list[tuple[bool, int]]:
+    """Handshake with permessage-deflate and return (RSV1, opcode) of the first frames."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(
+        (
+            "GET / HTTP/1.1\r\n"
+            f"Host: 127.0.0.1:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "Sec-WebSocket-Extensions: permessage-deflate\r\n"
+            "\r\n"
+        ).encode()
+    )
+
+    headers = await reader.readuntil(b"\r\n\r\n")
+    assert b"permessage-deflate" in headers
+
+    frames = list[tuple[bool, int]]()
+
+    for _ in range(count):
+        first, second = await reader.readexactly(2)
+        size = second & 0x7F
+        if size == 126:
+            size = int.from_bytes(await reader.readexactly(2), "big")
+        elif size == 127:
+            size = int.from_bytes(await reader.readexactly(8), "big")
+        await reader.readexactly(size)
+        frames.append((bool(first & 0x40), first & 0x0F))
+
+    writer.close()
+    return frames
+
+
+def test_uncompressed_frames_on_the_wire() -> None:
+    # Relies on the private aiohttp writer attribute, fails if it changes.
+    async def handler(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+
+        assert ws._writer is not None
+        assert hasattr(ws._writer, "compress")
+
+        sender = CompressingSender(ws, CompressionPolicy(text_min_size=10, binary_min_size=100))
+        await sender.send(WSMsgType.BINARY, JPEG)
+        await sender.send(WSMsgType.TEXT, "x" * 1000)
+        await sender.send(WSMsgType.TEXT, "tiny")
+        await sender.send(WSMsgType.BINARY, RAW)
+        await ws.close()
+        return ws
+
+    async def run() -> list[tuple[bool, int]]:
+        application = web.Application()
+        application.router.add_get("/", handler)
+        runner = web.AppRunner(application)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            return await read_frames(port, 4)
+        finally:
+            await runner.cleanup()
+
+    frames = asyncio.run(run())
+
+    binary, text = WSMsgType.BINARY.value, WSMsgType.TEXT.value
+    assert frames == [(False, binary), (True, text), (False, text), (True, binary)]
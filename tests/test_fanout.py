@@ -0,0 +1,96 @@
+import asyncio
+from typing import Any
+
+from aiohttp import WSCloseCode, WSMessage, WSMsgType
+
+from vsm.fanout import Participant
+from vsm.settings import PROXY_FANOUT_QUEUE_SIZE
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.close_code: int | None = None
+
+    async def close(self, code: int) -> None:
+        self.close_code = code
+
+
+class FakeSender:
+    def __init__(self) -> None:
+        self.sent = list[Any]()
+
+    async def send(self, message_type: WSMsgType, data: Any) -> None:
+        self.sent.append(data)
+
+
+def create_message(data: str) -> WSMessage:
+    return WSMessage(WSMsgType.TEXT, data, None)
+
+
+def create_participant(controller: bool) -> tuple[Participant, FakeWebSocket, FakeSender]:
+    ws, sender = FakeWebSocket(), FakeSender()
+    return Participant(ws, sender, controller), ws, sender  # type: ignore[arg-type]
+
+
+def test_viewer_dropped_when_queue_full() -> None:
+    async def run() -> None:
+        viewer, ws, sender = create_participant(controller=False)
+
+        for index in range(PROXY_FANOUT_QUEUE_SIZE):
+            assert await viewer.put(create_message(str(index)))
+
+        assert not await viewer.put(create_message("overflow"))
+        assert viewer.dropped
+        assert not await viewer.put(create_message("after drop"))
+
+        # What was queued is discarded, the connection is closed right away.
+        await viewer.send_loop()
+
+        assert sender.sent == []
+        assert ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+
+    asyncio.run(run())
+
+
+def test_controller_waits_for_room() -> None:
+    async def run() -> None:
+        controller, ws, sender = create_participant(controller=True)
+
+        for index in range(PROXY_FANOUT_QUEUE_SIZE):
+            await controller.put(create_message(str(index)))
+
+        blocked = asyncio.create_task(controller.put(create_message("last")))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        await controller.queue.get()
+        assert await blocked
+        assert not controller.dropped
+
+        sending = asyncio.create_task(controller.send_loop())
+        await controller.put(None)
+        await asyncio.wait_for(sending, 1)
+
+        assert sender.sent == [str(index) for index in range(1, PROXY_FANOUT_QUEUE_SIZE)] + ["last"]
+        assert ws.close_code == WSCloseCode.OK
+
+    asyncio.run(run())
+
+
+def test_drop_unblocks_waiting_controller() -> None:
+    async def run() -> None:
+        controller, ws, _ = create_participant(controller=True)
+
+        for index in range(PROXY_FANOUT_QUEUE_SIZE):
+            await controller.put(create_message(str(index)))
+
+        blocked = asyncio.create_task(controller.put(create_message("last")))
+        await asyncio.sleep(0.01)
+
+        controller.drop()
+        await asyncio.wait_for(blocked, 1)
+        await controller.send_loop()
+
+        assert ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from aiohttp import WSMessage, WSMsgType
+
+from vsm.frame_queue import FrameQueue, is_droppable
+
+
+def binary(data: bytes) -> WSMessage:
+    return WSMessage(WSMsgType.BINARY, data, None)
+
+
+def brayns_reply(header: dict) -> WSMessage:
+    encoded = json.dumps(header).encode()
+    return binary(len(encoded).to_bytes(4, "little") + encoded + b"\x00" * 16)
+
+
+def test_is_droppable() -> None:
+    assert is_droppable(binary(b"\xff\xd8\xff" + bytes(100)))
+    assert is_droppable(brayns_reply({"params": {}}))
+    assert not is_droppable(brayns_reply({"id": 1, "result": {}}))
+    assert not is_droppable(WSMessage(WSMsgType.TEXT, '{"id": 1}', None))
+    assert not is_droppable(WSMessage(WSMsgType.PING, b"", None))
+
+
+def test_oldest_frame_dropped() -> None:
+    async def run() -> list[WSMessage]:
+        queue = FrameQueue(2)
+        queue.put(binary(b"frame 1"))
+        queue.put(WSMessage(WSMsgType.TEXT, "text", None))
+        queue.put(brayns_reply({"id": 1}))
+        queue.put(binary(b"frame 2"))
+        queue.put(binary(b"frame 3"))
+        queue.close()
+
+        messages = list[WSMessage]()
+        while (message := await queue.get()) is not None:
+            messages.append(message)
+        return messages
+
+    messages = asyncio.run(run())
+
+    assert [message.data for message in messages][:2] == ["text", brayns_reply({"id": 1}).data]
+    assert [message.data for message in messages][2:] == [b"frame 2", b"frame 3"]
@@ -0,0 +1,35 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from vsm.allocator import FakeAllocator
+from vsm.db import Job, JobState
+from vsm.db_local import MemoryConnector
+from vsm.readiness import ReadinessTracker
+
+
+def test_cancel_stops_tracking_before_update() -> None:
+    async def run() -> None:
+        logger = logging.getLogger("test")
+        allocator = FakeAllocator(logger, delay=0, boot_time=0.05)
+        connector = MemoryConnector()
+        job_id = await allocator.create_job("token", {})
+
+        now = datetime.now(timezone.utc)
+        async with await connector.connect() as connection:
+            await connection.insert_job(Job(job_id, "user", now, now))
+
+        tracker = ReadinessTracker(allocator, connector, logger, initial_delay=0.01)
+        tracker.track("token", job_id)
+
+        await tracker.cancel(job_id)
+        await asyncio.sleep(0.1)
+
+        async with await connector.connect() as connection:
+            job = await connection.get_job(job_id)
+
+        assert job is not None
+        assert job.state == JobState.PENDING
+        assert job.host == ""
+
+    asyncio.run(run())
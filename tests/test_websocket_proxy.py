@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiohttp import WSMessage, WSMsgType
+
+from vsm.activity import ActivityRecorder
+from vsm.db_local import MemoryConnector
+from vsm.websocket_proxy import WebSocketProxy
+
+
+class FakeWebSocket:
+    def __init__(self, messages: list[WSMessage] | None = None) -> None:
+        self.messages = [*(messages or []), WSMessage(WSMsgType.CLOSED, None, None)]
+        self.sent = list[Any]()
+        self.closed = False
+
+    async def receive(self) -> WSMessage:
+        await asyncio.sleep(0)
+        return self.messages.pop(0)
+
+    async def ping(self) -> None:
+        self.sent.append(WSMsgType.PING)
+
+    async def pong(self) -> None:
+        self.sent.append(WSMsgType.PONG)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class FakeSender:
+    def __init__(self, ws: FakeWebSocket, fail: bool = False) -> None:
+        self.ws = ws
+        self.fail = fail
+
+    async def send(self, message_type: WSMsgType, data: Any) -> None:
+        if self.fail:
+            raise ConnectionResetError("Client gone")
+        self.ws.sent.append(data)
+
+
+def create_proxy() -> WebSocketProxy:
+    logger = logging.getLogger("test")
+    return WebSocketProxy(None, None, ActivityRecorder(MemoryConnector(), logger), logger)  # type: ignore[arg-type]
+
+
+def test_latest_forwards_control_frames_in_order() -> None:
+    brayns = FakeWebSocket(
+        [
+            WSMessage(WSMsgType.BINARY, b"frame", None),
+            WSMessage(WSMsgType.PING, b"", None),
+            WSMessage(WSMsgType.TEXT, "text", None),
+            WSMessage(WSMsgType.PONG, b"", None),
+        ]
+    )
+    client = FakeWebSocket()
+
+    asyncio.run(create_proxy().wsforward_latest("brayns", brayns, client, FakeSender(client)))  # type: ignore[arg-type]
+
+    assert client.sent == [b"frame", WSMsgType.PING, "text", WSMsgType.PONG]
+    assert client.closed
+
+
+def test_latest_send_failure_closes_client() -> None:
+    brayns = FakeWebSocket([WSMessage(WSMsgType.BINARY, b"frame", None)] * 10)
+    client = FakeWebSocket()
+    sender = FakeSender(client, fail=True)
+
+    asyncio.run(create_proxy().wsforward_latest("brayns", brayns, client, sender))  # type: ignore[arg-type]
+
+    assert client.sent == []
+    assert client.closed
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timezone
+from logging import Logger
+
+from .db import DbConnector
+from .metrics import Counter
+from .settings import PROXY_ACTIVITY_PERIOD_SECONDS
+
+ACTIVITY_WRITES = Counter("vsm_proxy_activity_writes_total", "Job activity writes to the DB by result", ("result",))
+
+
+class ActivityRecorder:
+    """Collect the jobs clients interacted with and write their last activity to the DB periodically."""
+
+    def __init__(self, connector: DbConnector, logger: Logger, period: float = PROXY_ACTIVITY_PERIOD_SECONDS) -> None:
+        self._connector = connector
+        self._logger = logger
+        self._period = period
+        self._active = set[str]()
+        self._sessions = dict[str, int]()
+
+    def record(self, job_id: str) -> None:
+        self._active.add(job_id)
+
+    def open(self, job_id: str) -> None:
+        """Count a client connection, jobs with one are recorded every period even without messages."""
+        self._sessions[job_id] = self._sessions.get(job_id, 0) + 1
+
+    def close(self, job_id: str) -> None:
+        count = self._sessions.pop(job_id) - 1
+
+        if count > 0:
+            self._sessions[job_id] = count
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self._period)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    async def flush(self) -> None:
+        ids = list(self._active.union(self._sessions))
+        self._active.clear()
+
+        if not ids:
+            return
+
+        try:
+            async with await self._connector.connect() as connection:
+                await connection.record_activity(ids, datetime.now(timezone.utc))
+        except Exception as e:
+            self._logger.error(f"DB error while recording activity of {len(ids)} jobs: {e}")
+            ACTIVITY_WRITES.inc("failed")
+            # Kept for the next period, the activity is not lost.
+            self._active.update(ids)
+            return
+
+        ACTIVITY_WRITES.inc("ok")
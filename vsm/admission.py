@@ -0,0 +1,159 @@
+import math
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from logging import Logger
+
+from aiohttp import web
+
+from .cache import TtlCache
+from .db import DbConnector
+from .metrics import Counter, Gauge
+from .settings import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_JOBS_PER_USER,
+    ADMISSION_QUOTA_RETRY_AFTER_SECONDS,
+    ADMISSION_START_BURST,
+    ADMISSION_START_RATE_PER_SECOND,
+)
+
+ADMISSION_REJECTIONS = Counter("vsm_admission_rejections_total", "Job starts rejected by reason", ("reason",))
+IN_FLIGHT_ALLOCATIONS = Gauge("vsm_admission_in_flight", "Job allocations in progress")
+
+MAX_TRACKED_USERS = 10000
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    burst: int
+    tokens: float = field(init=False)
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self) -> None:
+        self.tokens = self.burst
+
+    def get_delay(self) -> float:
+        """Return the delay before a token is available, 0 if there is one."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        # Concurrent starts checked before the first one takes its token can
+        # overdraw the bucket, the next ones wait longer.
+        self.tokens -= 1
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        connector: DbConnector,
+        logger: Logger,
+        max_jobs_per_user: int = ADMISSION_MAX_JOBS_PER_USER,
+        start_rate: float = ADMISSION_START_RATE_PER_SECOND,
+        start_burst: int = ADMISSION_START_BURST,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+    ) -> None:
+        self._connector = connector
+        self._logger = logger
+        self._max_jobs_per_user = max_jobs_per_user
+        self._start_rate = start_rate
+        self._start_burst = start_burst
+        self._max_in_flight = max_in_flight
+        # A bucket untouched for the time it takes to refill is full again,
+        # dropping it is the same as creating a fresh one.
+        refill_time = start_burst / start_rate if start_rate > 0 else 0
+        self._buckets = TtlCache[str, TokenBucket](MAX_TRACKED_USERS, refill_time)
+        self._in_flight = dict[str, int]()
+        self._total_in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._total_in_flight
+
+    @asynccontextmanager
+    async def admit(self, user: str) -> AsyncIterator[None]:
+        """Reject the start with 429 or count it as in flight until the job is saved."""
+        self._check_in_flight(user)
+        bucket = self._check_rate(user)
+        self._add_in_flight(user, 1)
+
+        try:
+            await self._check_quota(user)
+
+            # Only admitted starts use a token.
+            if bucket is not None:
+                bucket.take()
+
+            yield
+        finally:
+            self._add_in_flight(user, -1)
+
+    def _check_rate(self, user: str) -> TokenBucket | None:
+        if self._start_rate <= 0:
+            return None
+
+        bucket = self._buckets.get(user)
+
+        if bucket is None:
+            bucket = TokenBucket(self._start_rate, self._start_burst)
+
+        self._buckets.put(user, bucket)
+
+        delay = bucket.get_delay()
+
+        if delay > 0:
+            self._reject("rate", f"User {user} starts jobs too fast", delay)
+
+        return bucket
+
+    def _check_in_flight(self, user: str) -> None:
+        if self._max_in_flight <= 0 or self.in_flight < self._max_in_flight:
+            return
+
+        self._reject("in_flight", f"Too many job allocations in progress ({self.in_flight})", 1)
+
+    async def _check_quota(self, user: str) -> None:
+        if self._max_jobs_per_user <= 0:
+            return
+
+        try:
+            async with await self._connector.connect() as connection:
+                active = await connection.count_active_jobs(user, datetime.now(timezone.utc))
+        except Exception as e:
+            self._logger.error(f"DB error while counting jobs: {e}")
+            raise web.HTTPInternalServerError(text="Internal DB error (cannot count jobs)")
+
+        # Concurrent starts of the same user are not in the DB yet.
+        total = active + self._in_flight[user]
+
+        if total > self._max_jobs_per_user:
+            self._reject(
+                "quota",
+                f"User {user} has reached the limit of {self._max_jobs_per_user} jobs",
+                ADMISSION_QUOTA_RETRY_AFTER_SECONDS,
+            )
+
+    def _add_in_flight(self, user: str, count: int) -> None:
+        value = self._in_flight.get(user, 0) + count
+
+        if value > 0:
+            self._in_flight[user] = value
+        else:
+            self._in_flight.pop(user, None)
+
+        self._total_in_flight += count
+        IN_FLIGHT_ALLOCATIONS.set(value=self._total_in_flight)
+
+    def _reject(self, reason: str, message: str, retry_after: float) -> None:
+        self._logger.warning(message)
+        ADMISSION_REJECTIONS.inc(reason)
+        raise web.HTTPTooManyRequests(text=message, headers={"Retry-After": str(math.ceil(retry_after))})
@@ -1,15 +1,19 @@
+import asyncio
+import time
 import uuid
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Protocol
 
 from .logger import Logger
+from .settings import FAKE_ALLOCATOR_BOOT_SECONDS, FAKE_ALLOCATOR_DELAY_SECONDS
 
 
 @dataclass
 class JobDetails:
     end_time: datetime | None = None
     host: str | None = None
+    failed: bool = False
 
     @property
     def ready(self) -> bool:
@@ -27,19 +31,49 @@ class JobAllocator(Protocol):
 
 
 class FakeAllocator(JobAllocator):
-    def __init__(self, logger: Logger) -> None:
+    """Local stand-in, jobs run on localhost after a configurable delay."""
+
+    def __init__(
+        self,
+        logger: Logger,
+        delay: float = FAKE_ALLOCATOR_DELAY_SECONDS,
+        boot_time: float = FAKE_ALLOCATOR_BOOT_SECONDS,
+    ) -> None:
         self._logger = logger
+        self._delay = delay
+        self._boot_time = boot_time
+        self._started = dict[str, float]()
 
     async def close(self) -> None:
         self._logger.info("Allocator closed")
 
     async def create_job(self, token: str, payload: dict[str, Any]) -> str:
         self._logger.info(f"Create job {token=} {payload=}")
-        return uuid.uuid4().hex
+        return await self._start()
+
+    async def create_idle_job(self) -> str:
+        self._logger.info("Create idle job")
+        return await self._start()
+
+    async def assign_job(self, job_id: str, payload: dict[str, Any]) -> None:
+        self._logger.info(f"Assign job {job_id} {payload=}")
+
+    async def list_idle_jobs(self) -> list[str]:
+        return []
 
     async def destroy_job(self, job_id: str) -> None:
         self._logger.info(f"Destroy job {job_id}")
+        self._started.pop(job_id, None)
 
     async def get_job_details(self, token: str, job_id: str) -> JobDetails:
         self._logger.info(f"Get job details {token=} {job_id=}")
+        started = self._started.get(job_id, 0)
+        if time.monotonic() - started < self._boot_time:
+            return JobDetails()
         return JobDetails(host="localhost")
+
+    async def _start(self) -> str:
+        await asyncio.sleep(self._delay)
+        job_id = uuid.uuid4().hex
+        self._started[job_id] = time.monotonic()
+        return job_id
@@ -1,5 +1,6 @@
 import asyncio
 from argparse import ArgumentParser
+from contextlib import suppress
 from dataclasses import dataclass
 from logging import INFO, Logger
 from ssl import PROTOCOL_TLS_SERVER, SSLContext
@@ -8,7 +9,9 @@ from aiohttp import web
 from aiohttp_middlewares.cors import cors_middleware
 
 from .logger import create_logger
-from .settings import BASE_HOST, CERT_CRT, CERT_KEY
+from .metrics import metrics_handler
+from .settings import BASE_HOST, CERT_CRT, CERT_KEY, WORKERS
+from .tracing import start_export, tracing_middleware
 
 
 @dataclass
@@ -16,23 +19,23 @@ class Settings:
     port: int
     host: str = BASE_HOST
     secure: bool = False
+    workers: int = WORKERS
 
 
-async def run_application(name: str, default_port: int, logger: Logger, routes: list[web.RouteDef]) -> None:
-    settings = parse_argv(name, default_port)
-
+async def run_application(name: str, settings: Settings, logger: Logger, routes: list[web.RouteDef]) -> None:
     logger.info(f"{name} settings: {settings}")
 
     ssl_context = create_ssl_context(settings.secure)
 
     application = web.Application(
         logger=create_logger("aiohttp", INFO),
-        middlewares=[cors_middleware(allow_all=True)],
+        middlewares=[cors_middleware(allow_all=True), tracing_middleware],
     )
 
     application.router.add_routes(
         [
             web.get("/healthz", healthcheck),
+            web.get("/metrics", metrics_handler),
             *routes,
         ]
     )
@@ -40,16 +43,25 @@ async def run_application(name: str, default_port: int, logger: Logger, routes:
     runner = web.AppRunner(application)
     await runner.setup()
 
-    site = web.TCPSite(runner, settings.host, settings.port, ssl_context=ssl_context)
+    # Workers share the port, the kernel balances connections between them.
+    reuse_port = True if settings.workers > 1 else None
+
+    site = web.TCPSite(runner, settings.host, settings.port, ssl_context=ssl_context, reuse_port=reuse_port)
 
     logger.info(f"{name} running at {settings.host}:{settings.port}")
 
     await site.start()
 
+    export = start_export(name.lower().replace(" ", "-"), logger)
+
     try:
         await asyncio.Future()
     finally:
         await runner.cleanup()
+        if export is not None:
+            export.cancel()
+            with suppress(asyncio.CancelledError):
+                await export
 
 
 def parse_argv(description: str, default_port: int) -> Settings:
@@ -69,6 +81,13 @@ def parse_argv(description: str, default_port: int) -> Settings:
         help="address to bind to",
     )
     parser.add_argument("--ssl", dest="ssl", action="store_true", help="force SSL")
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=WORKERS,
+        help="number of worker processes sharing the port",
+    )
     settings = Settings(default_port)
     parser.parse_args(namespace=settings)
     return settings
@@ -1,15 +1,41 @@
-from logging import Logger
+import asyncio
+import base64
+import hashlib
+import json
+import time
 from http import HTTPStatus
+from logging import Logger
+from typing import Any
 
 from aiohttp import ClientSession, web
 
-from .settings import KEYCLOAK_HOST, KEYCLOAK_USER_INFO_URL, USE_KEYCLOAK
+from .cache import TtlCache
+from .jwks import InvalidToken, JwksVerifier
+from .metrics import Counter
+from .settings import (
+    KEYCLOAK_AUDIENCE,
+    KEYCLOAK_HOST,
+    KEYCLOAK_ISSUER,
+    KEYCLOAK_JWKS_REFRESH_SECONDS,
+    KEYCLOAK_JWKS_URL,
+    KEYCLOAK_LOCAL_VERIFY,
+    KEYCLOAK_TOKEN_CACHE_SIZE,
+    KEYCLOAK_TOKEN_CACHE_TTL_SECONDS,
+    KEYCLOAK_USER_INFO_URL,
+    USE_KEYCLOAK,
+)
+from .tracing import span
+
+TOKEN_CACHE_LOOKUPS = Counter("vsm_token_cache_lookups_total", "Token cache lookups by result", ("result",))
 
 
 class Authenticator:
     def __init__(self, session: ClientSession, logger: Logger) -> None:
         self._session = session
         self._logger = logger
+        self._cache = TtlCache[str, str](KEYCLOAK_TOKEN_CACHE_SIZE, KEYCLOAK_TOKEN_CACHE_TTL_SECONDS)
+        self._pending = dict[str, asyncio.Future[str]]()
+        self._verifier = self._create_verifier() if KEYCLOAK_LOCAL_VERIFY else None
 
     def get_token(self, request: web.Request) -> str:
         self._logger.info("Extracting token from request header")
@@ -27,6 +53,75 @@ class Authenticator:
             self._logger.warn("No Keycloak configured, using default user")
             return None
 
+        key = hashlib.sha256(token.encode()).hexdigest()
+
+        email = self._cache.get(key)
+
+        if email is not None:
+            TOKEN_CACHE_LOOKUPS.inc("hit")
+            self._logger.info(f"User ID from token cache: {email}")
+            return email
+
+        TOKEN_CACHE_LOOKUPS.inc("miss")
+
+        with span("auth"):
+            pending = self._pending.get(key)
+
+            if pending is None:
+                pending = asyncio.ensure_future(self._resolve_username(key, token))
+                pending.add_done_callback(lambda future: self._lookup_done(key, future))
+                self._pending[key] = pending
+            else:
+                self._logger.info("Waiting for concurrent lookup of the same token")
+
+            return await asyncio.shield(pending)
+
+    def _lookup_done(self, key: str, future: asyncio.Future[str]) -> None:
+        self._pending.pop(key, None)
+
+        # The callers waiting for it may all have been cancelled.
+        if not future.cancelled():
+            future.exception()
+
+    async def _resolve_username(self, key: str, token: str) -> str:
+        lifetime = _get_remaining_lifetime(token)
+
+        if lifetime is not None and lifetime <= 0:
+            self._logger.error("Token is expired")
+            raise web.HTTPUnauthorized(text="Expired token")
+
+        email = None
+
+        if self._verifier is not None:
+            email = await self._verify_locally(token)
+
+        if email is None:
+            email = await self._fetch_username(token)
+
+        self._cache.put(key, email, lifetime)
+
+        return email
+
+    async def _verify_locally(self, token: str) -> str | None:
+        assert self._verifier is not None
+
+        try:
+            claims = await self._verifier.verify(_strip_bearer(token))
+        except InvalidToken as e:
+            self._logger.error(f"Local token verification failed: {e}")
+            raise web.HTTPUnauthorized(text="Invalid Keycloak token")
+
+        email = claims.get("email")
+
+        if email is None or not isinstance(email, str):
+            self._logger.warning("No 'email' claim in token, falling back to userinfo")
+            return None
+
+        self._logger.info(f"User ID from verified token: {email}")
+
+        return email
+
+    async def _fetch_username(self, token: str) -> str:
         url = KEYCLOAK_USER_INFO_URL
         headers = {
             "Host": KEYCLOAK_HOST,
@@ -36,21 +131,22 @@ class Authenticator:
         self._logger.info("Sending Keycloack request")
         self._logger.debug(f"Keycloak request details: {url=} {headers=}")
 
-        try:
-            response = await self._session.get(url, headers=headers)
-        except Exception as e:
-            self._logger.error(f"Adrien's logger saying that KK errors with: {e}")
-            raise web.HTTPInternalServerError("KK cert issue")
+        with span("keycloak"):
+            try:
+                response = await self._session.get(url, headers=headers)
+            except Exception as e:
+                self._logger.error(f"Adrien's logger saying that KK errors with: {e}")
+                raise web.HTTPInternalServerError("KK cert issue")
 
-        status = response.status
+            status = response.status
 
-        if status != HTTPStatus.OK:
-            self._logger.error(f"Keycloak status error (invalid token) {status}")
-            raise web.HTTPUnauthorized(text="Invalid Keycloak token")
+            if status != HTTPStatus.OK:
+                self._logger.error(f"Keycloak status error (invalid token) {status}")
+                raise web.HTTPUnauthorized(text="Invalid Keycloak token")
 
-        self._logger.info("Keycloak status Ok")
+            self._logger.info("Keycloak status Ok")
 
-        data = await response.json()
+            data = await response.json()
 
         self._logger.debug(f"Keycloak response body: {data}")
 
@@ -67,3 +163,45 @@ class Authenticator:
         self._logger.info(f"User ID: {email}")
 
         return email
+
+    def _create_verifier(self) -> JwksVerifier:
+        return JwksVerifier(
+            self._session,
+            self._logger,
+            KEYCLOAK_JWKS_URL,
+            KEYCLOAK_JWKS_REFRESH_SECONDS,
+            issuer=KEYCLOAK_ISSUER,
+            audience=KEYCLOAK_AUDIENCE,
+        )
+
+
+def _strip_bearer(token: str) -> str:
+    scheme, _, value = token.partition(" ")
+    if value and scheme.lower() == "bearer":
+        return value.strip()
+    return token
+
+
+def _decode_claims(token: str) -> dict[str, Any]:
+    parts = _strip_bearer(token).split(".")
+
+    if len(parts) != 3:
+        return {}
+
+    payload = parts[1] + "=" * (-len(parts[1]) % 4)
+
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return {}
+
+    return claims if isinstance(claims, dict) else {}
+
+
+def _get_remaining_lifetime(token: str) -> float | None:
+    expiry = _decode_claims(token).get("exp")
+
+    if not isinstance(expiry, int | float):
+        return None
+
+    return expiry - time.time()
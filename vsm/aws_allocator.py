@@ -1,67 +1,166 @@
+import asyncio
+import time
 from logging import INFO, Logger
 from typing import Any
 
 import boto3
 from aiohttp import ClientSession, web
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 from .allocator import JobAllocator, JobDetails
+from .batcher import RequestBatcher
+from .cache import TtlCache
+from .executor import BlockingExecutor
+from .metrics import Counter
 from .settings import (
+    AWS_ASSIGNMENT_BUCKET,
+    AWS_ASSIGNMENT_PREFIX,
     AWS_BUCKET_MOUNT_PATH,
     AWS_BUCKET_NAME,
+    AWS_CALL_TIMEOUT_SECONDS,
     AWS_CAPACITY_PROVIDER,
     AWS_CLUSTER,
+    AWS_DESCRIBE_BATCH_WINDOW_SECONDS,
+    AWS_DESCRIBE_CACHE_SECONDS,
+    AWS_MAX_CONCURRENCY,
     AWS_SECURITY_GROUPS,
     AWS_SUBNETS,
     AWS_TASK_DEFINITION,
+    AWS_TASK_MISSING_GRACE_SECONDS,
+    WARM_POOL_MAX_SIZE,
 )
+from .tracing import span
+
+DESCRIBE_TASKS_MAX_SIZE = 100
+WARM_POOL_STARTED_BY = "vsm-warm-pool"
+
+DESCRIBE_CALLS = Counter("vsm_ecs_describe_calls_total", "ECS describe_tasks API calls")
+DESCRIBE_LOOKUPS = Counter("vsm_ecs_describe_lookups_total", "Task status lookups by source", ("source",))
 
 
 class AwsAllocator(JobAllocator):
     def __init__(self, session: ClientSession, logger: Logger) -> None:
         self._session = session
         self._logger = logger
-        self._ecs_client = boto3.client("ecs")
+        self._ecs_client = boto3.client(
+            "ecs",
+            config=Config(
+                max_pool_connections=AWS_MAX_CONCURRENCY,
+                connect_timeout=AWS_CALL_TIMEOUT_SECONDS,
+                read_timeout=AWS_CALL_TIMEOUT_SECONDS,
+            ),
+        )
+        self._s3_client = boto3.client("s3")
+        self._executor = BlockingExecutor(AWS_MAX_CONCURRENCY, AWS_CALL_TIMEOUT_SECONDS, "ecs")
+        self._tasks = TtlCache[str, dict[str, Any]](10000, AWS_DESCRIBE_CACHE_SECONDS)
+        self._missing_since = TtlCache[str, float](10000, 10 * AWS_TASK_MISSING_GRACE_SECONDS)
+        self._describer = RequestBatcher(
+            self._describe_tasks, AWS_DESCRIBE_BATCH_WINDOW_SECONDS, DESCRIBE_TASKS_MAX_SIZE
+        )
         boto3.set_stream_logger(level=INFO)
 
     async def close(self) -> None:
-        pass
+        self._executor.close()
 
     async def create_job(self, token: str, payload: dict[str, Any]) -> str:
         self._logger.info("Creating new AWS task")
 
-        project = payload.get("project")
+        bucket_path, root_folder = self._get_mount(payload)
 
-        if project is None:
-            raise web.HTTPBadRequest(text="No projects provided in request body")
+        self._logger.info(f"Starting new ECS task mounting {bucket_path} at {root_folder}")
 
-        self._logger.info(f"Project name {project}")
+        environment = [
+            {"name": "S3_BUCKET_PATH", "value": bucket_path},
+            {"name": "FUSE_MOUNT_POINT", "value": root_folder},
+        ]
 
         try:
-            return await self._run_aws_task(project)
+            return await self._run_aws_task(environment)
         except Exception as e:
             self._logger.error(f"Error in AWS call: {e}")
             raise web.HTTPInternalServerError(text="Job allocation failed")
 
+    async def create_idle_job(self) -> str:
+        self._logger.info("Starting new idle ECS task for warm pool")
+
+        # The task waits for its assignment object before mounting the bucket.
+        environment = [
+            {"name": "VSM_ASSIGNMENT_URI", "value": f"s3://{AWS_ASSIGNMENT_BUCKET}/{AWS_ASSIGNMENT_PREFIX}"},
+        ]
+
+        return await self._run_aws_task(environment, started_by=WARM_POOL_STARTED_BY)
+
+    async def assign_job(self, job_id: str, payload: dict[str, Any]) -> None:
+        bucket_path, root_folder = self._get_mount(payload)
+
+        self._logger.info(f"Assigning task {job_id} to mount {bucket_path} at {root_folder}")
+
+        await self._executor.run(
+            self._s3_client.put_object,
+            Bucket=AWS_ASSIGNMENT_BUCKET,
+            Key=_get_assignment_key(job_id),
+            Body=f"{bucket_path}\n{root_folder}\n".encode(),
+        )
+
+    async def list_idle_jobs(self) -> list[str]:
+        """Running warm pool tasks that were never assigned, left by a previous master."""
+        kwargs: dict[str, Any] = {
+            "cluster": AWS_CLUSTER,
+            "startedBy": WARM_POOL_STARTED_BY,
+            "desiredStatus": "RUNNING",
+        }
+        job_ids = list[str]()
+
+        while True:
+            response = await self._executor.run(self._ecs_client.list_tasks, **kwargs)
+            job_ids.extend(arn.rsplit("/", 1)[-1] for arn in response["taskArns"])
+
+            next_token = response.get("nextToken")
+
+            if next_token is None:
+                break
+
+            kwargs["nextToken"] = next_token
+
+        assigned = await asyncio.gather(*(self._is_assigned(job_id) for job_id in job_ids))
+
+        return [job_id for job_id, job_assigned in zip(job_ids, assigned) if not job_assigned]
+
     async def destroy_job(self, job_id: str) -> None:
         try:
-            response = self._ecs_client.stop_task(cluster=AWS_CLUSTER, task=job_id)
+            response = await self._executor.run_to_completion(
+                self._ecs_client.stop_task, cluster=AWS_CLUSTER, task=job_id
+            )
         except Exception as e:
             self._logger.error(f"Failed to stop task {job_id}, assuming invalid ID: {e}")
             raise web.HTTPBadRequest(text=f"Invalid job ID {job_id}")
 
         self._logger.debug(f"AWS stop response {response}")
 
+        if WARM_POOL_MAX_SIZE > 0:
+            await self._delete_assignment(job_id)
+
     async def get_job_details(self, token: str, job_id: str) -> JobDetails:
         try:
-            response = self._ecs_client.describe_tasks(cluster=AWS_CLUSTER, tasks=[job_id])
+            task = await self._get_task(job_id)
         except Exception as e:
             self._logger.error(f"Failed to describe task {job_id}, assuming invalid ID: {e}")
             raise web.HTTPBadRequest(text=f"Invalid job ID {job_id}")
 
-        self._logger.debug(f"AWS describe tasks response {response}")
+        self._logger.debug(f"AWS task description {task}")
+
+        if task is None:
+            return self._get_missing_task_details(job_id)
+
+        self._missing_since.pop(job_id)
+
+        if task.get("lastStatus") == "STOPPED":
+            self._logger.warn(f"Task {job_id} is stopped: {task.get('stoppedReason')}")
+            return JobDetails(failed=True)
 
         try:
-            host_ip = response["tasks"][0]["containers"][0]["networkInterfaces"][0]["privateIpv4Address"]
+            host_ip = task["containers"][0]["networkInterfaces"][0]["privateIpv4Address"]
         except (KeyError, IndexError) as e:
             self._logger.warn(f"Cannot get host_ip from AWS response {e}")
             return JobDetails()
@@ -71,15 +170,118 @@ class AwsAllocator(JobAllocator):
         if not await self._check_brayns_responds(host_ip):
             return JobDetails()
 
+        # Warm tasks run Brayns before their bucket is mounted.
+        if task.get("startedBy") == WARM_POOL_STARTED_BY and not await self._is_mounted(job_id):
+            self._logger.info(f"Task {job_id} is mounting its bucket")
+            return JobDetails()
+
         return JobDetails(host=host_ip)
 
-    async def _run_aws_task(self, project: str) -> str:
-        bucket_path = f"{AWS_BUCKET_NAME}:/{project}"
-        root_folder = f"{AWS_BUCKET_MOUNT_PATH}/{project}"
+    def _get_missing_task_details(self, job_id: str) -> JobDetails:
+        # describe_tasks is eventually consistent, a task just started by
+        # run_task can be missing for a while.
+        now = time.monotonic()
+        since = self._missing_since.get(job_id)
 
-        self._logger.info(f"Starting new ECS task mounting {bucket_path} at {root_folder}")
+        if since is None:
+            since = now
+            self._missing_since.put(job_id, since)
+
+        if now - since < AWS_TASK_MISSING_GRACE_SECONDS:
+            self._logger.info(f"Task {job_id} not found in ECS yet")
+            return JobDetails()
+
+        self._logger.warn(f"Task {job_id} not found in ECS for {AWS_TASK_MISSING_GRACE_SECONDS}s")
+        return JobDetails(failed=True)
+
+    async def _is_assigned(self, job_id: str) -> bool:
+        return await self._exists(_get_assignment_key(job_id))
 
-        response = self._ecs_client.run_task(
+    async def _is_mounted(self, job_id: str) -> bool:
+        # Written by mount_s3.sh once the bucket is mounted, idle tasks have
+        # nothing to mount.
+        if await self._exists(_get_mounted_key(job_id)):
+            return True
+
+        return not await self._is_assigned(job_id)
+
+    async def _exists(self, key: str) -> bool:
+        try:
+            await self._executor.run(self._s3_client.head_object, Bucket=AWS_ASSIGNMENT_BUCKET, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+
+        return True
+
+    async def _delete_assignment(self, job_id: str) -> None:
+        # Missing for cold and idle jobs, S3 deletes are idempotent.
+        try:
+            await self._executor.run(
+                self._s3_client.delete_objects,
+                Bucket=AWS_ASSIGNMENT_BUCKET,
+                Delete={"Objects": [{"Key": _get_assignment_key(job_id)}, {"Key": _get_mounted_key(job_id)}]},
+            )
+        except Exception as e:
+            self._logger.warning(f"Failed to delete assignment of task {job_id}: {e}")
+
+    async def _get_task(self, job_id: str) -> dict[str, Any] | None:
+        task = self._tasks.get(job_id)
+
+        if task is not None:
+            DESCRIBE_LOOKUPS.inc("cache")
+            return task
+
+        DESCRIBE_LOOKUPS.inc("ecs")
+
+        with span("ecs", operation="describe_tasks"):
+            return await self._describer.get(job_id)
+
+    async def _describe_tasks(self, job_ids: list[str]) -> dict[str, dict[str, Any] | Exception]:
+        self._logger.info(f"Describing {len(job_ids)} ECS tasks")
+
+        DESCRIBE_CALLS.inc()
+
+        try:
+            response = await self._executor.run(self._ecs_client.describe_tasks, cluster=AWS_CLUSTER, tasks=job_ids)
+        except Exception as e:
+            if len(job_ids) == 1:
+                return {job_ids[0]: e}
+            # One malformed ID fails the whole call, isolate it.
+            self._logger.warning(f"Batched describe_tasks failed, retrying tasks one by one: {e}")
+            results = await asyncio.gather(*(self._describe_tasks([job_id]) for job_id in job_ids))
+            return {job_id: task for result in results for job_id, task in result.items()}
+
+        self._logger.debug(f"AWS describe tasks response {response}")
+
+        tasks = dict[str, dict[str, Any] | Exception]()
+
+        for task in response.get("tasks", []):
+            job_id = task["taskArn"].rsplit("/", 1)[-1]
+            self._tasks.put(job_id, task)
+            tasks[job_id] = task
+
+        return tasks
+
+    def _get_mount(self, payload: dict[str, Any]) -> tuple[str, str]:
+        project = payload.get("project")
+
+        if project is None:
+            raise web.HTTPBadRequest(text="No projects provided in request body")
+
+        self._logger.info(f"Project name {project}")
+
+        return f"{AWS_BUCKET_NAME}:/{project}", f"{AWS_BUCKET_MOUNT_PATH}/{project}"
+
+    async def _run_aws_task(self, environment: list[dict[str, str]], started_by: str | None = None) -> str:
+        options = {} if started_by is None else {"startedBy": started_by}
+
+        # A timed out run_task would still start a task that no job tracks, the
+        # call is bounded by the timeouts of the client instead.
+        response = await self._executor.run_to_completion(
+            self._ecs_client.run_task,
+            **options,
             cluster=AWS_CLUSTER,
             taskDefinition=AWS_TASK_DEFINITION,
             enableExecuteCommand=True,
@@ -101,10 +303,7 @@ class AwsAllocator(JobAllocator):
                 "containerOverrides": [
                     {
                         "name": "viz_brayns",
-                        "environment": [
-                            {"name": "S3_BUCKET_PATH", "value": bucket_path},
-                            {"name": "FUSE_MOUNT_POINT", "value": root_folder},
-                        ],
+                        "environment": environment,
                     }
                 ]
             },
@@ -130,8 +329,17 @@ class AwsAllocator(JobAllocator):
 
     async def _check_brayns_responds(self, host_ip: str) -> bool:
         try:
-            response = await self._session.get(f"http://{host_ip}:5000/healthz")
+            with span("brayns_probe"):
+                response = await self._session.get(f"http://{host_ip}:5000/healthz")
             return response.ok
         except Exception as e:
             self._logger.warn(f"Brayns healthcheck failed: {e}")
             return False
+
+
+def _get_assignment_key(job_id: str) -> str:
+    return f"{AWS_ASSIGNMENT_PREFIX}/{job_id}"
+
+
+def _get_mounted_key(job_id: str) -> str:
+    return f"{AWS_ASSIGNMENT_PREFIX}/{job_id}.mounted"
@@ -0,0 +1,67 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+BatchFetch = Callable[[list[K]], Awaitable[dict[K, V | Exception]]]
+
+
+class RequestBatcher(Generic[K, V]):
+    """Coalesce lookups arriving within a short window into a single fetch.
+
+    Keys missing from the fetch result resolve to None, exceptions in the
+    result are raised to the callers waiting on the matching key.
+    """
+
+    def __init__(self, fetch: BatchFetch[K, V], window: float, max_size: int) -> None:
+        self._fetch = fetch
+        self._window = window
+        self._max_size = max_size
+        self._waiting = dict[K, asyncio.Future[V | None]]()
+        self._timer: asyncio.TimerHandle | None = None
+        self._batches = set[asyncio.Task[None]]()
+
+    async def get(self, key: K) -> V | None:
+        future = self._waiting.get(key)
+
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[key] = future
+
+            if len(self._waiting) >= self._max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self._window, self._flush)
+
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        waiting, self._waiting = self._waiting, {}
+
+        task = asyncio.create_task(self._run(waiting))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _run(self, waiting: dict[K, asyncio.Future[V | None]]) -> None:
+        try:
+            results = await self._fetch(list(waiting))
+        except Exception as e:
+            for future in waiting.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in waiting.items():
+            if future.done():
+                continue
+            result = results.get(key)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
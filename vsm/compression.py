@@ -0,0 +1,143 @@
+import zlib
+from dataclasses import dataclass
+
+from aiohttp import WSMsgType, web
+
+from .metrics import Counter
+from .settings import PROXY_COMPRESS_BINARY_MIN_SIZE, PROXY_COMPRESS_TEXT_MIN_SIZE
+
+COMPRESSED = "compressed"
+SMALL = "small"
+PRECOMPRESSED = "precompressed"
+NOT_NEGOTIATED = "not_negotiated"
+
+COMPRESSION_BYTES = Counter(
+    "vsm_proxy_compression_bytes_total", "Payload bytes sent to clients by compression decision", ("decision",)
+)
+COMPRESSION_SAMPLE_BYTES = Counter(
+    "vsm_proxy_compression_sample_bytes_total",
+    "Payload bytes before (in) and after (out) deflate of the sampled compressed messages",
+    ("stage",),
+)
+
+# One compressed message out of SAMPLE_RATE is deflated again on the side to
+# estimate the compression ratio, aiohttp does not expose the wire size.
+SAMPLE_RATE = 50
+
+# Magic numbers of formats that deflate cannot shrink further.
+SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF8",
+    b"\x1f\x8b",  # gzip
+    b"PK\x03\x04",  # zip
+    b"\x28\xb5\x2f\xfd",  # zstd
+)
+
+
+def _has_signature(head: bytes) -> bool:
+    return head.startswith(SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+def is_precompressed(data: bytes) -> bool:
+    if _has_signature(data[:12]):
+        return True
+
+    # Brayns binary replies start with the size of their JSON header (uint32 LE).
+    if data[4:5] == b"{":
+        offset = 4 + int.from_bytes(data[:4], "little")
+        return _has_signature(data[offset : offset + 12])
+
+    return False
+
+
+@dataclass
+class CompressionPolicy:
+    text_min_size: int = PROXY_COMPRESS_TEXT_MIN_SIZE
+    binary_min_size: int = PROXY_COMPRESS_BINARY_MIN_SIZE
+
+    def decide(self, message_type: WSMsgType, data: str | bytes) -> str:
+        if message_type == WSMsgType.TEXT:
+            return COMPRESSED if len(data) >= self.text_min_size else SMALL
+
+        if len(data) < self.binary_min_size:
+            return SMALL
+
+        assert isinstance(data, bytes)
+
+        return PRECOMPRESSED if is_precompressed(data) else COMPRESSED
+
+
+class CompressingSender:
+    """Send data messages to a client, compressing only the ones the policy selects."""
+
+    def __init__(self, ws: web.WebSocketResponse, policy: CompressionPolicy) -> None:
+        self._ws = ws
+        self._policy = policy
+        self._compressed = 0
+        self._sample_in = 0
+        self._sample_out = 0
+
+    @property
+    def ratio(self) -> float | None:
+        """Estimated compressed / original size of the compressed messages."""
+        return self._sample_out / self._sample_in if self._sample_in else None
+
+    async def send(self, message_type: WSMsgType, data: str | bytes) -> None:
+        # The client did not offer permessage-deflate, nothing is compressed.
+        if not self._ws.compress:
+            COMPRESSION_BYTES.inc(NOT_NEGOTIATED, value=len(data))
+            await self._send(message_type, data)
+            return
+
+        decision = self._policy.decide(message_type, data)
+        COMPRESSION_BYTES.inc(decision, value=len(data))
+
+        if decision == COMPRESSED:
+            self._sample(data)
+            await self._send(message_type, data)
+            return
+
+        await self._send_uncompressed(message_type, data)
+
+    async def _send(self, message_type: WSMsgType, data: str | bytes) -> None:
+        if message_type == WSMsgType.TEXT:
+            assert isinstance(data, str)
+            await self._ws.send_str(data)
+            return
+
+        assert isinstance(data, bytes)
+        await self._ws.send_bytes(data)
+
+    async def _send_uncompressed(self, message_type: WSMsgType, data: str | bytes) -> None:
+        # aiohttp has no per message opt-out once deflate is negotiated, the
+        # writer setting is switched off around the send. Uncompressed frames
+        # leave the deflate context untouched (RFC 7692). The aiohttp range in
+        # pyproject.toml is the one tests/test_compression.py passes with.
+        writer = self._ws._writer
+        assert writer is not None
+
+        negotiated = writer.compress
+        writer.compress = 0
+
+        try:
+            await self._send(message_type, data)
+        finally:
+            writer.compress = negotiated
+
+    def _sample(self, data: str | bytes) -> None:
+        self._compressed += 1
+
+        if self._compressed % SAMPLE_RATE != 1:
+            return
+
+        payload = data.encode() if isinstance(data, str) else data
+        # Same settings as the aiohttp compressor but without context takeover,
+        # so the estimate errs on the pessimistic side.
+        compressor = zlib.compressobj(zlib.Z_BEST_SPEED, wbits=-zlib.MAX_WBITS)
+        size = len(compressor.compress(payload)) + len(compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+        self._sample_in += len(payload)
+        self._sample_out += size
+        COMPRESSION_SAMPLE_BYTES.inc("in", value=len(payload))
+        COMPRESSION_SAMPLE_BYTES.inc("out", value=size)
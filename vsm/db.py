@@ -1,13 +1,24 @@
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Protocol
-
+import base64
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from enum import StrEnum
+from typing import Any, Protocol
 
 JOB_ID = "job_id"
 USER_ID = "user_id"
 START_TIME = "start_time"
 END_TIME = "end_time"
 HOSTNAME = "hostname"
+STATE = "state"
+LAST_ACTIVITY = "last_activity"
+
+
+class JobState(StrEnum):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
 
 
 @dataclass
@@ -17,18 +28,63 @@ class Job:
     start_time: datetime
     end_time: datetime
     host: str = ""
+    state: JobState = JobState.PENDING
+    last_activity: datetime | None = None
+
+
+@dataclass
+class JobPage:
+    jobs: list[Job] = field(default_factory=list)
+    cursor: str | None = None
+
+
+def encode_cursor(data: dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
 
+def decode_cursor(cursor: str, fields: dict[str, type] | None = None) -> dict[str, Any]:
+    """Raise ValueError if the cursor was not produced by encode_cursor or lacks one of the typed fields."""
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    for name, field_type in (fields or {}).items():
+        if not isinstance(data.get(name), field_type):
+            raise ValueError(f"Invalid cursor field {name}")
+    return data
 
-def parse_job(row: dict[str, str]) -> Job:
+
+def parse_time(value: str | datetime) -> datetime:
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    # Naive values were written before times were stored in UTC.
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def parse_job(row: Mapping[str, Any]) -> Job:
     return Job(
         id=row[JOB_ID],
         user=row[USER_ID],
-        start_time=datetime.fromisoformat(row[START_TIME]),
-        end_time=datetime.fromisoformat(row[END_TIME]),
+        start_time=parse_time(row[START_TIME]),
+        end_time=parse_time(row[END_TIME]),
         host=row[HOSTNAME],
+        state=parse_state(row.get(STATE), row[HOSTNAME]),
+        last_activity=parse_optional_time(row.get(LAST_ACTIVITY)),
     )
 
 
+def parse_optional_time(value: str | datetime | None) -> datetime | None:
+    return None if value is None else parse_time(value)
+
+
+def parse_state(value: str | None, host: str) -> JobState:
+    # Rows written before job states existed only have a host once ready.
+    if value is None:
+        return JobState.READY if host else JobState.PENDING
+    return JobState(value)
+
+
 class DbConnection(Protocol):
     async def __aenter__(self):
         return self
@@ -40,17 +96,66 @@ class DbConnection(Protocol):
 
     async def recreate_table(self) -> None: ...
 
+    async def upgrade_table(self) -> None: ...
+
     async def get_jobs(self) -> list[Job]: ...
 
     async def get_job(self, id: str) -> Job | None: ...
 
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]: ...
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]: ...
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        """Ready jobs without activity (or started if none) since before, least recent first."""
+        ...
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        """Jobs of user started in [start, end), newest first."""
+        ...
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int: ...
+
     async def insert_job(self, job: Job) -> None: ...
 
-    async def update_job(self, id: str, host: str) -> None: ...
+    async def insert_jobs(self, jobs: list[Job]) -> None: ...
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None: ...
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        """Move the last activity of the existing jobs forward to time."""
+        ...
+
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        """Move the end time and last activity of the job forward."""
+        ...
 
     async def delete_job(self, id: str) -> None: ...
 
+    async def delete_jobs(self, ids: list[str]) -> None: ...
+
+
+class JobListener(Protocol):
+    def job_changed(self, id: str, host: str | None) -> None: ...
+
+
+class JobSubscription(Protocol):
+    async def is_alive(self) -> bool: ...
+
+    async def close(self) -> None: ...
+
 
 class DbConnector(Protocol):
     async def connect(self) -> DbConnection: ...
 
+    async def listen(self, listener: JobListener) -> JobSubscription | None: ...
+
+    async def close(self) -> None: ...
@@ -1,68 +1,513 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, TypeVar
+
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
 
-from .db import DbConnection, Job, DbConnector, parse_job
-from .settings import DBD_TABLE_NAME
+from .db import (
+    DbConnection,
+    DbConnector,
+    Job,
+    JobListener,
+    JobPage,
+    JobState,
+    JobSubscription,
+    decode_cursor,
+    encode_cursor,
+    parse_job,
+)
+from .executor import BlockingExecutor
+from .settings import (
+    DBD_CALL_TIMEOUT_SECONDS,
+    DBD_EXPIRY_INDEX,
+    DBD_IDLE_INDEX,
+    DBD_MAX_CONCURRENCY,
+    DBD_TABLE_NAME,
+    DBD_USER_INDEX,
+)
 
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_MAX_ATTEMPTS = 5
 
-from boto3.dynamodb.types import TypeDeserializer
+# Constant partition key of the expiry and idle GSIs (sort key is end_time or
+# last_activity), DynamoDB has no other way to run a range query across the
+# whole table.
+EXPIRY_PARTITION = "expiry_partition"
+EXPIRY_PARTITION_VALUE = "jobs"
+
+# Tag of the table holding the version of the last backfill applied.
+SCHEMA_VERSION_TAG = "vsm-schema-version"
+
+DESERIALIZER = TypeDeserializer()
+
+T = TypeVar("T")
 
 
 def dynamo_obj_to_python_obj(dynamo_obj: dict) -> dict:
-    deserializer = TypeDeserializer()
-    return {k: deserializer.deserialize(v) for k, v in dynamo_obj.items()}
+    return {k: DESERIALIZER.deserialize(v) for k, v in dynamo_obj.items()}
+
+
+def compose_key(id: str) -> dict[str, Any]:
+    return {"job_id": {"S": id}}
+
+
+def get_page_key_names() -> list[str]:
+    # Pagination of a GSI query needs the index keys on top of the table key.
+    return ["job_id", "user_id", "start_time"] if DBD_USER_INDEX else ["job_id"]
+
+
+def parse_page_key(cursor: str) -> dict[str, Any]:
+    key = decode_cursor(cursor, dict.fromkeys(get_page_key_names(), dict))
+    if len(key) != len(get_page_key_names()):
+        raise ValueError("Invalid cursor keys")
+    for name, value in key.items():
+        if not isinstance(value.get("S"), str) or len(value) != 1:
+            raise ValueError(f"Invalid cursor key {name}")
+    return key
+
+
+def compose_page_key(item: dict[str, Any]) -> dict[str, Any]:
+    return {name: item[name] for name in get_page_key_names()}
+
+
+def compose_item(job: Job) -> dict[str, Any]:
+    return {
+        "job_id": {"S": job.id},
+        "user_id": {"S": job.user},
+        "start_time": {"S": str(job.start_time)},
+        "end_time": {"S": str(job.end_time)},
+        "hostname": {"S": job.host},
+        "state": {"S": job.state},
+        EXPIRY_PARTITION: {"S": EXPIRY_PARTITION_VALUE},
+        # Jobs never used are idle from their start, the idle GSI only holds
+        # items with the attribute.
+        "last_activity": {"S": str(job.last_activity or job.start_time)},
+    }
+
+
+def chunk(items: list[T], size: int) -> list[list[T]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
 
 
 class DynamoConnection(DbConnection):
-    def __init__(self, client) -> None:
+    def __init__(self, client, executor: BlockingExecutor) -> None:
         self.client = client
+        self._executor = executor
 
     async def close(self) -> None:
         pass
 
+    async def recreate_table(self) -> None:
+        pass
+
+    async def upgrade_table(self) -> None:
+        # Attributes added to items after the first version, each backfill is a
+        # full scan so the version applied is kept in a tag of the table.
+        backfills = [
+            # Items written before the expiry GSI existed are not in the index.
+            (1, EXPIRY_PARTITION, {"S": EXPIRY_PARTITION_VALUE}),
+            # Jobs running before activity was recorded are not stopped as idle right away.
+            (2, "last_activity", {"S": str(datetime.now(timezone.utc))}),
+        ]
+
+        table = await self._executor.run(self.client.describe_table, TableName=DBD_TABLE_NAME)
+        arn = table["Table"]["TableArn"]
+
+        response = await self._executor.run(self.client.list_tags_of_resource, ResourceArn=arn)
+        tags = {tag["Key"]: tag["Value"] for tag in response.get("Tags", [])}
+        current = int(tags.get(SCHEMA_VERSION_TAG, "0"))
+
+        for version, name, value in backfills:
+            if version <= current:
+                continue
+            await self._backfill(name, value)
+            await self._executor.run(
+                self.client.tag_resource,
+                ResourceArn=arn,
+                Tags=[{"Key": SCHEMA_VERSION_TAG, "Value": str(version)}],
+            )
+
     async def get_jobs(self) -> list[Job]:
-        jobs = self.client.scan(TableName=DBD_TABLE_NAME)["Items"]
-        return [parse_job(dynamo_obj_to_python_obj(job)) for job in jobs]
+        jobs = list[Job]()
+        kwargs: dict[str, Any] = {"TableName": DBD_TABLE_NAME}
+
+        while True:
+            response = await self._executor.run(self.client.scan, **kwargs)
+            jobs.extend(parse_job(dynamo_obj_to_python_obj(item)) for item in response["Items"])
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                return jobs
+
+            kwargs["ExclusiveStartKey"] = last_key
 
     async def get_job(self, id: str) -> Job | None:
-        job = dynamo_obj_to_python_obj(self.client.get_item(
+        response = await self._executor.run(
+            self.client.get_item,
             TableName=DBD_TABLE_NAME,
-            Key={'job_id': {'S': id}},
-        )["Item"])
-        return parse_job(job)
+            Key=compose_key(id),
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        return parse_job(dynamo_obj_to_python_obj(item))
 
-    async def insert_job(self, job: Job) -> None:
-        self.client.put_item(
-            TableName=DBD_TABLE_NAME,
-            Item={
-                'job_id': {'S': job.id},
-                'user_id': {'S': job.user},
-                'start_time': {'S': str(job.start_time)},
-                'end_time': {'S': str(job.end_time)},
-                'hostname': {'S': job.host},
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]:
+        # Batch requests with duplicate keys are rejected.
+        chunks = chunk(list(dict.fromkeys(ids)), BATCH_GET_SIZE)
+        results = await asyncio.gather(*(self._batch_get(ids) for ids in chunks))
+        return [job for jobs in results for job in jobs]
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]:
+        kwargs: dict[str, Any] = {
+            "TableName": DBD_TABLE_NAME,
+            "ExpressionAttributeValues": {":now": {"S": str(now)}},
+        }
+
+        if DBD_EXPIRY_INDEX:
+            kwargs["IndexName"] = DBD_EXPIRY_INDEX
+            kwargs["KeyConditionExpression"] = f"{EXPIRY_PARTITION} = :partition AND end_time <= :now"
+            kwargs["ExpressionAttributeValues"][":partition"] = {"S": EXPIRY_PARTITION_VALUE}
+            operation = self.client.query
+        else:
+            kwargs["FilterExpression"] = "end_time <= :now"
+            operation = self.client.scan
+
+        jobs = list[Job]()
+
+        while len(jobs) < limit:
+            kwargs["Limit"] = limit - len(jobs) if DBD_EXPIRY_INDEX else max(limit, 1000)
+            response = await self._executor.run(operation, **kwargs)
+            jobs.extend(parse_job(dynamo_obj_to_python_obj(item)) for item in response["Items"])
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                break
+
+            kwargs["ExclusiveStartKey"] = last_key
+
+        return jobs[:limit]
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        kwargs: dict[str, Any] = {
+            "TableName": DBD_TABLE_NAME,
+            "FilterExpression": "#state = :ready",
+            "ExpressionAttributeNames": {"#state": "state"},
+            "ExpressionAttributeValues": {
+                ":ready": {"S": JobState.READY},
+                ":before": {"S": str(before)},
             },
-        )
+        }
+
+        if DBD_IDLE_INDEX:
+            kwargs["IndexName"] = DBD_IDLE_INDEX
+            kwargs["KeyConditionExpression"] = f"{EXPIRY_PARTITION} = :partition AND last_activity < :before"
+            kwargs["ExpressionAttributeValues"][":partition"] = {"S": EXPIRY_PARTITION_VALUE}
+            operation = self.client.query
+        else:
+            # Items of older versions may lack the attribute until the backfill.
+            kwargs["FilterExpression"] += (
+                " AND (last_activity < :before OR (attribute_not_exists(last_activity) AND start_time < :before))"
+            )
+            operation = self.client.scan
+
+        jobs = list[Job]()
+
+        while len(jobs) < limit:
+            kwargs["Limit"] = limit - len(jobs) if DBD_IDLE_INDEX else max(limit, 1000)
+            response = await self._executor.run(operation, **kwargs)
+            jobs.extend(parse_job(dynamo_obj_to_python_obj(item)) for item in response["Items"])
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                break
+
+            kwargs["ExclusiveStartKey"] = last_key
+
+        # The index returns the least recently active first, a scan has no order.
+        jobs.sort(key=lambda job: job.last_activity or job.start_time)
+        return jobs[:limit]
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        values = {":user": {"S": user}}
+        conditions = list[str]()
+        filters = list[str]()
+        kwargs: dict[str, Any] = {"TableName": DBD_TABLE_NAME}
+
+        # A key condition allows a single range on the sort key, the end
+        # bound of BETWEEN is inclusive and excluded below.
+        if start is not None and end is not None:
+            conditions.append("start_time BETWEEN :start AND :end")
+        elif start is not None:
+            conditions.append("start_time >= :start")
+        elif end is not None:
+            conditions.append("start_time < :end")
+
+        if start is not None:
+            values[":start"] = {"S": str(start)}
+
+        if end is not None:
+            values[":end"] = {"S": str(end)}
 
-    async def update_job(self, id: str, host: str) -> None:
-        self.client.update_item(
+        if state is not None:
+            filters.append("#state = :state")
+            values[":state"] = {"S": state}
+            kwargs["ExpressionAttributeNames"] = {"#state": "state"}
+
+        if DBD_USER_INDEX:
+            kwargs["IndexName"] = DBD_USER_INDEX
+            kwargs["KeyConditionExpression"] = " AND ".join(["user_id = :user", *conditions])
+            kwargs["ScanIndexForward"] = False
+            operation = self.client.query
+        else:
+            # Without the index the scan is not ordered by start time.
+            filters = ["user_id = :user", *conditions, *filters]
+            operation = self.client.scan
+
+        if filters:
+            kwargs["FilterExpression"] = " AND ".join(filters)
+
+        kwargs["ExpressionAttributeValues"] = values
+
+        if cursor is not None:
+            kwargs["ExclusiveStartKey"] = parse_page_key(cursor)
+
+        jobs = list[Job]()
+
+        while True:
+            kwargs["Limit"] = limit - len(jobs) if DBD_USER_INDEX else max(limit, 1000)
+            response = await self._executor.run(operation, **kwargs)
+
+            for item in response["Items"]:
+                job = parse_job(dynamo_obj_to_python_obj(item))
+
+                if end is not None and job.start_time >= end:
+                    continue
+
+                jobs.append(job)
+
+                if len(jobs) == limit:
+                    return JobPage(jobs, encode_cursor(compose_page_key(item)))
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                return JobPage(jobs)
+
+            kwargs["ExclusiveStartKey"] = last_key
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int:
+        kwargs: dict[str, Any] = {
+            "TableName": DBD_TABLE_NAME,
+            "Select": "COUNT",
+            "ExpressionAttributeNames": {"#state": "state"},
+            "ExpressionAttributeValues": {
+                ":user": {"S": user},
+                ":now": {"S": str(now)},
+                ":failed": {"S": JobState.FAILED},
+            },
+        }
+
+        filters = "end_time > :now AND #state <> :failed"
+
+        if DBD_USER_INDEX:
+            kwargs["IndexName"] = DBD_USER_INDEX
+            kwargs["KeyConditionExpression"] = "user_id = :user"
+            kwargs["FilterExpression"] = filters
+            operation = self.client.query
+        else:
+            kwargs["FilterExpression"] = f"user_id = :user AND {filters}"
+            operation = self.client.scan
+
+        count = 0
+
+        while True:
+            response = await self._executor.run(operation, **kwargs)
+            count += response["Count"]
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                return count
+
+            kwargs["ExclusiveStartKey"] = last_key
+
+    async def insert_job(self, job: Job) -> None:
+        await self._executor.run(
+            self.client.put_item,
             TableName=DBD_TABLE_NAME,
-            Key={'job_id': {'S': id}},
-            UpdateExpression="SET hostname = :hostname",
-            ExpressionAttributeValues={
-                ':hostname': {'S': host},
-            }
+            Item=compose_item(job),
         )
 
+    async def insert_jobs(self, jobs: list[Job]) -> None:
+        # Batch requests with duplicate keys are rejected, the last job wins.
+        unique = {job.id: job for job in jobs}
+        requests = [{"PutRequest": {"Item": compose_item(job)}} for job in unique.values()]
+        await asyncio.gather(*(self._batch_write(batch) for batch in chunk(requests, BATCH_WRITE_SIZE)))
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None:
+        # Without the condition, updating a deleted job creates a partial item.
+        try:
+            await self._executor.run(
+                self.client.update_item,
+                TableName=DBD_TABLE_NAME,
+                Key=compose_key(id),
+                UpdateExpression="SET hostname = :hostname, #state = :state",
+                ConditionExpression="attribute_exists(job_id)",
+                ExpressionAttributeNames={"#state": "state"},
+                ExpressionAttributeValues={
+                    ":hostname": {"S": host},
+                    ":state": {"S": state},
+                },
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        await asyncio.gather(*(self._record_activity(id, time) for id in ids))
+
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        # Both only move forward in practice (now + duration and now), one
+        # conditional update per attribute is not worth it.
+        try:
+            await self._executor.run(
+                self.client.update_item,
+                TableName=DBD_TABLE_NAME,
+                Key=compose_key(id),
+                UpdateExpression="SET end_time = :end_time, last_activity = :time",
+                ConditionExpression="attribute_exists(job_id)",
+                ExpressionAttributeValues={
+                    ":end_time": {"S": str(end_time)},
+                    ":time": {"S": str(time)},
+                },
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
     async def delete_job(self, id: str) -> None:
-        self.client.delete_item(
+        await self._executor.run(
+            self.client.delete_item,
             TableName=DBD_TABLE_NAME,
-            Key={'job_id': {'S': id}}
+            Key=compose_key(id),
         )
 
+    async def delete_jobs(self, ids: list[str]) -> None:
+        requests = [{"DeleteRequest": {"Key": compose_key(id)}} for id in dict.fromkeys(ids)]
+        await asyncio.gather(*(self._batch_write(batch) for batch in chunk(requests, BATCH_WRITE_SIZE)))
+
+    async def _record_activity(self, id: str, time: datetime) -> None:
+        try:
+            await self._executor.run(
+                self.client.update_item,
+                TableName=DBD_TABLE_NAME,
+                Key=compose_key(id),
+                UpdateExpression="SET last_activity = :time",
+                ConditionExpression=(
+                    "attribute_exists(job_id) AND (attribute_not_exists(last_activity) OR last_activity < :time)"
+                ),
+                ExpressionAttributeValues={":time": {"S": str(time)}},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            # Deleted job or more recent activity already recorded.
+            pass
+
+    async def _backfill(self, name: str, value: dict[str, Any]) -> None:
+        """Set the attribute on the items that do not have it yet (a full scan)."""
+        kwargs: dict[str, Any] = {
+            "TableName": DBD_TABLE_NAME,
+            "FilterExpression": "attribute_not_exists(#name)",
+            "ProjectionExpression": "job_id",
+            "ExpressionAttributeNames": {"#name": name},
+        }
+
+        while True:
+            response = await self._executor.run(self.client.scan, **kwargs)
+            ids = [item["job_id"]["S"] for item in response["Items"]]
+            await asyncio.gather(*(self._set_missing(id, name, value) for id in ids))
+
+            last_key = response.get("LastEvaluatedKey")
+
+            if last_key is None:
+                return
+
+            kwargs["ExclusiveStartKey"] = last_key
+
+    async def _set_missing(self, id: str, name: str, value: dict[str, Any]) -> None:
+        try:
+            await self._executor.run(
+                self.client.update_item,
+                TableName=DBD_TABLE_NAME,
+                Key=compose_key(id),
+                UpdateExpression="SET #name = :value",
+                ConditionExpression="attribute_exists(job_id) AND attribute_not_exists(#name)",
+                ExpressionAttributeNames={"#name": name},
+                ExpressionAttributeValues={":value": value},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            # Deleted or written meanwhile.
+            pass
+
+    async def _batch_get(self, ids: list[str]) -> list[Job]:
+        jobs = list[Job]()
+        request = {DBD_TABLE_NAME: {"Keys": [compose_key(id) for id in ids]}}
+
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            response = await self._executor.run(self.client.batch_get_item, RequestItems=request)
+            items = response.get("Responses", {}).get(DBD_TABLE_NAME, [])
+            jobs.extend(parse_job(dynamo_obj_to_python_obj(item)) for item in items)
+
+            request = response.get("UnprocessedKeys")
+
+            if not request:
+                return jobs
+
+            await asyncio.sleep(0.05 * 2**attempt)
+
+        raise RuntimeError(f"DynamoDB batch get left unprocessed keys after {BATCH_MAX_ATTEMPTS} attempts")
+
+    async def _batch_write(self, requests: list[dict[str, Any]]) -> None:
+        request = {DBD_TABLE_NAME: requests}
+
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            response = await self._executor.run(self.client.batch_write_item, RequestItems=request)
+
+            request = response.get("UnprocessedItems")
+
+            if not request:
+                return
+
+            await asyncio.sleep(0.05 * 2**attempt)
+
+        raise RuntimeError(f"DynamoDB batch write left unprocessed items after {BATCH_MAX_ATTEMPTS} attempts")
+
 
 class DynamodbClient(DbConnector):
     def __init__(self):
-        self.client = boto3.client("dynamodb")
+        self.client = boto3.client(
+            "dynamodb",
+            config=Config(max_pool_connections=DBD_MAX_CONCURRENCY),
+        )
+        self._executor = BlockingExecutor(DBD_MAX_CONCURRENCY, DBD_CALL_TIMEOUT_SECONDS, "dynamodb")
 
     async def connect(self) -> DbConnection:
-        return DynamoConnection(self.client)
+        return DynamoConnection(self.client, self._executor)
+
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        return None
 
+    async def close(self) -> None:
+        self._executor.close()
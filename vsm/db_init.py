@@ -1,15 +1,59 @@
-from vsm import settings
-
 from vsm.db import DbConnector
 from vsm.db_dynanamo import DynamodbClient
-from vsm.db_pgsql import PsqlConnector
-from vsm.settings import DB_HOST, DB_USERNAME, DB_PASSWORD, DB_NAME
+from vsm.db_local import MemoryConnector, SqliteConnector
+from vsm.db_pgsql import PsqlConnector, PsqlPoolConnector
+from vsm.db_traced import TracedConnector
+from vsm.settings import (
+    DB_HOST,
+    DB_NAME,
+    DB_PASSWORD,
+    DB_POOL,
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    DB_POOL_HEALTH_CHECK,
+    DB_POOL_MAX_IDLE_SECONDS,
+    DB_POOL_MAX_QUERIES,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_SQLITE_PATH,
+    DB_TYPE,
+    DB_USERNAME,
+)
 
 
 def create_db_connector() -> DbConnector:
-    return PsqlConnector(
+    return TracedConnector(_create_connector())
+
+
+def _create_connector() -> DbConnector:
+    if DB_TYPE == "dynamodb":
+        return DynamodbClient()
+
+    if DB_TYPE == "sqlite":
+        return SqliteConnector(DB_SQLITE_PATH)
+
+    if DB_TYPE == "memory":
+        return MemoryConnector()
+
+    if DB_TYPE != "postgresql":
+        raise ValueError(f"Invalid DB engine {DB_TYPE}")
+
+    if not DB_POOL:
+        return PsqlConnector(
+            host=DB_HOST,
+            database=DB_NAME,
+            user=DB_USERNAME,
+            password=DB_PASSWORD,
+        )
+
+    return PsqlPoolConnector(
         host=DB_HOST,
         database=DB_NAME,
         user=DB_USERNAME,
         password=DB_PASSWORD,
-    ) if settings.DB_TYPE == "postgresql" else DynamodbClient()
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+        max_queries=DB_POOL_MAX_QUERIES,
+        max_idle_seconds=DB_POOL_MAX_IDLE_SECONDS,
+        health_check=DB_POOL_HEALTH_CHECK,
+    )
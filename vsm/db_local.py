@@ -0,0 +1,495 @@
+import asyncio
+import json
+import sqlite3
+from bisect import bisect_left, insort
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import Any
+
+from .db import (
+    END_TIME,
+    HOSTNAME,
+    JOB_ID,
+    LAST_ACTIVITY,
+    START_TIME,
+    STATE,
+    USER_ID,
+    DbConnection,
+    DbConnector,
+    Job,
+    JobListener,
+    JobPage,
+    JobState,
+    JobSubscription,
+    decode_cursor,
+    encode_cursor,
+    parse_job,
+    parse_time,
+)
+from .executor import BlockingExecutor
+
+TABLE = "jobs"
+
+COLUMNS = [JOB_ID, USER_ID, START_TIME, END_TIME, HOSTNAME, STATE, LAST_ACTIVITY]
+
+Key = tuple[datetime, str]
+
+
+def compose_cursor(job: Job) -> str:
+    return encode_cursor({START_TIME: job.start_time.isoformat(), JOB_ID: job.id})
+
+
+def parse_cursor(cursor: str) -> Key:
+    position = decode_cursor(cursor, {START_TIME: str, JOB_ID: str})
+    return parse_time(position[START_TIME]), position[JOB_ID]
+
+
+class MemoryStore:
+    """Jobs indexed by user and end time, shared by all connections of a connector."""
+
+    def __init__(self) -> None:
+        self.jobs = dict[str, Job]()
+        self.by_user = dict[str, list[Key]]()
+        self.by_end_time = list[Key]()
+        self.listeners = set[JobListener]()
+
+    def clear(self) -> None:
+        self.jobs.clear()
+        self.by_user.clear()
+        self.by_end_time.clear()
+
+    def add(self, job: Job) -> None:
+        self.remove(job.id)
+        self.jobs[job.id] = job
+        insort(self.by_user.setdefault(job.user, []), (job.start_time, job.id))
+        insort(self.by_end_time, (job.end_time, job.id))
+        self.notify(job.id, job.host)
+
+    def remove(self, id: str) -> None:
+        job = self.jobs.pop(id, None)
+
+        if job is None:
+            return
+
+        keys = self.by_user[job.user]
+        del keys[bisect_left(keys, (job.start_time, job.id))]
+
+        if not keys:
+            del self.by_user[job.user]
+
+        del self.by_end_time[bisect_left(self.by_end_time, (job.end_time, job.id))]
+
+        self.notify(id, None)
+
+    def set_end_time(self, job: Job, end_time: datetime) -> None:
+        del self.by_end_time[bisect_left(self.by_end_time, (job.end_time, job.id))]
+        job.end_time = end_time
+        insort(self.by_end_time, (job.end_time, job.id))
+
+    def notify(self, id: str, host: str | None) -> None:
+        for listener in self.listeners:
+            listener.job_changed(id, host)
+
+
+class MemorySubscription(JobSubscription):
+    def __init__(self, store: MemoryStore, listener: JobListener) -> None:
+        self._store = store
+        self._listener = listener
+
+    async def is_alive(self) -> bool:
+        return self._listener in self._store.listeners
+
+    async def close(self) -> None:
+        self._store.listeners.discard(self._listener)
+
+
+class MemoryConnection(DbConnection):
+    def __init__(self, store: MemoryStore) -> None:
+        self._store = store
+
+    async def close(self) -> None:
+        pass
+
+    async def recreate_table(self) -> None:
+        self._store.clear()
+
+    async def upgrade_table(self) -> None:
+        pass
+
+    async def get_jobs(self) -> list[Job]:
+        return [replace(job) for job in self._store.jobs.values()]
+
+    async def get_job(self, id: str) -> Job | None:
+        job = self._store.jobs.get(id)
+        if job is None:
+            return None
+        return replace(job)
+
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]:
+        return [replace(self._store.jobs[id]) for id in ids if id in self._store.jobs]
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]:
+        jobs = list[Job]()
+
+        for end_time, id in self._store.by_end_time:
+            if end_time > now or len(jobs) == limit:
+                break
+            jobs.append(replace(self._store.jobs[id]))
+
+        return jobs
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        jobs = [job for job in self._store.jobs.values() if job.state == JobState.READY and idle_since(job) < before]
+        jobs.sort(key=idle_since)
+        return [replace(job) for job in jobs[:limit]]
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        keys = self._store.by_user.get(user, [])
+        index = len(keys)
+
+        if cursor is not None:
+            index = bisect_left(keys, parse_cursor(cursor))
+
+        if end is not None:
+            index = min(index, bisect_left(keys, (end, "")))
+
+        jobs = list[Job]()
+
+        for start_time, id in reversed(keys[:index]):
+            if start is not None and start_time < start:
+                break
+
+            job = self._store.jobs[id]
+
+            if state is not None and job.state != state:
+                continue
+
+            if len(jobs) == limit:
+                return JobPage(jobs, compose_cursor(jobs[-1]))
+
+            jobs.append(replace(job))
+
+        return JobPage(jobs)
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int:
+        jobs = (self._store.jobs[id] for _, id in self._store.by_user.get(user, []))
+        return sum(1 for job in jobs if job.end_time > now and job.state != JobState.FAILED)
+
+    async def insert_job(self, job: Job) -> None:
+        if job.id in self._store.jobs:
+            raise ValueError(f"Duplicated job ID {job.id}")
+        self._store.add(replace(job))
+
+    async def insert_jobs(self, jobs: list[Job]) -> None:
+        for job in jobs:
+            await self.insert_job(job)
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None:
+        job = self._store.jobs.get(id)
+
+        if job is None:
+            return
+
+        changed = job.host != host
+        job.host = host
+        job.state = state
+
+        if changed:
+            self._store.notify(id, host)
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        for id in ids:
+            job = self._store.jobs.get(id)
+            if job is not None and (job.last_activity is None or job.last_activity < time):
+                job.last_activity = time
+
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        job = self._store.jobs.get(id)
+
+        if job is None:
+            return
+
+        if end_time > job.end_time:
+            self._store.set_end_time(job, end_time)
+
+        await self.record_activity([id], time)
+
+    async def delete_job(self, id: str) -> None:
+        self._store.remove(id)
+
+    async def delete_jobs(self, ids: list[str]) -> None:
+        for id in ids:
+            self._store.remove(id)
+
+
+class MemoryConnector(DbConnector):
+    """Process-local store, master and slave must run in the same process to share it."""
+
+    def __init__(self) -> None:
+        self._store = MemoryStore()
+
+    async def connect(self) -> DbConnection:
+        return MemoryConnection(self._store)
+
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        self._store.listeners.add(listener)
+        return MemorySubscription(self._store, listener)
+
+    async def close(self) -> None:
+        pass
+
+
+SQLITE_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        {JOB_ID} TEXT PRIMARY KEY,
+        {USER_ID} TEXT NOT NULL,
+        {START_TIME} TEXT NOT NULL,
+        {END_TIME} TEXT NOT NULL,
+        {HOSTNAME} TEXT NOT NULL,
+        {STATE} TEXT NOT NULL
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_{USER_ID}_{START_TIME}_idx ON {TABLE} ({USER_ID}, {START_TIME}, {JOB_ID})",
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_{END_TIME}_idx ON {TABLE} ({END_TIME})",
+]
+
+# Columns added after the table was created, with their definition.
+SQLITE_ADDED_COLUMNS = {LAST_ACTIVITY: "TEXT"}
+
+# Jobs never used count as idle from their start.
+IDLE_SINCE = f"COALESCE({LAST_ACTIVITY}, {START_TIME})"
+
+SQLITE_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_idle_idx ON {TABLE} ({IDLE_SINCE}) WHERE {STATE} = '{JobState.READY}'",
+]
+
+SELECT_JOBS = f"SELECT {', '.join(COLUMNS)} FROM {TABLE}"
+SELECT_JOB = f"{SELECT_JOBS} WHERE {JOB_ID} = ?"
+SELECT_JOBS_BY_IDS = f"{SELECT_JOBS} WHERE {JOB_ID} IN (SELECT value FROM json_each(?))"
+SELECT_EXPIRED_JOBS = f"{SELECT_JOBS} WHERE {END_TIME} <= ? ORDER BY {END_TIME} LIMIT ?"
+SELECT_IDLE_JOBS = f"""
+{SELECT_JOBS}
+WHERE {STATE} = '{JobState.READY}' AND {IDLE_SINCE} < ?
+ORDER BY {IDLE_SINCE}
+LIMIT ?
+"""
+SELECT_USER_JOBS = f"""
+{SELECT_JOBS}
+WHERE {USER_ID} = ?
+AND (? IS NULL OR {STATE} = ?)
+AND {START_TIME} >= COALESCE(?, '')
+AND ({START_TIME}, {JOB_ID}) < (COALESCE(?, '~'), COALESCE(?, ''))
+ORDER BY {START_TIME} DESC, {JOB_ID} DESC
+LIMIT ?
+"""
+COUNT_ACTIVE_JOBS = f"""
+SELECT COUNT(*) AS count FROM {TABLE}
+WHERE {USER_ID} = ? AND {END_TIME} > ? AND {STATE} <> '{JobState.FAILED}'
+"""
+INSERT_JOB = f"INSERT INTO {TABLE}({', '.join(COLUMNS)}) VALUES({', '.join('?' for _ in COLUMNS)})"
+UPDATE_JOB = f"UPDATE {TABLE} SET {HOSTNAME} = ?, {STATE} = ? WHERE {JOB_ID} = ?"
+RECORD_ACTIVITY = f"""
+UPDATE {TABLE} SET {LAST_ACTIVITY} = MAX(COALESCE({LAST_ACTIVITY}, ''), ?)
+WHERE {JOB_ID} IN (SELECT value FROM json_each(?))
+"""
+EXTEND_JOB = f"""
+UPDATE {TABLE} SET {END_TIME} = MAX({END_TIME}, ?), {LAST_ACTIVITY} = MAX(COALESCE({LAST_ACTIVITY}, ''), ?)
+WHERE {JOB_ID} = ?
+"""
+DELETE_JOB = f"DELETE FROM {TABLE} WHERE {JOB_ID} = ?"
+DELETE_JOBS = f"DELETE FROM {TABLE} WHERE {JOB_ID} IN (SELECT value FROM json_each(?))"
+
+
+def format_time(value: datetime) -> str:
+    # Fixed width UTC text so that string order is time order.
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def format_optional_time(value: datetime | None) -> str | None:
+    return None if value is None else format_time(value)
+
+
+def idle_since(job: Job) -> datetime:
+    return job.last_activity or job.start_time
+
+
+def compose_row(job: Job) -> tuple[Any, ...]:
+    return (
+        job.id,
+        job.user,
+        format_time(job.start_time),
+        format_time(job.end_time),
+        job.host,
+        job.state,
+        format_optional_time(job.last_activity),
+    )
+
+
+def to_dict(cursor: sqlite3.Cursor, row: tuple[Any, ...]) -> dict[str, Any]:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def open_database(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    connection.row_factory = to_dict
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA busy_timeout=5000")
+    upgrade_schema(connection)
+    return connection
+
+
+def upgrade_schema(connection: sqlite3.Connection) -> None:
+    for statement in SQLITE_SCHEMA:
+        connection.execute(statement)
+
+    existing = {row["name"] for row in connection.execute(f"PRAGMA table_info({TABLE})").fetchall()}
+
+    for name, definition in SQLITE_ADDED_COLUMNS.items():
+        if name not in existing:
+            connection.execute(f"ALTER TABLE {TABLE} ADD COLUMN {name} {definition}")
+
+    # Jobs running before activity was recorded are not stopped as idle right away.
+    if LAST_ACTIVITY not in existing:
+        connection.execute(f"UPDATE {TABLE} SET {LAST_ACTIVITY} = ?", (format_time(datetime.now(timezone.utc)),))
+
+    for statement in SQLITE_INDEXES:
+        connection.execute(statement)
+
+
+class SqliteConnection(DbConnection):
+    def __init__(self, connection: sqlite3.Connection, executor: BlockingExecutor) -> None:
+        self._connection = connection
+        self._executor = executor
+
+    async def close(self) -> None:
+        pass
+
+    async def recreate_table(self) -> None:
+        await self._execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await self.upgrade_table()
+
+    async def upgrade_table(self) -> None:
+        await self._executor.run(upgrade_schema, self._connection)
+
+    async def get_jobs(self) -> list[Job]:
+        rows = await self._fetch(SELECT_JOBS)
+        return [parse_job(row) for row in rows]
+
+    async def get_job(self, id: str) -> Job | None:
+        rows = await self._fetch(SELECT_JOB, id)
+        if not rows:
+            return None
+        return parse_job(rows[0])
+
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]:
+        rows = await self._fetch(SELECT_JOBS_BY_IDS, json.dumps(ids))
+        return [parse_job(row) for row in rows]
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]:
+        rows = await self._fetch(SELECT_EXPIRED_JOBS, format_time(now), limit)
+        return [parse_job(row) for row in rows]
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        rows = await self._fetch(SELECT_IDLE_JOBS, format_time(before), limit)
+        return [parse_job(row) for row in rows]
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        # End bound and cursor are both an exclusive upper bound on (start time, ID).
+        upper = None if end is None else (end, "")
+
+        if cursor is not None:
+            position = parse_cursor(cursor)
+            upper = position if upper is None else min(upper, position)
+
+        rows = await self._fetch(
+            SELECT_USER_JOBS,
+            user,
+            state,
+            state,
+            None if start is None else format_time(start),
+            None if upper is None else format_time(upper[0]),
+            None if upper is None else upper[1],
+            limit + 1,
+        )
+
+        jobs = [parse_job(row) for row in rows[:limit]]
+
+        if len(rows) <= limit:
+            return JobPage(jobs)
+
+        return JobPage(jobs, compose_cursor(jobs[-1]))
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int:
+        rows = await self._fetch(COUNT_ACTIVE_JOBS, user, format_time(now))
+        return rows[0]["count"]
+
+    async def insert_job(self, job: Job) -> None:
+        await self._execute(INSERT_JOB, *compose_row(job))
+
+    async def insert_jobs(self, jobs: list[Job]) -> None:
+        await self._executor.run(self._connection.executemany, INSERT_JOB, [compose_row(job) for job in jobs])
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None:
+        await self._execute(UPDATE_JOB, host, state, id)
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        await self._execute(RECORD_ACTIVITY, format_time(time), json.dumps(ids))
+
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        await self._execute(EXTEND_JOB, format_time(end_time), format_time(time), id)
+
+    async def delete_job(self, id: str) -> None:
+        await self._execute(DELETE_JOB, id)
+
+    async def delete_jobs(self, ids: list[str]) -> None:
+        await self._execute(DELETE_JOBS, json.dumps(ids))
+
+    async def _fetch(self, query: str, *args: Any) -> list[dict[str, Any]]:
+        return await self._executor.run(lambda: self._connection.execute(query, args).fetchall())
+
+    async def _execute(self, query: str, *args: Any) -> None:
+        await self._executor.run(self._connection.execute, query, args)
+
+
+class SqliteConnector(DbConnector):
+    """SQLite file in WAL mode, other processes (slave) can read it concurrently."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        # A single worker serializes access to the connection.
+        self._executor = BlockingExecutor(1, name="sqlite")
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> DbConnection:
+        async with self._lock:
+            if self._connection is None:
+                self._connection = await self._executor.run(open_database, self._path)
+        return SqliteConnection(self._connection, self._executor)
+
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        return None
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._executor.run(self._connection.close)
+            self._connection = None
+        self._executor.close()
@@ -1,86 +1,333 @@
-from dataclasses import dataclass
+import asyncio
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
 
 import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
 
-from .db import DbConnection, Job, DbConnector, JOB_ID, HOSTNAME
+from .db import (
+    END_TIME,
+    HOSTNAME,
+    JOB_ID,
+    LAST_ACTIVITY,
+    START_TIME,
+    STATE,
+    USER_ID,
+    DbConnection,
+    DbConnector,
+    Job,
+    JobListener,
+    JobPage,
+    JobState,
+    JobSubscription,
+    decode_cursor,
+    encode_cursor,
+    parse_job,
+    parse_time,
+)
+from .metrics import Counter
+
+PREPARED_STATEMENTS = Counter("vsm_db_prepared_statements_total", "Prepared statement cache lookups", ("result",))
 
 
 @dataclass
-class Column:
-    name: str
-    type: str = "VARCHAR(255)"
-    primary: bool = False
+class Migration:
+    version: int
+    description: str
+    statements: list[str]
 
 
 TABLE = "jobs"
+VERSION_TABLE = "schema_version"
+
+COLUMNS = [JOB_ID, USER_ID, START_TIME, END_TIME, HOSTNAME, STATE, LAST_ACTIVITY]
+
+# Jobs never used count as idle from their start.
+IDLE_SINCE = f"COALESCE({LAST_ACTIVITY}, {START_TIME})"
 
-COLUMNS = [
-    Column(JOB_ID, primary=True),
-    Column("user_id"),
-    Column("start_time"),
-    Column("end_time"),
-    Column(HOSTNAME),
+# Append only, applied migrations must never change. Naive times written by
+# previous versions are interpreted as UTC.
+MIGRATIONS = [
+    Migration(
+        1,
+        "Create jobs table",
+        [
+            f"""
+            CREATE TABLE IF NOT EXISTS {TABLE} (
+                {JOB_ID} VARCHAR(255) PRIMARY KEY,
+                {USER_ID} VARCHAR(255) NOT NULL,
+                {START_TIME} VARCHAR(255) NOT NULL,
+                {END_TIME} VARCHAR(255) NOT NULL,
+                {HOSTNAME} VARCHAR(255) NOT NULL
+            )
+            """,
+        ],
+    ),
+    Migration(
+        2,
+        "Add job state",
+        [
+            f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS {STATE} VARCHAR(255) NOT NULL DEFAULT '{JobState.PENDING}'",
+            f"""
+            UPDATE {TABLE} SET {STATE} = '{JobState.READY}'
+            WHERE {STATE} = '{JobState.PENDING}' AND {HOSTNAME} <> ''
+            """,
+        ],
+    ),
+    Migration(
+        3,
+        "Store job times as TIMESTAMPTZ",
+        [
+            f"""
+            ALTER TABLE {TABLE}
+                ALTER COLUMN {START_TIME} TYPE TIMESTAMPTZ USING {START_TIME}::timestamp AT TIME ZONE 'UTC',
+                ALTER COLUMN {END_TIME} TYPE TIMESTAMPTZ USING {END_TIME}::timestamp AT TIME ZONE 'UTC'
+            """,
+        ],
+    ),
+    Migration(
+        4,
+        "Index jobs by user in listing order and by end time",
+        [
+            f"""
+            CREATE INDEX IF NOT EXISTS {TABLE}_{USER_ID}_{START_TIME}_idx
+            ON {TABLE} ({USER_ID}, {START_TIME} DESC, {JOB_ID} DESC)
+            """,
+            f"CREATE INDEX IF NOT EXISTS {TABLE}_{END_TIME}_idx ON {TABLE} ({END_TIME})",
+        ],
+    ),
+    Migration(
+        5,
+        "Add job last activity",
+        [
+            f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS {LAST_ACTIVITY} TIMESTAMPTZ",
+            # Jobs running before activity was recorded are not stopped as idle right away.
+            f"UPDATE {TABLE} SET {LAST_ACTIVITY} = now() WHERE {LAST_ACTIVITY} IS NULL",
+            f"""
+            CREATE INDEX IF NOT EXISTS {TABLE}_idle_idx
+            ON {TABLE} (({IDLE_SINCE})) WHERE {STATE} = '{JobState.READY}'
+            """,
+        ],
+    ),
 ]
 
 
-def declare_column(column: Column) -> str:
-    suffix = "PRIMARY KEY" if column.primary else "NOT NULL"
-    return f"{column.name} {column.type} {suffix}"
+NOTIFY_CHANNEL = f"{TABLE}_changed"
+
+NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION {TABLE}_notify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object('{JOB_ID}', OLD.{JOB_ID})::text);
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW.{HOSTNAME} IS NOT DISTINCT FROM OLD.{HOSTNAME} THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object('{JOB_ID}', NEW.{JOB_ID}, '{HOSTNAME}', NEW.{HOSTNAME})::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+NOTIFY_TRIGGER = f"""
+CREATE TRIGGER {TABLE}_notify AFTER INSERT OR UPDATE OR DELETE ON {TABLE}
+FOR EACH ROW EXECUTE FUNCTION {TABLE}_notify()
+"""
 
 
-def get_all_columns(columns: list[Column]) -> str:
-    return ", ".join(column.name for column in columns)
+def get_all_columns(columns: list[str]) -> str:
+    return ", ".join(columns)
 
 
-def compose_job(job: Job) -> list[str]:
+def get_placeholders(columns: list[str]) -> str:
+    return ", ".join(f"${i + 1}" for i in range(len(columns)))
+
+
+def compose_job(job: Job) -> list[object]:
     return [
         job.id,
         job.user,
-        job.start_time.isoformat(),
-        job.end_time.isoformat(),
+        job.start_time,
+        job.end_time,
         job.host,
+        job.state,
+        job.last_activity,
     ]
 
 
+SELECT_JOBS = f"SELECT {get_all_columns(COLUMNS)} FROM {TABLE}"
+SELECT_JOB = f"{SELECT_JOBS} WHERE {JOB_ID} = $1"
+SELECT_JOBS_BY_IDS = f"{SELECT_JOBS} WHERE {JOB_ID} = ANY($1::varchar[])"
+SELECT_EXPIRED_JOBS = f"{SELECT_JOBS} WHERE {END_TIME} <= $1 ORDER BY {END_TIME} LIMIT $2"
+SELECT_IDLE_JOBS = f"""
+{SELECT_JOBS}
+WHERE {STATE} = '{JobState.READY}' AND {IDLE_SINCE} < $1
+ORDER BY {IDLE_SINCE}
+LIMIT $2
+"""
+# Bounds are COALESCEd rather than made optional so that the generic plan of
+# the prepared statement still seeks the (user, start time) index.
+SELECT_USER_JOBS = f"""
+{SELECT_JOBS}
+WHERE {USER_ID} = $1
+AND ($2::varchar IS NULL OR {STATE} = $2)
+AND {START_TIME} >= COALESCE($3, '-infinity'::timestamptz)
+AND {START_TIME} < COALESCE($4, 'infinity'::timestamptz)
+AND ({START_TIME}, {JOB_ID}) < (COALESCE($5, 'infinity'::timestamptz), COALESCE($6, ''))
+ORDER BY {START_TIME} DESC, {JOB_ID} DESC
+LIMIT $7
+"""
+COUNT_ACTIVE_JOBS = f"""
+SELECT COUNT(*) FROM {TABLE}
+WHERE {USER_ID} = $1 AND {END_TIME} > $2 AND {STATE} <> '{JobState.FAILED}'
+"""
+INSERT_JOB = f"INSERT INTO {TABLE}({get_all_columns(COLUMNS)}) VALUES({get_placeholders(COLUMNS)})"
+UPDATE_JOB = f"UPDATE {TABLE} SET {HOSTNAME} = $1, {STATE} = $2 WHERE {JOB_ID} = $3"
+RECORD_ACTIVITY = f"""
+UPDATE {TABLE} SET {LAST_ACTIVITY} = GREATEST({LAST_ACTIVITY}, $2)
+WHERE {JOB_ID} = ANY($1::varchar[])
+"""
+EXTEND_JOB = f"""
+UPDATE {TABLE} SET {END_TIME} = GREATEST({END_TIME}, $2), {LAST_ACTIVITY} = GREATEST({LAST_ACTIVITY}, $3)
+WHERE {JOB_ID} = $1
+"""
+DELETE_JOB = f"DELETE FROM {TABLE} WHERE {JOB_ID} = $1"
+DELETE_JOBS = f"DELETE FROM {TABLE} WHERE {JOB_ID} = ANY($1::varchar[])"
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Connection keeping the statements it prepared for its whole lifetime.
+
+    asyncpg has its own statement cache but it is bounded and shared with
+    ad hoc queries, this one only holds the constant queries above.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._prepared = dict[str, PreparedStatement]()
+
+    async def prepare_cached(self, query: str) -> PreparedStatement:
+        statement = self._prepared.get(query)
+
+        if statement is not None:
+            PREPARED_STATEMENTS.inc("hit")
+            return statement
+
+        PREPARED_STATEMENTS.inc("miss")
+        statement = await self.prepare(query)
+        self._prepared[query] = statement
+        return statement
+
+    def forget_prepared(self, query: str) -> None:
+        self._prepared.pop(query, None)
+
+
 class PsqlConnection(DbConnection):
-    def __init__(self, connection: asyncpg.Connection) -> None:
+    def __init__(self, connection: PreparedConnection, pool: asyncpg.Pool | None = None) -> None:
         self._connection = connection
+        self._pool = pool
 
     async def close(self) -> None:
-        await self._connection.close()
+        if self._pool is None:
+            await self._connection.close()
+            return
+        await self._pool.release(self._connection)
 
     async def recreate_table(self) -> None:
-        await self._connection.execute(f"DROP TABLE IF EXISTS {TABLE}")
-        columns = ",\n".join(declare_column(column) for column in COLUMNS)
-        await self._connection.execute(f"CREATE TABLE {TABLE} (\n{columns}\n)")
+        await self._connection.execute(f"DROP TABLE IF EXISTS {TABLE}, {VERSION_TABLE}")
+        await self.upgrade_table()
+
+    async def upgrade_table(self) -> None:
+        await migrate(self._connection)
+        await create_notify_trigger(self._connection)
 
     async def get_jobs(self) -> list[Job]:
-        columns = get_all_columns(COLUMNS)
-        rows = await self._connection.fetch(f"SELECT {columns} FROM {TABLE}")
+        rows = await self._fetch(SELECT_JOBS)
         return [parse_job(row) for row in rows]
 
     async def get_job(self, id: str) -> Job | None:
-        columns = get_all_columns(COLUMNS)
-        query = f"SELECT {columns} FROM {TABLE} WHERE {JOB_ID} = $1"
-        row = await self._connection.fetchrow(query, id)
-        if row is None:
+        rows = await self._fetch(SELECT_JOB, id)
+        if not rows:
             return None
-        return parse_job(row)
+        return parse_job(rows[0])
+
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]:
+        rows = await self._fetch(SELECT_JOBS_BY_IDS, ids)
+        return [parse_job(row) for row in rows]
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]:
+        rows = await self._fetch(SELECT_EXPIRED_JOBS, now, limit)
+        return [parse_job(row) for row in rows]
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        rows = await self._fetch(SELECT_IDLE_JOBS, before, limit)
+        return [parse_job(row) for row in rows]
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        after_time, after_id = None, None
+
+        if cursor is not None:
+            position = decode_cursor(cursor, {START_TIME: str, JOB_ID: str})
+            after_time = parse_time(position[START_TIME])
+            after_id = position[JOB_ID]
+
+        # One extra row tells if there is a next page.
+        rows = await self._fetch(SELECT_USER_JOBS, user, state, start, end, after_time, after_id, limit + 1)
+        jobs = [parse_job(row) for row in rows[:limit]]
+
+        if len(rows) <= limit:
+            return JobPage(jobs)
+
+        last = jobs[-1]
+        return JobPage(jobs, encode_cursor({START_TIME: last.start_time.isoformat(), JOB_ID: last.id}))
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int:
+        rows = await self._fetch(COUNT_ACTIVE_JOBS, user, now)
+        return rows[0][0]
 
     async def insert_job(self, job: Job) -> None:
-        columns = get_all_columns(COLUMNS)
-        values = compose_job(job)
-        placeholders = ", ".join(f"${i + 1}" for i in range(len(COLUMNS)))
-        query = f"INSERT INTO {TABLE}({columns}) VALUES({placeholders})"
-        await self._connection.execute(query, *values)
+        await self._fetch(INSERT_JOB, *compose_job(job))
+
+    async def insert_jobs(self, jobs: list[Job]) -> None:
+        statement = await self._connection.prepare_cached(INSERT_JOB)
+        await statement.executemany([compose_job(job) for job in jobs])
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None:
+        await self._fetch(UPDATE_JOB, host, state, id)
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        await self._fetch(RECORD_ACTIVITY, ids, time)
 
-    async def update_job(self, id: str, host: str) -> None:
-        query = f"UPDATE {TABLE} SET {HOSTNAME} = $1 WHERE {JOB_ID} = $2"
-        await self._connection.execute(query, host, id)
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        await self._fetch(EXTEND_JOB, id, end_time, time)
 
     async def delete_job(self, id: str) -> None:
-        query = f"DELETE FROM {TABLE} WHERE {JOB_ID} = $1"
-        await self._connection.execute(query, id)
+        await self._fetch(DELETE_JOB, id)
+
+    async def delete_jobs(self, ids: list[str]) -> None:
+        await self._fetch(DELETE_JOBS, ids)
+
+    async def _fetch(self, query: str, *args: Any) -> list[asyncpg.Record]:
+        statement = await self._connection.prepare_cached(query)
+
+        try:
+            return await statement.fetch(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # Schema changed under the statement (migration), prepare it again.
+            self._connection.forget_prepared(query)
+            statement = await self._connection.prepare_cached(query)
+            return await statement.fetch(*args)
 
 
 @dataclass
@@ -96,6 +343,142 @@ class PsqlConnector(DbConnector):
             database=self.database,
             user=self.user,
             password=self.password,
+            connection_class=PreparedConnection,
         )
         return PsqlConnection(connection)
 
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        return await listen(self.host, self.database, self.user, self.password, listener)
+
+    async def close(self) -> None:
+        pass
+
+
+@dataclass
+class PsqlPoolConnector(DbConnector):
+    host: str
+    database: str
+    user: str
+    password: str
+    min_size: int = 1
+    max_size: int = 10
+    acquire_timeout: float | None = None
+    max_queries: int = 50000
+    max_idle_seconds: float = 300
+    health_check: bool = False
+    _pool: asyncpg.Pool | None = field(default=None, init=False, repr=False)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False, repr=False)
+
+    async def connect(self) -> DbConnection:
+        pool = await self._get_pool()
+        connection = await pool.acquire(timeout=self.acquire_timeout)
+
+        if self.health_check and not await _is_alive(connection):
+            connection.terminate()
+            await pool.release(connection)
+            connection = await pool.acquire(timeout=self.acquire_timeout)
+
+        return PsqlConnection(connection, pool)
+
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        return await listen(self.host, self.database, self.user, self.password, listener)
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        await self._pool.close()
+        self._pool = None
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._pool is not None:
+            return self._pool
+
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    host=self.host,
+                    database=self.database,
+                    user=self.user,
+                    password=self.password,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_queries=self.max_queries,
+                    max_inactive_connection_lifetime=self.max_idle_seconds,
+                    connection_class=PreparedConnection,
+                )
+
+        return self._pool
+
+
+async def _is_alive(connection: asyncpg.Connection) -> bool:
+    if connection.is_closed():
+        return False
+    try:
+        await connection.fetchval("SELECT 1")
+    except (asyncpg.PostgresError, OSError):
+        return False
+    return True
+
+
+class PsqlSubscription(JobSubscription):
+    def __init__(self, connection: asyncpg.Connection) -> None:
+        self._connection = connection
+
+    async def is_alive(self) -> bool:
+        return await _is_alive(self._connection)
+
+    async def close(self) -> None:
+        await self._connection.close()
+
+
+async def migrate(connection: asyncpg.Connection) -> None:
+    async with connection.transaction():
+        await connection.execute(f"SELECT pg_advisory_xact_lock(hashtext('{VERSION_TABLE}'))")
+        await connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+
+        current = await connection.fetchval(f"SELECT COALESCE(MAX(version), 0) FROM {VERSION_TABLE}")
+
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            for statement in migration.statements:
+                await connection.execute(statement)
+            await connection.execute(
+                f"INSERT INTO {VERSION_TABLE}(version, description) VALUES($1, $2)",
+                migration.version,
+                migration.description,
+            )
+
+
+async def create_notify_trigger(connection: asyncpg.Connection) -> None:
+    async with connection.transaction():
+        await connection.execute(f"SELECT pg_advisory_xact_lock(hashtext('{NOTIFY_CHANNEL}'))")
+        await connection.execute(NOTIFY_FUNCTION)
+        await connection.execute(f"DROP TRIGGER IF EXISTS {TABLE}_notify ON {TABLE}")
+        await connection.execute(NOTIFY_TRIGGER)
+
+
+async def listen(host: str, database: str, user: str, password: str, listener: JobListener) -> JobSubscription:
+    connection = await asyncpg.connect(host=host, database=database, user=user, password=password)
+
+    def notify(_connection: asyncpg.Connection, _pid: int, _channel: str, payload: str) -> None:
+        data = json.loads(payload)
+        listener.job_changed(data[JOB_ID], data.get(HOSTNAME))
+
+    # Only LISTEN here, the trigger is installed by the master with the
+    # schema (upgrade_table), DDL would lock the table on every resubscribe.
+    try:
+        await connection.add_listener(NOTIFY_CHANNEL, notify)
+    except BaseException:
+        await connection.close()
+        raise
+
+    return PsqlSubscription(connection)
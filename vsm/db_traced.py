@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from .db import DbConnection, DbConnector, Job, JobListener, JobPage, JobState, JobSubscription
+from .tracing import span
+
+
+class TracedConnection(DbConnection):
+    """Connection wrapper timing each query in a "db" span of the current trace."""
+
+    def __init__(self, connection: DbConnection) -> None:
+        self._connection = connection
+
+    async def __aenter__(self):
+        await self._connection.__aenter__()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self._connection.__aexit__(*args)
+
+    async def close(self) -> None:
+        await self._connection.close()
+
+    async def recreate_table(self) -> None:
+        with span("db", operation="recreate_table"):
+            await self._connection.recreate_table()
+
+    async def upgrade_table(self) -> None:
+        with span("db", operation="upgrade_table"):
+            await self._connection.upgrade_table()
+
+    async def get_jobs(self) -> list[Job]:
+        with span("db", operation="get_jobs"):
+            return await self._connection.get_jobs()
+
+    async def get_job(self, id: str) -> Job | None:
+        with span("db", operation="get_job"):
+            return await self._connection.get_job(id)
+
+    async def get_jobs_by_ids(self, ids: list[str]) -> list[Job]:
+        with span("db", operation="get_jobs_by_ids"):
+            return await self._connection.get_jobs_by_ids(ids)
+
+    async def get_expired_jobs(self, now: datetime, limit: int) -> list[Job]:
+        with span("db", operation="get_expired_jobs"):
+            return await self._connection.get_expired_jobs(now, limit)
+
+    async def get_idle_jobs(self, before: datetime, limit: int) -> list[Job]:
+        with span("db", operation="get_idle_jobs"):
+            return await self._connection.get_idle_jobs(before, limit)
+
+    async def get_jobs_by_user(
+        self,
+        user: str,
+        cursor: str | None,
+        limit: int,
+        state: JobState | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> JobPage:
+        with span("db", operation="get_jobs_by_user"):
+            return await self._connection.get_jobs_by_user(user, cursor, limit, state, start, end)
+
+    async def count_active_jobs(self, user: str, now: datetime) -> int:
+        with span("db", operation="count_active_jobs"):
+            return await self._connection.count_active_jobs(user, now)
+
+    async def insert_job(self, job: Job) -> None:
+        with span("db", operation="insert_job"):
+            await self._connection.insert_job(job)
+
+    async def insert_jobs(self, jobs: list[Job]) -> None:
+        with span("db", operation="insert_jobs"):
+            await self._connection.insert_jobs(jobs)
+
+    async def update_job(self, id: str, host: str, state: JobState = JobState.READY) -> None:
+        with span("db", operation="update_job"):
+            await self._connection.update_job(id, host, state)
+
+    async def record_activity(self, ids: list[str], time: datetime) -> None:
+        with span("db", operation="record_activity"):
+            await self._connection.record_activity(ids, time)
+
+    async def extend_job(self, id: str, end_time: datetime, time: datetime) -> None:
+        with span("db", operation="extend_job"):
+            await self._connection.extend_job(id, end_time, time)
+
+    async def delete_job(self, id: str) -> None:
+        with span("db", operation="delete_job"):
+            await self._connection.delete_job(id)
+
+    async def delete_jobs(self, ids: list[str]) -> None:
+        with span("db", operation="delete_jobs"):
+            await self._connection.delete_jobs(ids)
+
+
+class TracedConnector(DbConnector):
+    def __init__(self, connector: DbConnector) -> None:
+        self._connector = connector
+
+    async def connect(self) -> DbConnection:
+        with span("db", operation="connect"):
+            connection = await self._connector.connect()
+
+        return TracedConnection(connection)
+
+    async def listen(self, listener: JobListener) -> JobSubscription | None:
+        return await self._connector.listen(listener)
+
+    async def close(self) -> None:
+        await self._connector.close()
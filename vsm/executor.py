@@ -0,0 +1,26 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    def __init__(self, max_workers: int, timeout: float | None = None, name: str = "vsm") -> None:
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._timeout = timeout
+
+    async def run(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(function, *args, **kwargs)
+        return await asyncio.wait_for(loop.run_in_executor(self._executor, call), self._timeout)
+
+    async def run_to_completion(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run without the timeout, for calls that change state and keep running on their thread when abandoned."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(function, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
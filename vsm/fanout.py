@@ -0,0 +1,232 @@
+import asyncio
+from contextlib import suppress
+from logging import Logger
+
+from aiohttp import ClientSession, ClientWebSocketResponse, WSCloseCode, WSMessage, WSMsgType, web
+
+from .activity import ActivityRecorder
+from .compression import CompressingSender
+from .metrics import Counter, Gauge
+from .settings import PROXY_FANOUT_QUEUE_SIZE, PROXY_MAX_MESSAGE_SIZE
+from .tracing import finish as finish_trace
+from .tracing import span
+
+SHARED_SESSIONS = Gauge("vsm_proxy_fanout_sessions", "Brayns connections shared between clients")
+PARTICIPANTS = Gauge("vsm_proxy_fanout_participants", "Clients attached to a shared Brayns connection", ("role",))
+FANOUT_MESSAGES = Counter("vsm_proxy_fanout_messages_total", "Messages through shared Brayns connections", ("source",))
+FANOUT_DELIVERIES = Counter("vsm_proxy_fanout_deliveries_total", "Brayns messages queued to clients")
+IGNORED_MESSAGES = Counter("vsm_proxy_fanout_ignored_messages_total", "Messages sent by read-only viewers")
+SLOW_VIEWERS = Counter("vsm_proxy_fanout_slow_viewers_total", "Viewers disconnected because their queue was full")
+
+CONTROLLER = "controller"
+VIEWER = "viewer"
+
+
+class Participant:
+    def __init__(self, ws: web.WebSocketResponse, sender: CompressingSender, controller: bool) -> None:
+        self.ws = ws
+        self.sender = sender
+        self.controller = controller
+        self.queue = asyncio.Queue[WSMessage | None](PROXY_FANOUT_QUEUE_SIZE)
+        self.dropped = False
+
+    @property
+    def role(self) -> str:
+        return CONTROLLER if self.controller else VIEWER
+
+    async def put(self, message: WSMessage | None) -> bool:
+        """Queue a message, return False if the participant had to be dropped."""
+        if self.dropped:
+            return False
+
+        # The controller drives Brayns and gets backpressure like a direct session.
+        if self.controller:
+            await self.queue.put(message)
+            return True
+
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.drop()
+            return False
+
+    def drop(self) -> None:
+        """Discard what is queued and make the send loop close the connection."""
+        self.dropped = True
+
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+        self.queue.put_nowait(None)
+
+    async def send_loop(self) -> None:
+        while (message := await self.queue.get()) is not None:
+            await self.sender.send(message.type, message.data)
+
+        code = WSCloseCode.TRY_AGAIN_LATER if self.dropped else WSCloseCode.OK
+        await self.ws.close(code=code)
+
+
+class SharedSession:
+    """One Brayns connection broadcasting to a controller and any number of viewers."""
+
+    def __init__(
+        self,
+        job_id: str,
+        hostname: str,
+        session: ClientSession,
+        activity: ActivityRecorder,
+        logger: Logger,
+    ) -> None:
+        self.job_id = job_id
+        self._hostname = hostname
+        self._session = session
+        self._activity = activity
+        self._logger = logger
+        self._participants = set[Participant]()
+        self._controller: Participant | None = None
+        self._upstream: ClientWebSocketResponse | None = None
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def empty(self) -> bool:
+        return not self._participants
+
+    def add(self, participant: Participant) -> None:
+        if participant.controller:
+            if self._controller is not None:
+                raise web.HTTPConflict(text=f"Job {self.job_id} already has a controller")
+            self._controller = participant
+
+        self._participants.add(participant)
+        PARTICIPANTS.inc(participant.role)
+
+    def remove(self, participant: Participant) -> None:
+        self._participants.discard(participant)
+        PARTICIPANTS.dec(participant.role)
+
+        # Unblocks the broadcast if it waits for room in this queue.
+        participant.drop()
+
+        if participant is self._controller:
+            self._controller = None
+
+    async def run(self, participant: Participant) -> None:
+        upstream = await self._connect()
+
+        # The session itself is not a request to time.
+        finish_trace()
+
+        sending = asyncio.create_task(participant.send_loop())
+
+        try:
+            while True:
+                message = await participant.ws.receive()
+
+                if message.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    break
+
+                if not participant.controller:
+                    IGNORED_MESSAGES.inc()
+                    continue
+
+                FANOUT_MESSAGES.inc("client")
+                self._activity.record(self.job_id)
+
+                if message.type == WSMsgType.TEXT:
+                    await upstream.send_str(message.data)
+                else:
+                    await upstream.send_bytes(message.data)
+        finally:
+            sending.cancel()
+            try:
+                await sending
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # The client is gone (reset during a send), the handshake is
+                # done and there is no error response to give anymore.
+                self._logger.warning(f"Failed to send to {participant.role} of job {self.job_id}: {e}")
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._reader
+
+        if self._upstream is not None:
+            await self._upstream.close()
+
+    async def _connect(self) -> ClientWebSocketResponse:
+        async with self._lock:
+            # Brayns may have closed the previous connection while clients stayed.
+            if self._upstream is None or self._upstream.closed:
+                with span("brayns_connect"):
+                    self._upstream = await self._session.ws_connect(
+                        f"ws://{self._hostname}", max_msg_size=PROXY_MAX_MESSAGE_SIZE
+                    )
+                self._reader = asyncio.create_task(self._broadcast(self._upstream))
+                SHARED_SESSIONS.inc()
+                self._logger.info(f"Shared Brayns session started for job {self.job_id}")
+
+        return self._upstream
+
+    async def _broadcast(self, upstream: ClientWebSocketResponse) -> None:
+        try:
+            while True:
+                message = await upstream.receive()
+
+                if message.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    break
+
+                FANOUT_MESSAGES.inc("brayns")
+
+                for participant in list(self._participants):
+                    if participant.dropped:
+                        continue
+
+                    if await participant.put(message):
+                        FANOUT_DELIVERIES.inc()
+                        continue
+
+                    SLOW_VIEWERS.inc()
+                    self._logger.warning(f"Viewer of job {self.job_id} too slow, disconnecting")
+        finally:
+            SHARED_SESSIONS.dec()
+
+        self._logger.info(f"Shared Brayns session of job {self.job_id} closed by Brayns")
+
+        # Clients get what is already queued, then their connection is closed.
+        for participant in list(self._participants):
+            await participant.put(None)
+
+
+class FanOut:
+    """Registry of the shared Brayns sessions, one per job."""
+
+    def __init__(self, session: ClientSession, activity: ActivityRecorder, logger: Logger) -> None:
+        self._session = session
+        self._activity = activity
+        self._logger = logger
+        self._sessions = dict[str, SharedSession]()
+
+    def join(self, job_id: str, hostname: str, participant: Participant) -> SharedSession:
+        shared = self._sessions.get(job_id)
+
+        if shared is None:
+            shared = self._sessions[job_id] = SharedSession(
+                job_id, hostname, self._session, self._activity, self._logger
+            )
+
+        shared.add(participant)
+        return shared
+
+    async def leave(self, shared: SharedSession, participant: Participant) -> None:
+        shared.remove(participant)
+
+        # The last client to leave closes the Brayns connection.
+        if shared.empty and self._sessions.get(shared.job_id) is shared:
+            del self._sessions[shared.job_id]
+            await shared.close()
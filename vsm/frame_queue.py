@@ -0,0 +1,82 @@
+import asyncio
+import json
+from collections import deque
+
+from aiohttp import WSMessage, WSMsgType
+
+from .metrics import Counter
+
+FRAMES = Counter("vsm_proxy_frames_total", "Binary frames to clients by outcome", ("outcome",))
+
+
+def is_droppable(message: WSMessage) -> bool:
+    """Binary frames can be superseded, except Brayns replies carrying a request ID in their JSON header."""
+    if message.type != WSMsgType.BINARY:
+        return False
+
+    data = message.data
+
+    if data[4:5] != b"{":
+        return True
+
+    size = int.from_bytes(data[:4], "little")
+
+    try:
+        header = json.loads(data[4 : 4 + size])
+    except ValueError:
+        return True
+
+    return not isinstance(header, dict) or header.get("id") is None
+
+
+class FrameQueue:
+    """Messages waiting for a client where a new frame drops the oldest one past max_frames."""
+
+    def __init__(self, max_frames: int) -> None:
+        self._max_frames = max(max_frames, 1)
+        self._messages = deque[tuple[WSMessage, bool]]()
+        self._frames = 0
+        self._closed = False
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def put(self, message: WSMessage) -> None:
+        droppable = is_droppable(message)
+
+        if droppable:
+            if self._frames >= self._max_frames:
+                self._drop_oldest_frame()
+            self._frames += 1
+
+        self._messages.append((message, droppable))
+        self._ready.set()
+
+    def close(self) -> None:
+        """Make get return None once the queued messages are consumed."""
+        self._closed = True
+        self._ready.set()
+
+    async def get(self) -> WSMessage | None:
+        while not self._messages:
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+        message, droppable = self._messages.popleft()
+
+        if droppable:
+            self._frames -= 1
+            FRAMES.inc("delivered")
+
+        return message
+
+    def _drop_oldest_frame(self) -> None:
+        for index, (_, droppable) in enumerate(self._messages):
+            if droppable:
+                del self._messages[index]
+                self._frames -= 1
+                FRAMES.inc("dropped")
+                return
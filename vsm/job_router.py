@@ -0,0 +1,114 @@
+import asyncio
+from logging import Logger
+
+from .cache import TtlCache
+from .db import DbConnector, JobListener, JobSubscription
+from .settings import (
+    ROUTER_CACHE_SIZE,
+    ROUTER_CACHE_TTL_SECONDS,
+    ROUTER_NEGATIVE_TTL_SECONDS,
+    ROUTER_RESYNC_BATCH_SIZE,
+    ROUTER_RESYNC_PERIOD_SECONDS,
+)
+
+
+class JobRouter(JobListener):
+    def __init__(self, connector: DbConnector, logger: Logger) -> None:
+        self._connector = connector
+        self._logger = logger
+        self._hosts = TtlCache[str, str](ROUTER_CACHE_SIZE, ROUTER_CACHE_TTL_SECONDS)
+        self._pending = TtlCache[str, bool](ROUTER_CACHE_SIZE, ROUTER_NEGATIVE_TTL_SECONDS)
+        self._missing = TtlCache[str, bool](ROUTER_CACHE_SIZE, ROUTER_NEGATIVE_TTL_SECONDS)
+        self._subscription: JobSubscription | None = None
+
+    async def get_host(self, job_id: str) -> str | None:
+        """Return the job host, "" if the job is not ready yet or None if it does not exist."""
+        host = self._hosts.get(job_id)
+
+        if host is not None:
+            return host
+
+        if self._pending.get(job_id):
+            return ""
+
+        if self._missing.get(job_id):
+            return None
+
+        self._logger.info(f"No route cached for job {job_id}, querying DB")
+
+        async with await self._connector.connect() as connection:
+            job = await connection.get_job(job_id)
+
+        host = None if job is None else job.host
+        self.job_changed(job_id, host)
+        return host
+
+    def job_changed(self, id: str, host: str | None) -> None:
+        if host is None:
+            self._hosts.pop(id)
+            self._pending.pop(id)
+            self._missing.put(id, True)
+            return
+
+        self._missing.pop(id)
+
+        if not host:
+            self._hosts.pop(id)
+            self._pending.put(id, True)
+            return
+
+        self._pending.pop(id)
+        self._hosts.put(id, host)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await self._subscribe()
+                await self._resync()
+                await asyncio.sleep(ROUTER_RESYNC_PERIOD_SECONDS)
+        finally:
+            if self._subscription is not None:
+                await self._subscription.close()
+
+    async def _subscribe(self) -> None:
+        if self._subscription is not None and await self._subscription.is_alive():
+            return
+
+        if self._subscription is not None:
+            self._logger.warning("Job notifications lost, resubscribing")
+            await self._subscription.close()
+            self._subscription = None
+
+        try:
+            self._subscription = await self._connector.listen(self)
+        except Exception as e:
+            self._logger.error(f"Failed to subscribe to job notifications: {e}")
+            return
+
+        if self._subscription is None:
+            return
+
+        self._logger.info("Subscribed to job notifications")
+
+        # Changes made while we were not listening are lost, resync will
+        # refresh known routes but negative entries must be dropped.
+        self._pending.clear()
+        self._missing.clear()
+
+    async def _resync(self) -> None:
+        ids = self._hosts.keys()
+
+        for i in range(0, len(ids), ROUTER_RESYNC_BATCH_SIZE):
+            batch = ids[i : i + ROUTER_RESYNC_BATCH_SIZE]
+
+            try:
+                async with await self._connector.connect() as connection:
+                    jobs = await connection.get_jobs_by_ids(batch)
+            except Exception as e:
+                self._logger.error(f"DB error while resyncing job routes: {e}")
+                return
+
+            hosts = {job.id: job.host for job in jobs}
+
+            for id in batch:
+                self.job_changed(id, hosts.get(id))
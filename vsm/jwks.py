@@ -0,0 +1,106 @@
+import asyncio
+import time
+from logging import Logger
+from typing import Any
+
+from aiohttp import ClientSession
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class JwksVerifier:
+    def __init__(
+        self,
+        session: ClientSession,
+        logger: Logger,
+        url: str,
+        refresh_period: float,
+        issuer: str | None = None,
+        audience: str | None = None,
+    ) -> None:
+        try:
+            import jwt
+        except ImportError as e:
+            raise RuntimeError("Local token verification requires PyJWT[crypto] (pip install vsm[jwt])") from e
+
+        self._jwt = jwt
+        self._session = session
+        self._logger = logger
+        self._url = url
+        self._refresh_period = refresh_period
+        self._issuer = issuer
+        self._audience = audience
+        self._keys: dict[str | None, Any] = {}
+        self._fetched_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def verify(self, token: str) -> dict[str, Any]:
+        jwt = self._jwt
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise InvalidToken(f"Malformed token: {e}") from e
+
+        kid = header.get("kid")
+        key = await self._get_key(kid)
+
+        if key is None:
+            raise InvalidToken(f"Unknown signing key {kid}")
+
+        try:
+            return jwt.decode(
+                token,
+                key.key,
+                algorithms=[key.algorithm_name],
+                issuer=self._issuer,
+                audience=self._audience,
+                options={"verify_aud": self._audience is not None},
+            )
+        except jwt.InvalidTokenError as e:
+            raise InvalidToken(str(e)) from e
+
+    async def _get_key(self, kid: str | None) -> Any:
+        if self._is_stale() or kid not in self._keys:
+            await self._refresh(force=kid not in self._keys)
+        return self._keys.get(kid)
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._fetched_at >= self._refresh_period
+
+    async def _refresh(self, force: bool) -> None:
+        async with self._lock:
+            age = time.monotonic() - self._fetched_at
+
+            # Unknown key IDs trigger a refresh at most every few seconds so
+            # forged tokens cannot be used to hammer the JWKS endpoint.
+            if age < self._refresh_period and (not force or age < 10):
+                return
+
+            self._logger.info(f"Fetching JWKS from {self._url}")
+
+            try:
+                async with self._session.get(self._url) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            except Exception as e:
+                self._logger.error(f"Failed to fetch JWKS: {e}")
+                self._fetched_at = time.monotonic()
+                return
+
+            keys: dict[str | None, Any] = {}
+
+            for item in data.get("keys", []):
+                if item.get("use", "sig") != "sig":
+                    continue
+                try:
+                    keys[item.get("kid")] = self._jwt.PyJWK(item)
+                except self._jwt.PyJWKError as e:
+                    self._logger.warning(f"Ignoring unsupported JWK {item.get('kid')}: {e}")
+
+            self._logger.info(f"Loaded {len(keys)} signing keys")
+
+            self._keys = keys
+            self._fetched_at = time.monotonic()
@@ -7,35 +7,85 @@ from logging import Logger
 from aiohttp import ClientSession, TCPConnector, web
 
 from .allocator import FakeAllocator, JobAllocator
-from .application import run_application
+from .application import Settings, parse_argv, run_application
 from .authenticator import Authenticator
 from .aws_allocator import AwsAllocator
 from .db_init import create_db_connector
 from .logger import create_logger
 from .scheduler import JobScheduler
-from .settings import JOB_ALLOCATOR, MASTER_PORT, RECREATE_DB, UNICORE_CA_FILE
+from .settings import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_JOBS_PER_USER,
+    ADMISSION_START_RATE_PER_SECOND,
+    JOB_ALLOCATOR,
+    MASTER_PORT,
+    RECREATE_DB,
+    UNICORE_CA_FILE,
+    WARM_POOL_MAX_SIZE,
+)
+from .supervisor import run_async, run_workers
 from .unicore_allocator import UnicoreAllocator
+from .warm_pool import WarmPool
 
 
-def create_allocator(name: str, session: ClientSession, logger: Logger) -> JobAllocator:
+def create_allocator(name: str, session: ClientSession, logger: Logger, warm_pool: bool) -> JobAllocator:
     if name == "UNICORE":
         logger.warn("Unicore deprecated")
         return UnicoreAllocator(session)
     if name == "AWS":
-        return AwsAllocator(session, logger)
+        return create_warm_pool(AwsAllocator(session, logger), logger, warm_pool)
     if name == "TEST":
-        return FakeAllocator(logger)
+        return create_warm_pool(FakeAllocator(logger), logger, warm_pool)
     raise ValueError(f"Invalid job allocator {name}")
 
 
-async def main():
-    logger = create_logger("VSM_MASTER")
+def create_warm_pool(allocator: AwsAllocator | FakeAllocator, logger: Logger, enabled: bool) -> JobAllocator:
+    if not enabled or WARM_POOL_MAX_SIZE <= 0:
+        return allocator
+    pool = WarmPool(allocator, logger)
+    pool.start()
+    return pool
+
+
+def check_workers(workers: int, logger: Logger) -> None:
+    """Refuse the settings whose state lives in one process when running several workers."""
+    if workers <= 1:
+        return
+
+    # The pool lives in one worker, the others would always start cold jobs.
+    if WARM_POOL_MAX_SIZE > 0:
+        raise ValueError("The warm pool needs a single worker (VSM_WORKERS=1)")
+
+    # Token buckets and in-flight counts would be multiplied by the workers.
+    if ADMISSION_START_RATE_PER_SECOND > 0 or ADMISSION_MAX_IN_FLIGHT > 0:
+        raise ValueError("Start rate and in-flight admission limits need a single worker (VSM_WORKERS=1)")
 
+    if ADMISSION_MAX_JOBS_PER_USER > 0:
+        logger.warning(f"Per-user quota is checked per worker, concurrent starts can exceed it by {workers - 1}")
+
+
+async def prepare_db() -> None:
     connector = create_db_connector()
 
-    if RECREATE_DB:
+    try:
         async with await connector.connect() as connection:
-            await connection.recreate_table()
+            if RECREATE_DB:
+                await connection.recreate_table()
+            else:
+                await connection.upgrade_table()
+    finally:
+        await connector.close()
+
+
+async def main(settings: Settings, worker: int) -> None:
+    logger = create_logger("VSM_MASTER")
+
+    # Singleton background tasks (cleanup, warm pool) only run in the first worker.
+    singleton = worker == 0
+
+    logger.info(f"Starting worker {worker}")
+
+    connector = create_db_connector()
 
     cafile = None
     if os.path.exists(UNICORE_CA_FILE):
@@ -51,26 +101,40 @@ async def main():
     async with session:
         authenticator = Authenticator(session, logger)
 
-        allocator = create_allocator(JOB_ALLOCATOR, session, logger)
+        allocator = create_allocator(JOB_ALLOCATOR, session, logger, warm_pool=singleton)
 
         scheduler = JobScheduler(allocator, authenticator, connector, logger)
 
-        cleanup_task = asyncio.create_task(scheduler.cleanup_expired_jobs())
+        cleanup_task = asyncio.create_task(scheduler.cleanup_expired_jobs()) if singleton else None
 
         routes = [
             web.post("/start", scheduler.start),
             web.post("/stop/{job_id:[^{}]+}", scheduler.stop),
+            web.post("/extend/{job_id:[^{}]+}", scheduler.extend),
+            web.get("/jobs", scheduler.list_jobs),
+            web.get("/status/{job_id:[^{}/]+}/wait", scheduler.wait_status),
             web.get("/status/{job_id:[^{}]+}", scheduler.get_status),
         ]
 
         try:
-            await run_application("VSM", MASTER_PORT, logger, routes)
+            await run_application("VSM", settings, logger, routes)
         finally:
-            cleanup_task.cancel()
-            with suppress(asyncio.CancelledError):
-                await cleanup_task
+            if cleanup_task is not None:
+                cleanup_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await cleanup_task
+            await scheduler.close()
             await allocator.close()
+            await connector.close()
 
 
 def run_master() -> None:
-    asyncio.run(main())
+    settings = parse_argv("VSM", MASTER_PORT)
+    logger = create_logger("VSM_MASTER")
+
+    check_workers(settings.workers, logger)
+
+    # Once before forking so that workers never race on the schema.
+    asyncio.run(prepare_db())
+
+    run_workers(settings.workers, lambda worker: run_async(main(settings, worker)), logger)
@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from collections.abc import Iterable
+
+from aiohttp import web
+
+Labels = tuple[str, ...]
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (1.0, 10.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 14400.0, 28800.0)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        REGISTRY.register(self)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+
+    def _format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values = dict[Labels, float]()
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for labels, value in self._values.items():
+            yield f"{self.name}{self._format_labels(labels)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, value: float = 1) -> None:
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+    def remove(self, *labels: str) -> None:
+        self._values.pop(labels, None)
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Labels = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self._buckets = buckets
+        self._counts = dict[Labels, list[int]]()
+        self._sums = dict[Labels, float]()
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self._buckets) + 1)
+            self._sums[labels] = 0
+        counts[bisect_left(self._buckets, value)] += 1
+        self._sums[labels] += value
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self._buckets, counts):
+                total += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._format_labels(labels, le)} {total}"
+            total += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{self._format_labels(labels, le)} {total}"
+            yield f"{self.name}_sum{self._format_labels(labels)} {self._sums[labels]}"
+            yield f"{self.name}_count{self._format_labels(labels)} {total}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics = dict[str, Metric]()
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicated metric {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
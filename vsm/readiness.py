@@ -0,0 +1,183 @@
+import asyncio
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import Logger
+
+from aiohttp import web
+
+from .allocator import JobAllocator, JobDetails
+from .db import DbConnector, JobState
+from .metrics import Counter, Gauge
+from .settings import (
+    JOB_BOOT_TIMEOUT_SECONDS,
+    JOB_READINESS_INITIAL_DELAY_SECONDS,
+    JOB_READINESS_MAX_DELAY_SECONDS,
+)
+from .tracing import span, trace
+
+TRACKED_JOBS = Gauge("vsm_readiness_tracked_jobs", "Jobs waiting to become ready")
+WAITING_CLIENTS = Gauge("vsm_readiness_waiters", "Clients waiting for a job to become ready")
+TRACKED_RESULTS = Counter("vsm_readiness_results_total", "Readiness tracking outcomes", ("state",))
+
+
+@dataclass
+class Tracking:
+    future: asyncio.Future[JobState]
+    task: asyncio.Task[None]
+
+
+class ReadinessTracker:
+    """Poll the allocator in the background until a job is ready and store the outcome once."""
+
+    def __init__(
+        self,
+        allocator: JobAllocator,
+        connector: DbConnector,
+        logger: Logger,
+        initial_delay: float = JOB_READINESS_INITIAL_DELAY_SECONDS,
+        max_delay: float = JOB_READINESS_MAX_DELAY_SECONDS,
+        boot_timeout: float = JOB_BOOT_TIMEOUT_SECONDS,
+    ) -> None:
+        self._allocator = allocator
+        self._connector = connector
+        self._logger = logger
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._boot_timeout = boot_timeout
+        self._tracked = dict[str, Tracking]()
+
+    def track(self, token: str, job_id: str) -> None:
+        self._track(token, job_id)
+
+    async def wait(self, token: str, job_id: str, timeout: float) -> JobState:
+        tracking = self._track(token, job_id)
+
+        WAITING_CLIENTS.inc()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(tracking.future), timeout)
+        except asyncio.TimeoutError:
+            return JobState.PENDING
+        finally:
+            WAITING_CLIENTS.dec()
+
+    async def cancel(self, job_id: str) -> None:
+        """Stop tracking a job, e.g. before it is destroyed."""
+        tracking = self._tracked.get(job_id)
+
+        if tracking is None:
+            return
+
+        tracking.task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await tracking.task
+
+    async def close(self) -> None:
+        tasks = [tracking.task for tracking in self._tracked.values()]
+
+        for task in tasks:
+            task.cancel()
+
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+
+    def _track(self, token: str, job_id: str) -> Tracking:
+        tracking = self._tracked.get(job_id)
+
+        if tracking is not None:
+            return tracking
+
+        future = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._run(token, job_id, future))
+        tracking = Tracking(future, task)
+
+        self._tracked[job_id] = tracking
+        TRACKED_JOBS.inc()
+
+        task.add_done_callback(lambda _: self._untrack(job_id, tracking))
+
+        return tracking
+
+    def _untrack(self, job_id: str, tracking: Tracking) -> None:
+        if self._tracked.get(job_id) is tracking:
+            del self._tracked[job_id]
+            TRACKED_JOBS.dec()
+
+        if not tracking.future.done():
+            tracking.future.set_exception(web.HTTPInternalServerError(text="Job readiness tracking stopped"))
+
+        # Mark the outcome as retrieved even when no client was waiting for it.
+        tracking.future.exception()
+
+    async def _run(self, token: str, job_id: str, future: asyncio.Future[JobState]) -> None:
+        self._logger.info(f"Tracking readiness of job {job_id}")
+
+        host, state = await self._poll(token, job_id)
+
+        self._logger.info(f"Job {job_id} is {state} (host={host!r})")
+
+        # Own trace per poll and for the result, the task outlives the request
+        # that started the tracking and the boot time is not an operation.
+        with trace("readiness_result", job_id=job_id):
+            await self._store_result(job_id, host, state, future)
+
+    async def _store_result(self, job_id: str, host: str, state: JobState, future: asyncio.Future[JobState]) -> None:
+        try:
+            async with await self._connector.connect() as connection:
+                await connection.update_job(job_id, host, state)
+        except Exception as e:
+            # The job stays pending in the DB, next status call resumes tracking.
+            self._logger.critical(f"DB error while updating job state: {e}")
+            future.set_exception(web.HTTPInternalServerError(text="Internal DB error (job state is not updated)"))
+            return
+
+        TRACKED_RESULTS.inc(state)
+        future.set_result(state)
+
+        # A failed job would otherwise keep its task up until its end time.
+        if state == JobState.FAILED:
+            await self._destroy(job_id)
+
+    async def _poll(self, token: str, job_id: str) -> tuple[str, JobState]:
+        deadline = time.monotonic() + self._boot_timeout
+        delay = self._initial_delay
+
+        while True:
+            with trace("readiness_poll", job_id=job_id):
+                details = await self._get_details(token, job_id)
+
+            if details.failed:
+                return "", JobState.FAILED
+
+            if details.host is not None:
+                return details.host, JobState.READY
+
+            if time.monotonic() + delay > deadline:
+                self._logger.error(f"Job {job_id} did not become ready in {self._boot_timeout}s")
+                return "", JobState.FAILED
+
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, self._max_delay)
+
+    async def _destroy(self, job_id: str) -> None:
+        self._logger.info(f"Stopping failed job {job_id}")
+
+        try:
+            await self._allocator.destroy_job(job_id)
+        except Exception as e:
+            # The cleanup of expired jobs retries at its end time.
+            self._logger.error(f"Failed to stop failed job {job_id}: {e}")
+
+    async def _get_details(self, token: str, job_id: str) -> JobDetails:
+        try:
+            with span("allocator", operation="get_job_details"):
+                return await self._allocator.get_job_details(token, job_id)
+        except web.HTTPException as e:
+            self._logger.error(f"Allocator rejected job {job_id}: {e.text}")
+            return JobDetails(failed=True)
+        except Exception as e:
+            self._logger.error(f"Cannot get details of job {job_id}: {e}")
+            return JobDetails()
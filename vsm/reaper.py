@@ -0,0 +1,96 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from logging import Logger
+
+from .allocator import JobAllocator
+from .db import DbConnector
+from .metrics import Counter
+from .settings import (
+    JOB_CLEANUP_CONCURRENCY,
+    JOB_CLEANUP_MAX_RETRY_SECONDS,
+    JOB_CLEANUP_PERIOD_SECONDS,
+    JOB_CLEANUP_RETRY_SECONDS,
+)
+
+REAPED_JOBS = Counter("vsm_reaped_jobs_total", "Expired jobs processed by the reaper", ("result",))
+
+
+@dataclass
+class ReapFailure:
+    attempts: int
+    retry_at: float
+    error: str
+    seen_at: float
+
+
+class JobReaper:
+    def __init__(self, allocator: JobAllocator, connector: DbConnector, logger: Logger) -> None:
+        self._allocator = allocator
+        self._connector = connector
+        self._logger = logger
+        self._semaphore = asyncio.Semaphore(JOB_CLEANUP_CONCURRENCY)
+        self._failures = dict[str, ReapFailure]()
+
+    @property
+    def failures(self) -> dict[str, ReapFailure]:
+        return dict(self._failures)
+
+    async def reap(self, ids: list[str]) -> list[str]:
+        """Stop the given jobs and remove them from the DB, return the IDs removed."""
+        now = time.monotonic()
+
+        self._prune(ids, now)
+
+        due = [id for id in ids if id not in self._failures or self._failures[id].retry_at <= now]
+
+        results = await asyncio.gather(*(self._stop(id) for id in due))
+        stopped = [id for id, ok in zip(due, results) if ok]
+
+        if not stopped:
+            return []
+
+        self._logger.info(f"Removing {len(stopped)} stopped jobs from DB")
+
+        async with await self._connector.connect() as connection:
+            await connection.delete_jobs(stopped)
+
+        return stopped
+
+    async def _stop(self, id: str) -> bool:
+        async with self._semaphore:
+            self._logger.info(f"Stopping job {id}")
+            try:
+                await self._allocator.destroy_job(id)
+            except Exception as e:
+                self._record_failure(id, e)
+                return False
+
+        self._failures.pop(id, None)
+        REAPED_JOBS.inc("stopped")
+        return True
+
+    def _prune(self, ids: list[str], now: float) -> None:
+        # Failed jobs come back in every cleanup until they are stopped, the
+        # ones missing for a while were stopped or deleted some other way.
+        for id in ids:
+            failure = self._failures.get(id)
+            if failure is not None:
+                failure.seen_at = now
+
+        forgotten = now - 2 * JOB_CLEANUP_PERIOD_SECONDS
+
+        for id, failure in list(self._failures.items()):
+            if failure.seen_at < forgotten:
+                del self._failures[id]
+
+    def _record_failure(self, id: str, error: Exception) -> None:
+        failure = self._failures.get(id)
+        attempts = 1 if failure is None else failure.attempts + 1
+        delay = min(JOB_CLEANUP_RETRY_SECONDS * 2 ** (attempts - 1), JOB_CLEANUP_MAX_RETRY_SECONDS)
+
+        self._logger.critical(f"Failed to stop job {id} (attempt {attempts}, retry in {delay:.0f}s): {error}")
+
+        now = time.monotonic()
+        self._failures[id] = ReapFailure(attempts, now + delay, str(error), now)
+        REAPED_JOBS.inc("failed")
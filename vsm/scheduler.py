@@ -1,17 +1,35 @@
 import asyncio
 import json
-from datetime import datetime, timedelta
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
 from logging import Logger
+from typing import Any
 
 from aiohttp import web
 
-from .allocator import JobAllocator, JobDetails
+from .admission import AdmissionController
+from .allocator import JobAllocator
 from .authenticator import Authenticator
-from .db import DbConnector, Job
-from .settings import JOB_CLEANUP_PERIOD_SECONDS, JOB_DURATION_SECONDS, PROXY_URL
+from .db import DbConnection, DbConnector, Job, JobState
+from .readiness import ReadinessTracker
+from .reaper import JobReaper
+from .settings import (
+    JOB_CLEANUP_PAGE_SIZE,
+    JOB_CLEANUP_PERIOD_SECONDS,
+    JOB_DURATION_SECONDS,
+    JOB_IDLE_TIMEOUT_SECONDS,
+    JOB_LIST_DEFAULT_PAGE_SIZE,
+    JOB_LIST_MAX_PAGE_SIZE,
+    JOB_STATUS_MAX_WAIT_SECONDS,
+    PROXY_URL,
+)
+from .tracing import span, trace
 
 CLEANUP_PERIOD = timedelta(seconds=JOB_CLEANUP_PERIOD_SECONDS)
 JOB_DURATION = timedelta(seconds=JOB_DURATION_SECONDS)
+JOB_IDLE_TIMEOUT = timedelta(seconds=JOB_IDLE_TIMEOUT_SECONDS)
+
+JobQuery = Callable[[DbConnection, int], Awaitable[list[Job]]]
 
 
 class JobScheduler:
@@ -26,6 +44,12 @@ class JobScheduler:
         self._authenticator = authenticator
         self._connector = connector
         self._logger = logger
+        self._reaper = JobReaper(allocator, connector, logger)
+        self._readiness = ReadinessTracker(allocator, connector, logger)
+        self._admission = AdmissionController(connector, logger)
+
+    async def close(self) -> None:
+        await self._readiness.close()
 
     async def start(self, request: web.Request) -> web.Response:
         self._logger.info("Start request received")
@@ -47,26 +71,30 @@ class JobScheduler:
 
         self._logger.debug(f"Request body {payload}")
 
-        job_id = await self._allocator.create_job(token, payload)
+        async with self._admission.admit(user_id):
+            with span("allocator", operation="create_job"):
+                job_id = await self._allocator.create_job(token, payload)
 
-        start_time = datetime.now()
-        end_time = start_time + JOB_DURATION
+            start_time = datetime.now(timezone.utc)
+            end_time = start_time + JOB_DURATION
 
-        job = Job(job_id, user_id, start_time, end_time)
+            job = Job(job_id, user_id, start_time, end_time)
 
-        self._logger.debug(f"Job details: {job}")
+            self._logger.debug(f"Job details: {job}")
 
-        self._logger.info("Saving new job to DB")
+            self._logger.info("Saving new job to DB")
 
-        try:
-            async with await self._connector.connect() as connection:
-                await connection.insert_job(job)
-        except Exception as e:
-            self._logger.critical(f"Failed to save job to DB: {e}")
-            raise web.HTTPInternalServerError(text="Internal DB error (job is started but not registered)")
+            try:
+                async with await self._connector.connect() as connection:
+                    await connection.insert_job(job)
+            except Exception as e:
+                self._logger.critical(f"Failed to save job to DB: {e}")
+                raise web.HTTPInternalServerError(text="Internal DB error (job is started but not registered)")
 
         self._logger.info("Job saved to DB")
 
+        self._readiness.track(token, job_id)
+
         return web.HTTPCreated(text=json.dumps({"job_id": job_id}))
 
     async def stop(self, request: web.Request) -> web.Response:
@@ -87,6 +115,35 @@ class JobScheduler:
 
         return web.HTTPOk()
 
+    async def extend(self, request: web.Request) -> web.Response:
+        self._logger.info("Extend request received")
+
+        token = self._authenticator.get_token(request)
+        user_id = await self._authenticator.get_username(token)
+
+        job_id = self._get_job_id_from_path(request)
+
+        job = await self._get_job_from_db(job_id)
+
+        await self._check_user_owns_job(job, user_id)
+
+        now = datetime.now(timezone.utc)
+        end_time = max(job.end_time, now + JOB_DURATION)
+
+        self._logger.info(f"Extending job {job_id} until {end_time}")
+
+        try:
+            async with await self._connector.connect() as connection:
+                await connection.extend_job(job_id, end_time, now)
+        except Exception as e:
+            self._logger.error(f"DB error while extending job: {e}")
+            raise web.HTTPInternalServerError(text="Internal DB error (cannot extend job)")
+
+        job.end_time = end_time
+        job.last_activity = now
+
+        return _serialize_response(job)
+
     async def get_status(self, request: web.Request) -> web.Response:
         self._logger.info("Status request received")
 
@@ -101,53 +158,137 @@ class JobScheduler:
 
         await self._check_user_owns_job(job, user_id)
 
-        details = await self._allocator.get_job_details(token, job_id)
+        if job.state == JobState.PENDING:
+            # Resume tracking of jobs started before a master restart.
+            self._readiness.track(token, job_id)
 
-        if details.end_time is None:
-            self._logger.info("Using endtime from DB as allocator did not provide it")
-            details.end_time = job.end_time
+        self._logger.info(f"Job state: {job.state}")
 
-        self._logger.info(f"Job details: {details}")
+        return _serialize_response(job)
 
-        if details.host is None:
-            return _serialize_response(job_id, details)
+    async def wait_status(self, request: web.Request) -> web.Response:
+        self._logger.info("Status wait request received")
+
+        token = self._authenticator.get_token(request)
+        user_id = await self._authenticator.get_username(token)
+
+        job_id = self._get_job_id_from_path(request)
+        timeout = self._get_timeout_from_query(request)
+
+        self._logger.info(f"Job ID to wait for {job_id} ({timeout=})")
+
+        job = await self._get_job_from_db(job_id)
+
+        await self._check_user_owns_job(job, user_id)
+
+        if job.state == JobState.PENDING:
+            job.state = await self._readiness.wait(token, job_id, timeout)
+
+        self._logger.info(f"Job state: {job.state}")
+
+        return _serialize_response(job)
+
+    async def list_jobs(self, request: web.Request) -> web.Response:
+        self._logger.info("List request received")
+
+        token = self._authenticator.get_token(request)
+        user_id = await self._authenticator.get_username(token)
+
+        if user_id is None:
+            self._logger.warn("Using sandbox user for DB")
+            user_id = "SANDBOX_USER"
+
+        cursor = request.query.get("cursor")
+        limit = self._get_limit_from_query(request)
+        state = self._get_state_from_query(request)
+        start = self._get_time_from_query(request, "start")
+        end = self._get_time_from_query(request, "end")
+
+        self._logger.info(f"Listing jobs of {user_id} ({limit=} {state=} {start=} {end=})")
 
         try:
             async with await self._connector.connect() as connection:
-                await connection.update_job(job_id, details.host)
+                page = await connection.get_jobs_by_user(user_id, cursor, limit, state, start, end)
+        except ValueError as e:
+            self._logger.error(f"Invalid cursor {cursor}: {e}")
+            raise web.HTTPBadRequest(text="Invalid cursor")
         except Exception as e:
-            self._logger.critical(f"DB error while updating jobs: {e}")
-            raise web.HTTPInternalServerError(text="Internal DB error (job host is not updated)")
+            self._logger.error(f"DB error while listing jobs: {e}")
+            raise web.HTTPInternalServerError(text="Internal DB error (cannot list jobs)")
+
+        jobs = [
+            {"job_id": job.id, "start_time": job.start_time.isoformat(), **_describe_job(job)} for job in page.jobs
+        ]
 
-        self._logger.info("Updated job host in DB")
+        message = {
+            "jobs": jobs,
+            "cursor": page.cursor,
+        }
 
-        return _serialize_response(job_id, details)
+        return web.HTTPOk(text=json.dumps(message))
 
     async def cleanup_expired_jobs(self) -> None:
         while True:
             await asyncio.sleep(CLEANUP_PERIOD.total_seconds())
+            now = datetime.now(timezone.utc)
+            with trace("expired_cleanup"):
+                await self._cleanup_expired_jobs(now)
+            if JOB_IDLE_TIMEOUT:
+                with trace("idle_cleanup"):
+                    await self._cleanup_idle_jobs(now)
+
+    async def _cleanup_expired_jobs(self, now: datetime) -> None:
+        await self._cleanup_jobs("expired", lambda connection, limit: connection.get_expired_jobs(now, limit))
+
+    async def _cleanup_idle_jobs(self, now: datetime) -> None:
+        before = now - JOB_IDLE_TIMEOUT
+        await self._cleanup_jobs("idle", lambda connection, limit: connection.get_idle_jobs(before, limit))
+
+    async def _cleanup_jobs(self, reason: str, query: JobQuery) -> None:
+        skipped = set[str]()
+        done = set[str]()
+
+        while True:
+            # Jobs that failed to stop stay in the DB and come back first,
+            # fetch that many extra rows to always make progress.
+            limit = JOB_CLEANUP_PAGE_SIZE + len(skipped)
 
             try:
                 async with await self._connector.connect() as connection:
-                    jobs = await connection.get_jobs()
+                    jobs = await query(connection, limit)
             except Exception as e:
                 self._logger.critical(f"DB error while cleaning jobs: {e}")
+                return
+
+            # Index reads can be eventually consistent (DynamoDB GSI) and
+            # return jobs that were just deleted.
+            due = [job.id for job in jobs if job.id not in skipped and job.id not in done]
+
+            if not due:
+                return
 
-            now = datetime.now()
+            self._logger.info(f"Cleaning up {len(due)} {reason} jobs")
 
-            for job in jobs:
-                if now < job.end_time:
-                    continue
+            try:
+                stopped = await self._reaper.reap(due)
+            except Exception as e:
+                self._logger.critical(f"DB error while removing stopped jobs: {e}")
+                return
+
+            done.update(stopped)
+            skipped.update(set(due) - done)
 
-                try:
-                    await self._kill_job(job.id)
-                except Exception as e:
-                    self._logger.critical(f"Failed to cleanup job {job.id}: {e}")
+            if len(jobs) < limit:
+                return
 
     async def _kill_job(self, job_id: str) -> None:
         self._logger.info(f"Stopping job {job_id}")
 
-        await self._allocator.destroy_job(job_id)
+        # Tracking would otherwise update the row after it is deleted.
+        await self._readiness.cancel(job_id)
+
+        with span("allocator", operation="destroy_job"):
+            await self._allocator.destroy_job(job_id)
 
         self._logger.info(f"Removing job {job_id} from DB")
 
@@ -193,16 +334,75 @@ class JobScheduler:
 
         return job_id
 
+    def _get_timeout_from_query(self, request: web.Request) -> float:
+        value = request.query.get("timeout", str(JOB_STATUS_MAX_WAIT_SECONDS))
 
-def _serialize_response(job_id: str, details: JobDetails) -> web.Response:
-    assert details.end_time is not None
+        try:
+            timeout = float(value)
+        except ValueError:
+            self._logger.error(f"Invalid wait timeout {value}")
+            raise web.HTTPBadRequest(text=f"Invalid timeout {value}")
+
+        return min(max(timeout, 0), JOB_STATUS_MAX_WAIT_SECONDS)
+
+    def _get_limit_from_query(self, request: web.Request) -> int:
+        value = request.query.get("limit", str(JOB_LIST_DEFAULT_PAGE_SIZE))
+
+        try:
+            limit = int(value)
+        except ValueError:
+            self._logger.error(f"Invalid page size {value}")
+            raise web.HTTPBadRequest(text=f"Invalid limit {value}")
+
+        return min(max(limit, 1), JOB_LIST_MAX_PAGE_SIZE)
+
+    def _get_state_from_query(self, request: web.Request) -> JobState | None:
+        value = request.query.get("state")
+
+        if value is None:
+            return None
+
+        try:
+            return JobState(value)
+        except ValueError:
+            self._logger.error(f"Invalid job state {value}")
+            raise web.HTTPBadRequest(text=f"Invalid state {value}")
+
+    def _get_time_from_query(self, request: web.Request, name: str) -> datetime | None:
+        value = request.query.get(name)
+
+        if value is None:
+            return None
+
+        try:
+            time = datetime.fromisoformat(value)
+        except ValueError:
+            self._logger.error(f"Invalid {name} time {value}")
+            raise web.HTTPBadRequest(text=f"Invalid {name} {value} (ISO 8601 expected)")
+
+        if time.tzinfo is None:
+            return time.replace(tzinfo=timezone.utc)
+
+        return time
+
+
+def _describe_job(job: Job) -> dict[str, Any]:
+    ready = job.state == JobState.READY
 
     message = {
-        "ready": details.ready,
-        "end_time": details.end_time.isoformat(),
+        "ready": ready,
+        "state": job.state,
+        "end_time": job.end_time.isoformat(),
     }
 
-    if details.ready:
-        message["job_url"] = f"{PROXY_URL}/{job_id}/renderer"
+    if job.last_activity is not None:
+        message["last_activity"] = job.last_activity.isoformat()
+
+    if ready:
+        message["job_url"] = f"{PROXY_URL}/{job.id}/renderer"
+
+    return message
+
 
-    return web.HTTPOk(text=json.dumps(message))
+def _serialize_response(job: Job) -> web.Response:
+    return web.HTTPOk(text=json.dumps(_describe_job(job)))
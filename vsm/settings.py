@@ -3,7 +3,8 @@ import os
 BASE_HOST = "127.0.0.1"
 MASTER_PORT = 4444
 SLAVE_PORT = 8888
-BRAYNS_PORT = 5000
+BRAYNS_PORT = int(os.getenv("VSM_BRAYNS_PORT", "5000"))
+WORKERS = int(os.getenv("VSM_WORKERS", "1"))
 
 CERT_CRT = os.getenv("VSM_SSL_CRT", "sslcert.crt")
 CERT_KEY = os.getenv("VSM_SSL_KEY", "sslcert.key")
@@ -11,23 +12,96 @@ CERT_KEY = os.getenv("VSM_SSL_KEY", "sslcert.key")
 # Debug/logging
 LOG_LEVEL = os.getenv("VSM_LOG_LEVEL", "DEBUG").upper()
 
-# DB
+# DB (dynamodb, postgresql, sqlite or memory)
+DB_TYPE = os.getenv("VSM_DB_ENGINE", "dynamodb")
+DB_SQLITE_PATH = os.getenv("VSM_DB_SQLITE_PATH", "vsm.db")
 DB_HOST = os.getenv("VSM_DB_HOST", "localhost:5432")
 DB_NAME = os.getenv("VSM_DB_NAME", "")
 DB_USERNAME = os.getenv("VSM_DB_USERNAME", "")
 DB_PASSWORD = os.getenv("VSM_DB_PASSWORD", "")
 RECREATE_DB = bool(int(os.getenv("VSM_RECREATE_DB", "0")))
+DB_POOL = bool(int(os.getenv("VSM_DB_POOL", "1")))
+DB_POOL_MIN_SIZE = int(os.getenv("VSM_DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("VSM_DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("VSM_DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "5"))
+DB_POOL_MAX_QUERIES = int(os.getenv("VSM_DB_POOL_MAX_QUERIES", "50000"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("VSM_DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_POOL_HEALTH_CHECK = bool(int(os.getenv("VSM_DB_POOL_HEALTH_CHECK", "0")))
 
 # DynamoDB
 DBD_TABLE_NAME = os.getenv("VSM_DB_TABLE_NAME", "viz-vsm-jobs-table")
-DB_TYPE = "postgresql" if (os.getenv("VSM_DB_ENGINE") == "postgresql") else "dynamodb"
+# GSI with expiry_partition as partition key and end_time as sort key, without
+# it the cleanup of expired jobs scans the whole table every period.
+DBD_EXPIRY_INDEX = os.getenv("VSM_DBD_EXPIRY_INDEX", "")
+DBD_USER_INDEX = os.getenv("VSM_DBD_USER_INDEX", "")
+# GSI with expiry_partition as partition key and last_activity as sort key,
+# without it the stop of idle jobs scans the whole table every period.
+DBD_IDLE_INDEX = os.getenv("VSM_DBD_IDLE_INDEX", "")
+DBD_MAX_CONCURRENCY = int(os.getenv("VSM_DBD_MAX_CONCURRENCY", "10"))
+DBD_CALL_TIMEOUT_SECONDS = float(os.getenv("VSM_DBD_CALL_TIMEOUT_SECONDS", "10"))
 
-# Job allocation (UNICORE or AWS)
+# Job allocation (UNICORE, AWS or TEST)
 JOB_ALLOCATOR = os.getenv("VSM_JOB_ALLOCATOR", "AWS")
+FAKE_ALLOCATOR_DELAY_SECONDS = float(os.getenv("VSM_FAKE_ALLOCATOR_DELAY_SECONDS", "0"))
+FAKE_ALLOCATOR_BOOT_SECONDS = float(os.getenv("VSM_FAKE_ALLOCATOR_BOOT_SECONDS", "0"))
 JOB_DURATION_SECONDS = int(os.getenv("VSM_JOB_DURATION_SECONDS", "28800"))
 JOB_CLEANUP_PERIOD_SECONDS = int(os.getenv("VSM_JOB_CLEANUP_PERIOD_SECONDS", "10"))
+JOB_CLEANUP_PAGE_SIZE = int(os.getenv("VSM_JOB_CLEANUP_PAGE_SIZE", "100"))
+JOB_CLEANUP_CONCURRENCY = int(os.getenv("VSM_JOB_CLEANUP_CONCURRENCY", "10"))
+JOB_CLEANUP_RETRY_SECONDS = float(os.getenv("VSM_JOB_CLEANUP_RETRY_SECONDS", "30"))
+JOB_CLEANUP_MAX_RETRY_SECONDS = float(os.getenv("VSM_JOB_CLEANUP_MAX_RETRY_SECONDS", "3600"))
+JOB_READINESS_INITIAL_DELAY_SECONDS = float(os.getenv("VSM_JOB_READINESS_INITIAL_DELAY_SECONDS", "1"))
+JOB_READINESS_MAX_DELAY_SECONDS = float(os.getenv("VSM_JOB_READINESS_MAX_DELAY_SECONDS", "30"))
+JOB_BOOT_TIMEOUT_SECONDS = float(os.getenv("VSM_JOB_BOOT_TIMEOUT_SECONDS", "1800"))
+JOB_LIST_DEFAULT_PAGE_SIZE = int(os.getenv("VSM_JOB_LIST_DEFAULT_PAGE_SIZE", "20"))
+JOB_LIST_MAX_PAGE_SIZE = int(os.getenv("VSM_JOB_LIST_MAX_PAGE_SIZE", "100"))
+JOB_STATUS_MAX_WAIT_SECONDS = float(os.getenv("VSM_JOB_STATUS_MAX_WAIT_SECONDS", "60"))
+# Ready jobs without client messages or connections for that long are stopped (0 disables)
+JOB_IDLE_TIMEOUT_SECONDS = int(os.getenv("VSM_JOB_IDLE_TIMEOUT_SECONDS", "0"))
 PROXY_URL = os.getenv("VSM_PROXY_URL", "localhost:8888")
 
+# Admission control on job start (0 disables a limit)
+ADMISSION_MAX_JOBS_PER_USER = int(os.getenv("VSM_ADMISSION_MAX_JOBS_PER_USER", "0"))
+ADMISSION_START_RATE_PER_SECOND = float(os.getenv("VSM_ADMISSION_START_RATE_PER_SECOND", "0"))
+ADMISSION_START_BURST = int(os.getenv("VSM_ADMISSION_START_BURST", "5"))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("VSM_ADMISSION_MAX_IN_FLIGHT", "0"))
+ADMISSION_QUOTA_RETRY_AFTER_SECONDS = int(os.getenv("VSM_ADMISSION_QUOTA_RETRY_AFTER_SECONDS", "60"))
+
+# Proxy
+ROUTER_CACHE_SIZE = int(os.getenv("VSM_ROUTER_CACHE_SIZE", "10000"))
+ROUTER_CACHE_TTL_SECONDS = float(os.getenv("VSM_ROUTER_CACHE_TTL_SECONDS", "3600"))
+ROUTER_NEGATIVE_TTL_SECONDS = float(os.getenv("VSM_ROUTER_NEGATIVE_TTL_SECONDS", "2"))
+ROUTER_RESYNC_PERIOD_SECONDS = float(os.getenv("VSM_ROUTER_RESYNC_PERIOD_SECONDS", "30"))
+ROUTER_RESYNC_BATCH_SIZE = int(os.getenv("VSM_ROUTER_RESYNC_BATCH_SIZE", "100"))
+PROXY_LOG_SAMPLE_RATE = int(os.getenv("VSM_PROXY_LOG_SAMPLE_RATE", "0"))
+# Largest message accepted from a client or Brayns (bytes), aiohttp reads each
+# message fully in memory and closes the session with 1009 above this size.
+# It bounds the memory of a session to about two messages (one per direction).
+PROXY_MAX_MESSAGE_SIZE = int(os.getenv("VSM_PROXY_MAX_MESSAGE_SIZE", str(64 * 1024 * 1024)))
+
+# Compression of the frames sent to clients (permessage-deflate)
+PROXY_COMPRESSION = bool(int(os.getenv("VSM_PROXY_COMPRESSION", "1")))
+PROXY_COMPRESS_TEXT_MIN_SIZE = int(os.getenv("VSM_PROXY_COMPRESS_TEXT_MIN_SIZE", "256"))
+PROXY_COMPRESS_BINARY_MIN_SIZE = int(os.getenv("VSM_PROXY_COMPRESS_BINARY_MIN_SIZE", "65536"))
+
+# Fan-out of one Brayns connection per job to a controller and read-only viewers
+PROXY_FANOUT = bool(int(os.getenv("VSM_PROXY_FANOUT", "0")))
+PROXY_FANOUT_QUEUE_SIZE = int(os.getenv("VSM_PROXY_FANOUT_QUEUE_SIZE", "64"))
+
+# Latest frame wins on Brayns to client binary frames, text is never dropped
+PROXY_DROP_FRAMES = bool(int(os.getenv("VSM_PROXY_DROP_FRAMES", "0")))
+PROXY_FRAME_QUEUE_SIZE = int(os.getenv("VSM_PROXY_FRAME_QUEUE_SIZE", "2"))
+
+# Period of the job activity writes of the proxy to the DB
+PROXY_ACTIVITY_PERIOD_SECONDS = float(os.getenv("VSM_PROXY_ACTIVITY_PERIOD_SECONDS", "60"))
+
+# Warm pool (disabled when max size is 0)
+WARM_POOL_MIN_SIZE = int(os.getenv("VSM_WARM_POOL_MIN_SIZE", "0"))
+WARM_POOL_MAX_SIZE = int(os.getenv("VSM_WARM_POOL_MAX_SIZE", "0"))
+WARM_POOL_DEMAND_WINDOW_SECONDS = float(os.getenv("VSM_WARM_POOL_DEMAND_WINDOW_SECONDS", "900"))
+WARM_POOL_REFILL_PERIOD_SECONDS = float(os.getenv("VSM_WARM_POOL_REFILL_PERIOD_SECONDS", "15"))
+WARM_POOL_BOOT_TIMEOUT_SECONDS = float(os.getenv("VSM_WARM_POOL_BOOT_TIMEOUT_SECONDS", "900"))
+
 # UNICORE
 UNICORE_ENDPOINT = os.getenv("VSM_UNICORE_ENDPOINT", "https://unicore.bbp.epfl.ch:8080/BB5-CSCS/rest/core")
 UNICORE_CA_FILE = os.getenv("VSM_UNICORE_CA_FILE", "/tmp/ca.pem")
@@ -40,6 +114,13 @@ AWS_CLUSTER = os.getenv("VSM_BRAYNS_TASK_CLUSTER", "viz_ecs_cluster")
 AWS_CAPACITY_PROVIDER = os.getenv("VSM_BRAYNS_TASK_CAPACITY_PROVIDER", "viz_ECS_CapacityProvider")
 AWS_BUCKET_NAME = os.getenv("VSM_BUCKET_NAME", "important-scientific-data")
 AWS_BUCKET_MOUNT_PATH = os.getenv("VSM_BUCKET_MOUNT_PATH", "/sbo/data/project")
+AWS_ASSIGNMENT_BUCKET = os.getenv("VSM_ASSIGNMENT_BUCKET", AWS_BUCKET_NAME)
+AWS_ASSIGNMENT_PREFIX = os.getenv("VSM_ASSIGNMENT_PREFIX", "vsm-assignments")
+AWS_MAX_CONCURRENCY = int(os.getenv("VSM_AWS_MAX_CONCURRENCY", "10"))
+AWS_CALL_TIMEOUT_SECONDS = float(os.getenv("VSM_AWS_CALL_TIMEOUT_SECONDS", "30"))
+AWS_DESCRIBE_BATCH_WINDOW_SECONDS = float(os.getenv("VSM_AWS_DESCRIBE_BATCH_WINDOW_SECONDS", "0.02"))
+AWS_DESCRIBE_CACHE_SECONDS = float(os.getenv("VSM_AWS_DESCRIBE_CACHE_SECONDS", "2"))
+AWS_TASK_MISSING_GRACE_SECONDS = float(os.getenv("VSM_AWS_TASK_MISSING_GRACE_SECONDS", "60"))
 
 # Keycloak
 USE_KEYCLOAK = bool(int(os.getenv("VSM_USE_KEYCLOAK", "1")))
@@ -47,3 +128,19 @@ KEYCLOAK_USER_INFO_URL = os.getenv(
     "VSM_KEYCLOAK_URL", "https://bbpauth.epfl.ch/auth/realms/BBP/protocol/openid-connect/userinfo"
 )
 KEYCLOAK_HOST = os.getenv("VSM_KEYCLOAK_HOST", "bbpauth.epfl.ch")
+KEYCLOAK_TOKEN_CACHE_SIZE = int(os.getenv("VSM_KEYCLOAK_TOKEN_CACHE_SIZE", "10000"))
+KEYCLOAK_TOKEN_CACHE_TTL_SECONDS = float(os.getenv("VSM_KEYCLOAK_TOKEN_CACHE_TTL_SECONDS", "300"))
+KEYCLOAK_LOCAL_VERIFY = bool(int(os.getenv("VSM_KEYCLOAK_LOCAL_VERIFY", "0")))
+KEYCLOAK_JWKS_URL = os.getenv("VSM_KEYCLOAK_JWKS_URL", KEYCLOAK_USER_INFO_URL.rsplit("/", 1)[0] + "/certs")
+KEYCLOAK_JWKS_REFRESH_SECONDS = float(os.getenv("VSM_KEYCLOAK_JWKS_REFRESH_SECONDS", "3600"))
+KEYCLOAK_ISSUER = os.getenv("VSM_KEYCLOAK_ISSUER") or None
+KEYCLOAK_AUDIENCE = os.getenv("VSM_KEYCLOAK_AUDIENCE") or None
+
+# Tracing, spans are exported as OTLP JSON to a file or a collector (none, file or otlp)
+TRACING_SERVER_TIMING = bool(int(os.getenv("VSM_TRACING_SERVER_TIMING", "1")))
+TRACING_EXPORT = os.getenv("VSM_TRACING_EXPORT", "none")
+TRACING_FILE = os.getenv("VSM_TRACING_FILE", "vsm-traces.jsonl")
+TRACING_OTLP_URL = os.getenv("VSM_TRACING_OTLP_URL", "http://localhost:4318/v1/traces")
+TRACING_SAMPLE_RATE = float(os.getenv("VSM_TRACING_SAMPLE_RATE", "1"))
+TRACING_EXPORT_PERIOD_SECONDS = float(os.getenv("VSM_TRACING_EXPORT_PERIOD_SECONDS", "5"))
+TRACING_EXPORT_MAX_TRACES = int(os.getenv("VSM_TRACING_EXPORT_MAX_TRACES", "10000"))
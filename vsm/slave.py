@@ -1,28 +1,57 @@
 import asyncio
+from contextlib import suppress
 
 from aiohttp import ClientSession, web
 
-from .application import run_application
+from .activity import ActivityRecorder
+from .application import Settings, parse_argv, run_application
 from .db_init import create_db_connector
+from .job_router import JobRouter
 from .logger import create_logger
-from .settings import SLAVE_PORT
+from .settings import PROXY_FANOUT, SLAVE_PORT
+from .supervisor import run_async, run_workers
 from .websocket_proxy import WebSocketProxy
 
 
-async def main():
+async def main(settings: Settings, worker: int) -> None:
     logger = create_logger("VSM_SLAVE")
 
+    logger.info(f"Starting worker {worker}")
+
     connector = create_db_connector()
 
+    router = JobRouter(connector, logger)
+
+    activity = ActivityRecorder(connector, logger)
+
     async with ClientSession() as session:
-        proxy = WebSocketProxy(session, connector, logger)
+        proxy = WebSocketProxy(session, router, activity, logger)
+
+        router_task = asyncio.create_task(router.run())
+        activity_task = asyncio.create_task(activity.run())
 
         routes = [
             web.get("/{job_id}/renderer", proxy.ws_handler),
+            web.get("/{job_id}/viewer", proxy.viewer_handler),
         ]
 
-        await run_application("VSM proxy", SLAVE_PORT, logger, routes)
+        try:
+            await run_application("VSM proxy", settings, logger, routes)
+        finally:
+            for task in (router_task, activity_task):
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+            await connector.close()
 
 
 def run_slave() -> None:
-    asyncio.run(main())
+    settings = parse_argv("VSM proxy", SLAVE_PORT)
+    logger = create_logger("VSM_SLAVE")
+
+    # Clients of the same job would land on different workers, each with its
+    # own Brayns connection and controller.
+    if PROXY_FANOUT and settings.workers > 1:
+        raise ValueError("Fan-out needs a single proxy worker (VSM_WORKERS=1)")
+
+    run_workers(settings.workers, lambda worker: run_async(main(settings, worker)), logger)
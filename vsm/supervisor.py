@@ -0,0 +1,126 @@
+import asyncio
+import os
+import signal
+import time
+import traceback
+from collections.abc import Callable, Coroutine
+from contextlib import suppress
+from logging import Logger
+from typing import Any
+
+# Workers dying sooner than this after their start are crash looping.
+MIN_UPTIME_SECONDS = 10
+MAX_RESTART_DELAY_SECONDS = 30
+
+
+def run_async(main: Coroutine[Any, Any, None]) -> None:
+    """Run main until it returns or the process gets SIGTERM/SIGINT, cancelling it to run its cleanup."""
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        assert task is not None
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, task.cancel)
+        await main
+
+    with suppress(asyncio.CancelledError):
+        asyncio.run(run())
+
+
+class Supervisor:
+    """Fork worker processes, restart the ones that die and stop them all on SIGTERM/SIGINT."""
+
+    def __init__(self, count: int, target: Callable[[int], None], logger: Logger) -> None:
+        self._count = count
+        self._target = target
+        self._logger = logger
+        self._workers = dict[int, int]()
+        self._started = dict[int, float]()
+        self._delays = dict[int, float]()
+        self._stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for index in range(self._count):
+            self._spawn(index)
+
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            if pid not in self._workers:
+                continue
+
+            index = self._workers.pop(pid)
+
+            if self._stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            delay = self._get_restart_delay(index)
+
+            self._logger.error(f"Worker {index} (pid {pid}) exited with code {code}, restarting in {delay}s")
+
+            time.sleep(delay)
+
+            if not self._stopping:
+                self._spawn(index)
+
+        self._logger.info("All workers stopped")
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self._target(index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+
+        self._logger.info(f"Worker {index} started with pid {pid}")
+
+        self._workers[pid] = index
+        self._started[index] = time.monotonic()
+
+    def _get_restart_delay(self, index: int) -> float:
+        uptime = time.monotonic() - self._started[index]
+
+        if uptime > MIN_UPTIME_SECONDS:
+            self._delays[index] = 0
+            return 0
+
+        delay = min(2 * self._delays.get(index, 0.5), MAX_RESTART_DELAY_SECONDS)
+        self._delays[index] = delay
+        return delay
+
+    def _stop(self, signum: int, _frame: Any) -> None:
+        if self._stopping:
+            return
+
+        self._logger.info(f"Received signal {signum}, stopping {len(self._workers)} workers")
+
+        self._stopping = True
+
+        for pid in self._workers:
+            with suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+
+def run_workers(count: int, target: Callable[[int], None], logger: Logger) -> None:
+    """Call target(index) in count forked workers, or directly in this process if count is 1."""
+    if count <= 1:
+        target(0)
+        return
+
+    Supervisor(count, target, logger).run()
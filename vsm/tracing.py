@@ -0,0 +1,357 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from logging import Logger
+from typing import Any
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+from .executor import BlockingExecutor
+from .metrics import Counter, Histogram
+from .settings import (
+    TRACING_EXPORT,
+    TRACING_EXPORT_MAX_TRACES,
+    TRACING_EXPORT_PERIOD_SECONDS,
+    TRACING_FILE,
+    TRACING_OTLP_URL,
+    TRACING_SAMPLE_RATE,
+    TRACING_SERVER_TIMING,
+)
+from .version import VERSION
+
+REQUEST_DURATION = Histogram("vsm_request_seconds", "Duration of traced requests and operations", ("endpoint",))
+SPAN_DURATION = Histogram(
+    "vsm_span_seconds", "Total duration of dependency calls per traced request", ("endpoint", "span")
+)
+EXPORTED_TRACES = Counter("vsm_tracing_exported_traces_total", "Traces handed to the exporter by result", ("result",))
+
+# Span kinds of OTLP.
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# Status code of OTLP.
+STATUS_ERROR = 2
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+UNTRACED = {"/healthz", "/metrics"}
+
+Attribute = str | int | float | bool
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    parent_id: str | None
+    kind: int = CLIENT
+    attributes: dict[str, Attribute] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: _new_id(64))
+    start_ns: int = field(default_factory=time.time_ns)
+    started: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    error: bool = False
+
+    def end(self) -> None:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+
+
+@dataclass
+class Trace:
+    root: Span
+    sampled: bool
+    spans: list[Span] = field(default_factory=list)
+    finished: bool = False
+
+    @property
+    def endpoint(self) -> str:
+        return self.root.name
+
+    def server_timing(self) -> str:
+        """Server-Timing header value with the total time per span name."""
+        totals = self._get_totals()
+        entries = [f"{name};dur={1000 * duration:.1f}" for name, duration in totals.items()]
+        entries.append(f"total;dur={1000 * (time.perf_counter() - self.root.started):.1f}")
+        return ", ".join(entries)
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+
+        self.finished = True
+        self.root.end()
+
+        assert self.root.duration is not None
+        REQUEST_DURATION.observe(self.root.duration, self.endpoint)
+
+        for name, duration in self._get_totals().items():
+            SPAN_DURATION.observe(duration, self.endpoint, name)
+
+        if self.sampled and _exporter is not None:
+            _exporter.add(self)
+
+    def _get_totals(self) -> dict[str, float]:
+        totals = dict[str, float]()
+        for span in self.spans:
+            if span.duration is not None:
+                totals[span.name] = totals.get(span.name, 0) + span.duration
+        return totals
+
+
+_trace = ContextVar[Trace | None]("vsm_trace", default=None)
+_span = ContextVar[Span | None]("vsm_span", default=None)
+
+
+@contextmanager
+def trace(
+    name: str,
+    kind: int = INTERNAL,
+    traceparent: str | None = None,
+    **attributes: Attribute,
+) -> Iterator[Trace]:
+    """Trace an operation (request or background work) and the spans opened under it."""
+    trace_id, parent_id = _new_id(128), None
+
+    match = TRACEPARENT.match(traceparent or "")
+
+    if match is not None:
+        trace_id, parent_id = match.groups()
+
+    root = Span(name, trace_id, parent_id, kind, attributes)
+    current = Trace(root, _exporter is not None and random.random() < TRACING_SAMPLE_RATE)
+
+    trace_token = _trace.set(current)
+    span_token = _span.set(root)
+
+    try:
+        yield current
+    except BaseException as e:
+        root.error = not isinstance(e, (web.HTTPException, asyncio.CancelledError))
+        raise
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        current.finish()
+
+
+@contextmanager
+def span(name: str, **attributes: Attribute) -> Iterator[Span | None]:
+    """Time a dependency call of the current trace, do nothing outside of one."""
+    current = _trace.get()
+
+    # Tasks inherit the trace of the request that created them, they may
+    # outlive it.
+    if current is None or current.finished:
+        yield None
+        return
+
+    parent = _span.get()
+    child = Span(name, current.root.trace_id, None if parent is None else parent.id, CLIENT, attributes)
+    current.spans.append(child)
+
+    token = _span.set(child)
+
+    try:
+        yield child
+    except BaseException as e:
+        child.error = not isinstance(e, (web.HTTPException, asyncio.CancelledError))
+        raise
+    finally:
+        child.end()
+        _span.reset(token)
+
+
+def finish() -> None:
+    """End the current trace early, for long lived requests such as WebSocket sessions."""
+    current = _trace.get()
+
+    if current is not None:
+        current.finish()
+
+
+def set_server_timing(headers: Any) -> None:
+    """Add the Server-Timing header of the current trace to headers, before they are sent."""
+    current = _trace.get()
+
+    if TRACING_SERVER_TIMING and current is not None:
+        headers["Server-Timing"] = current.server_timing()
+
+
+@web.middleware
+async def tracing_middleware(request: web.Request, handler: Any) -> web.StreamResponse:
+    resource = request.match_info.route.resource
+    endpoint = "unmatched" if resource is None else resource.canonical
+
+    if endpoint in UNTRACED:
+        return await handler(request)
+
+    with trace(
+        endpoint,
+        SERVER,
+        request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.route": endpoint},
+    ) as current:
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            current.root.attributes["http.status_code"] = e.status
+            set_server_timing(e.headers)
+            raise
+
+        current.root.attributes["http.status_code"] = response.status
+
+        if not response.prepared:
+            set_server_timing(response.headers)
+
+        return response
+
+
+def _export_attributes(attributes: dict[str, Attribute]) -> list[dict[str, Any]]:
+    exported = list[dict[str, Any]]()
+
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            exported.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            exported.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            exported.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            exported.append({"key": key, "value": {"stringValue": value}})
+
+    return exported
+
+
+def _export_span(span: Span) -> dict[str, Any]:
+    duration = span.duration or 0
+    exported = {
+        "traceId": span.trace_id,
+        "spanId": span.id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.start_ns + int(duration * 1e9)),
+        "attributes": _export_attributes(span.attributes),
+        "status": {"code": STATUS_ERROR} if span.error else {},
+    }
+
+    if span.parent_id is not None:
+        exported["parentSpanId"] = span.parent_id
+
+    return exported
+
+
+def to_otlp(service: str, traces: list[Trace]) -> dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest of the given traces."""
+    resource: dict[str, Attribute] = {"service.name": service, "service.version": VERSION, "process.pid": os.getpid()}
+    spans = [_export_span(span) for current in traces for span in (current.root, *current.spans)]
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _export_attributes(resource)},
+                "scopeSpans": [{"scope": {"name": "vsm", "version": VERSION}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """Buffer finished traces and periodically write them to a file (JSON lines) or an OTLP/HTTP collector."""
+
+    def __init__(self, service: str, target: str, logger: Logger) -> None:
+        if target not in ("file", "otlp"):
+            raise ValueError(f"Invalid tracing export {target}")
+
+        self._service = service
+        self._target = target
+        self._logger = logger
+        self._traces = list[Trace]()
+        self._executor = BlockingExecutor(1, name="tracing")
+        self._session: ClientSession | None = None
+
+    def add(self, trace: Trace) -> None:
+        if len(self._traces) >= TRACING_EXPORT_MAX_TRACES:
+            EXPORTED_TRACES.inc("dropped")
+            return
+
+        self._traces.append(trace)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(TRACING_EXPORT_PERIOD_SECONDS)
+                await self.flush()
+        finally:
+            await self.flush()
+            await self.close()
+
+    async def flush(self) -> None:
+        if not self._traces:
+            return
+
+        traces, self._traces = self._traces, []
+        payload = json.dumps(to_otlp(self._service, traces))
+
+        try:
+            if self._target == "file":
+                await self._executor.run(_append_line, TRACING_FILE, payload)
+            else:
+                await self._post(payload)
+        except Exception as e:
+            self._logger.error(f"Failed to export {len(traces)} traces: {e}")
+            EXPORTED_TRACES.inc("failed", value=len(traces))
+            return
+
+        EXPORTED_TRACES.inc("exported", value=len(traces))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._executor.close()
+
+    async def _post(self, payload: str) -> None:
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=10))
+
+        headers = {"Content-Type": "application/json"}
+
+        async with self._session.post(TRACING_OTLP_URL, data=payload, headers=headers) as response:
+            response.raise_for_status()
+
+
+def _append_line(path: str, line: str) -> None:
+    # One write per batch, workers can share the file.
+    with open(path, "a") as file:
+        file.write(line + "\n")
+
+
+_exporter: SpanExporter | None = None
+
+
+def start_export(service: str, logger: Logger) -> asyncio.Task | None:
+    """Export the sampled traces of this process according to settings, until the task is cancelled."""
+    global _exporter
+
+    if TRACING_EXPORT == "none":
+        return None
+
+    _exporter = SpanExporter(service, TRACING_EXPORT, logger)
+
+    logger.info(f"Exporting traces of {service} ({TRACING_EXPORT})")
+
+    return asyncio.create_task(_exporter.run())
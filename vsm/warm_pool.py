@@ -0,0 +1,235 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import suppress
+from logging import Logger
+from typing import Any, Protocol
+
+from aiohttp import web
+
+from .allocator import JobAllocator, JobDetails
+from .metrics import Counter, Gauge
+from .settings import (
+    WARM_POOL_BOOT_TIMEOUT_SECONDS,
+    WARM_POOL_DEMAND_WINDOW_SECONDS,
+    WARM_POOL_MAX_SIZE,
+    WARM_POOL_MIN_SIZE,
+    WARM_POOL_REFILL_PERIOD_SECONDS,
+)
+
+POOL_SIZE = Gauge("vsm_warm_pool_jobs", "Idle jobs in the warm pool by state", ("state",))
+POOL_STARTS = Counter("vsm_warm_pool_starts_total", "Job starts by origin", ("origin",))
+
+
+class PoolableAllocator(JobAllocator, Protocol):
+    async def create_idle_job(self) -> str: ...
+
+    async def assign_job(self, job_id: str, payload: dict[str, Any]) -> None: ...
+
+    async def list_idle_jobs(self) -> list[str]: ...
+
+
+class WarmPool(JobAllocator):
+    def __init__(
+        self,
+        allocator: PoolableAllocator,
+        logger: Logger,
+        min_size: int = WARM_POOL_MIN_SIZE,
+        max_size: int = WARM_POOL_MAX_SIZE,
+        demand_window: float = WARM_POOL_DEMAND_WINDOW_SECONDS,
+        refill_period: float = WARM_POOL_REFILL_PERIOD_SECONDS,
+        boot_timeout: float = WARM_POOL_BOOT_TIMEOUT_SECONDS,
+    ) -> None:
+        self._allocator = allocator
+        self._logger = logger
+        self._min_size = min_size
+        self._max_size = max_size
+        self._demand_window = demand_window
+        self._refill_period = refill_period
+        self._boot_timeout = boot_timeout
+        self._starting = dict[str, float]()
+        self._ready = dict[str, None]()
+        self._demand = deque[float]()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._background = set[asyncio.Task[None]]()
+
+    @property
+    def ready_size(self) -> int:
+        return len(self._ready)
+
+    @property
+    def starting_size(self) -> int:
+        return len(self._starting)
+
+    @property
+    def target_size(self) -> int:
+        now = time.monotonic()
+        while self._demand and self._demand[0] < now - self._demand_window:
+            self._demand.popleft()
+        return min(self._max_size, max(self._min_size, len(self._demand)))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+        idle = [*self._ready, *self._starting]
+        self._ready.clear()
+        self._starting.clear()
+
+        self._logger.info(f"Destroying {len(idle)} idle jobs from warm pool")
+
+        await asyncio.gather(*(self._destroy(job_id) for job_id in idle))
+        await self._allocator.close()
+
+    async def create_job(self, token: str, payload: dict[str, Any]) -> str:
+        self._demand.append(time.monotonic())
+        self._wakeup.set()
+
+        while self._ready:
+            job_id = next(iter(self._ready))
+            del self._ready[job_id]
+
+            self._logger.info(f"Assigning warm job {job_id}")
+
+            try:
+                await self._allocator.assign_job(job_id, payload)
+            except web.HTTPException:
+                self._ready[job_id] = None
+                raise
+            except Exception as e:
+                self._logger.error(f"Failed to assign warm job {job_id}: {e}")
+                task = asyncio.create_task(self._destroy(job_id))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                continue
+
+            POOL_STARTS.inc("warm")
+            return job_id
+
+        self._logger.info("Warm pool empty, starting a cold job")
+
+        POOL_STARTS.inc("cold")
+        return await self._allocator.create_job(token, payload)
+
+    async def destroy_job(self, job_id: str) -> None:
+        await self._allocator.destroy_job(job_id)
+
+    async def get_job_details(self, token: str, job_id: str) -> JobDetails:
+        return await self._allocator.get_job_details(token, job_id)
+
+    async def run(self) -> None:
+        await self.recover()
+
+        while True:
+            try:
+                await self.refill()
+            except Exception as e:
+                self._logger.error(f"Warm pool refill failed: {e}")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self._refill_period)
+
+            self._wakeup.clear()
+
+    async def recover(self) -> None:
+        """Adopt the idle jobs left running by a previous master (crash, kill or deploy)."""
+        try:
+            job_ids = await self._allocator.list_idle_jobs()
+        except Exception as e:
+            self._logger.error(f"Cannot list idle jobs of a previous run: {e}")
+            return
+
+        if not job_ids:
+            return
+
+        self._logger.info(f"Adopting {len(job_ids)} idle jobs of a previous run")
+
+        # Checked like new ones, then kept or scaled down to the target.
+        now = time.monotonic()
+        for job_id in job_ids:
+            if job_id not in self._ready:
+                self._starting.setdefault(job_id, now)
+
+    async def refill(self) -> None:
+        await asyncio.gather(self._check_starting(), self._check_ready())
+
+        target = self.target_size
+        missing = target - len(self._ready) - len(self._starting)
+        excess = len(self._ready) - target
+
+        if missing > 0:
+            self._logger.info(f"Starting {missing} idle jobs for warm pool (target {target})")
+            await asyncio.gather(*(self._start_idle() for _ in range(missing)))
+
+        if excess > 0:
+            self._logger.info(f"Scaling warm pool down by {excess} jobs (target {target})")
+            for job_id in list(self._ready)[:excess]:
+                # Assigned to a user during a previous await.
+                if job_id not in self._ready:
+                    continue
+                del self._ready[job_id]
+                await self._destroy(job_id)
+
+        POOL_SIZE.set("ready", value=len(self._ready))
+        POOL_SIZE.set("starting", value=len(self._starting))
+
+    async def _start_idle(self) -> None:
+        try:
+            job_id = await self._allocator.create_idle_job()
+        except Exception as e:
+            self._logger.error(f"Failed to start idle job: {e}")
+            return
+        self._starting[job_id] = time.monotonic()
+
+    async def _check_starting(self) -> None:
+        job_ids = list(self._starting)
+        ready = await asyncio.gather(*(self._is_ready(job_id) for job_id in job_ids))
+        now = time.monotonic()
+
+        for job_id, job_ready in zip(job_ids, ready):
+            started = self._starting.pop(job_id)
+
+            if job_ready:
+                self._logger.info(f"Idle job {job_id} is ready")
+                self._ready[job_id] = None
+                continue
+
+            if now - started > self._boot_timeout:
+                self._logger.error(f"Idle job {job_id} did not boot in time")
+                await self._destroy(job_id)
+                continue
+
+            self._starting[job_id] = started
+
+    async def _check_ready(self) -> None:
+        job_ids = list(self._ready)
+        ready = await asyncio.gather(*(self._is_ready(job_id) for job_id in job_ids))
+
+        for job_id, job_ready in zip(job_ids, ready):
+            # Skip jobs assigned to a user meanwhile.
+            if job_ready or job_id not in self._ready:
+                continue
+
+            self._logger.warning(f"Idle job {job_id} is not healthy anymore")
+            self._ready.pop(job_id, None)
+            await self._destroy(job_id)
+
+    async def _is_ready(self, job_id: str) -> bool:
+        try:
+            details = await self._allocator.get_job_details("", job_id)
+        except Exception as e:
+            self._logger.warning(f"Cannot get idle job {job_id} details: {e}")
+            return False
+        return details.ready
+
+    async def _destroy(self, job_id: str) -> None:
+        try:
+            await self._allocator.destroy_job(job_id)
+        except Exception as e:
+            self._logger.error(f"Failed to destroy idle job {job_id}: {e}")
@@ -1,24 +1,58 @@
 import asyncio
-from logging import Logger
+import time
+from collections.abc import Callable
+from functools import partial
+from logging import DEBUG, Logger
 
-from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType, web
+from aiohttp import ClientSession, ClientWebSocketResponse, WSMessage, WSMsgType, web
 from aiohttp.web_request import Request
 
-from .db import DbConnector
-from .settings import BRAYNS_PORT
+from .activity import ActivityRecorder
+from .compression import CompressingSender, CompressionPolicy
+from .fanout import FanOut, Participant
+from .frame_queue import FrameQueue
+from .job_router import JobRouter
+from .metrics import DURATION_BUCKETS, Counter, Gauge, Histogram
+from .settings import (
+    BRAYNS_PORT,
+    PROXY_COMPRESSION,
+    PROXY_DROP_FRAMES,
+    PROXY_FANOUT,
+    PROXY_FRAME_QUEUE_SIZE,
+    PROXY_LOG_SAMPLE_RATE,
+    PROXY_MAX_MESSAGE_SIZE,
+)
+from .tracing import finish as finish_trace
+from .tracing import set_server_timing, span
 
-MAX_MESSAGE_SIZE = 2 * 1024 * 1024 * 1024
+MAX_MESSAGE_SIZE = PROXY_MAX_MESSAGE_SIZE
 
 WebSocketLike = ClientWebSocketResponse | web.WebSocketResponse
 
+MESSAGES = Counter("vsm_proxy_messages_total", "Forwarded WebSocket messages", ("source",))
+BYTES = Counter("vsm_proxy_bytes_total", "Forwarded WebSocket payload bytes", ("source",))
+FORWARD_LATENCY = Histogram("vsm_proxy_forward_seconds", "Time to send one message to its destination", ("source",))
+SESSION_DURATION = Histogram("vsm_proxy_session_seconds", "Duration of proxied sessions", buckets=DURATION_BUCKETS)
+ACTIVE_SESSIONS = Gauge("vsm_proxy_active_sessions", "Open proxied sessions per job", ("job_id",))
+
 
 class WebSocketProxy:
-    def __init__(self, session: ClientSession, connector: DbConnector, logger: Logger) -> None:
+    def __init__(self, session: ClientSession, router: JobRouter, activity: ActivityRecorder, logger: Logger) -> None:
         self._session = session
-        self._connector = connector
+        self._router = router
+        self._activity = activity
         self._logger = logger
+        self._compression = CompressionPolicy()
+        self._fanout = FanOut(session, activity, logger) if PROXY_FANOUT else None
+
+    async def viewer_handler(self, request: Request):
+        """Read-only client of the job Brayns connection shared by its controller."""
+        if self._fanout is None:
+            raise web.HTTPNotFound(text="Viewers need fan-out to be enabled")
+
+        return await self.ws_handler(request, controller=False)
 
-    async def ws_handler(self, request: Request):
+    async def ws_handler(self, request: Request, controller: bool = True):
         self._logger.info(f"New websocket connection from {request.host}")
 
         job_id = request.match_info.get("job_id")
@@ -28,65 +62,222 @@ class WebSocketProxy:
             raise web.HTTPBadRequest(text="No job ID in path")
 
         try:
-            async with await self._connector.connect() as connection:
-                job = await connection.get_job(job_id)
+            host = await self._router.get_host(job_id)
         except Exception as e:
             self._logger.error(f"DB error while getting job details: {e}")
             return web.HTTPInternalServerError(text="Internal DB error (cannot retreive job)")
 
-        if job is None:
+        if host is None:
             self._logger.error(f"Invalid job ID from user: {job_id}")
             raise web.HTTPNotFound(text=f"No jobs found with ID {job_id}")
 
-        if not job.host:
+        if not host:
             self._logger.error(f"No host found for job {job_id}")
             return web.HTTPBadRequest(text="Job not ready")
 
-        hostname = f"{job.host}:{BRAYNS_PORT}"
+        hostname = f"{host}:{BRAYNS_PORT}"
 
         self._logger.info(f"Brayns hostname: {hostname}")
 
-        ws_client = web.WebSocketResponse(max_msg_size=MAX_MESSAGE_SIZE)
+        # Only the client leg negotiates permessage-deflate, Brayns is on the
+        # local network where compressing costs more than it saves.
+        ws_client = web.WebSocketResponse(max_msg_size=MAX_MESSAGE_SIZE, compress=PROXY_COMPRESSION)
 
-        await ws_client.prepare(request)
+        sender = CompressingSender(ws_client, self._compression)
+
+        # Joined before the handshake so a second controller gets a 409.
+        participant = Participant(ws_client, sender, controller)
+        shared = self._fanout.join(job_id, hostname, participant) if self._fanout is not None else None
+
+        start = time.monotonic()
+        ACTIVE_SESSIONS.inc(job_id)
+        self._activity.open(job_id)
 
         try:
-            async with self._session.ws_connect(f"ws://{hostname}", max_msg_size=MAX_MESSAGE_SIZE) as ws_brayns:
-                self._logger.info("Websocket session started")
-                task1 = asyncio.create_task(self.wsforward("brayns", ws_brayns, ws_client))
-                task2 = asyncio.create_task(self.wsforward("client", ws_client, ws_brayns))
-                await asyncio.wait([task1, task2], return_when=asyncio.FIRST_COMPLETED)
+            set_server_timing(ws_client.headers)
+            await ws_client.prepare(request)
+
+            if shared is None:
+                await self._forward(job_id, hostname, ws_client, sender)
+            else:
+                await shared.run(participant)
+        except web.HTTPException:
+            raise
         except Exception as e:
             self._logger.error(f"WS forward error: {e}")
             raise web.HTTPInternalServerError(text="WS proxy error")
+        finally:
+            if self._fanout is not None and shared is not None:
+                await self._fanout.leave(shared, participant)
+            self._activity.close(job_id)
+            ACTIVE_SESSIONS.dec(job_id)
+            if not ACTIVE_SESSIONS.get(job_id):
+                ACTIVE_SESSIONS.remove(job_id)
+            SESSION_DURATION.observe(time.monotonic() - start)
 
-        self._logger.info(f"Client with ip {request.host} disconnected")
+        self._logger.info(f"Client with ip {request.host} disconnected after {time.monotonic() - start:.1f}s")
+
+        if sender.ratio is not None:
+            self._logger.info(f"Estimated compression ratio to client: {sender.ratio:.2f}")
 
         return ws_client
 
-    async def wsforward(self, source: str, ws_from: WebSocketLike, ws_to: WebSocketLike) -> None:
-        async for message in ws_from:
+    async def _forward(
+        self, job_id: str, hostname: str, ws_client: web.WebSocketResponse, sender: CompressingSender
+    ) -> None:
+        with span("brayns_connect"):
+            ws_brayns = await self._session.ws_connect(f"ws://{hostname}", max_msg_size=MAX_MESSAGE_SIZE)
+
+        # The session itself is not a request to time.
+        finish_trace()
+
+        async with ws_brayns:
+            self._logger.info("Websocket session started")
+            if PROXY_DROP_FRAMES:
+                task1 = asyncio.create_task(self.wsforward_latest("brayns", ws_brayns, ws_client, sender))
+            else:
+                task1 = asyncio.create_task(self.wsforward("brayns", ws_brayns, ws_client, sender))
+            on_message = partial(self._activity.record, job_id)
+            task2 = asyncio.create_task(self.wsforward("client", ws_client, ws_brayns, on_message=on_message))
+            await asyncio.wait([task1, task2], return_when=asyncio.FIRST_COMPLETED)
+
+    async def wsforward(
+        self,
+        source: str,
+        ws_from: WebSocketLike,
+        ws_to: WebSocketLike,
+        sender: CompressingSender | None = None,
+        on_message: Callable[[], None] | None = None,
+    ) -> None:
+        sample_rate = PROXY_LOG_SAMPLE_RATE if self._logger.isEnabledFor(DEBUG) else 0
+        messages = 0
+        total_size = 0
+
+        while True:
+            message = await ws_from.receive()
             message_type = message.type
 
-            self._logger.info(f"WS message received from {source} {message_type=}")
+            if message_type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
+                break
 
-            if message_type == WSMsgType.TEXT:
-                await ws_to.send_str(message.data)
-                continue
+            if message_type == WSMsgType.ERROR:
+                self._logger.error(f"WS error from {source}: {ws_from.exception()}")
+                break
 
-            if message_type == WSMsgType.BINARY:
-                await ws_to.send_bytes(message.data)
-                continue
+            messages += 1
 
-            if message_type == WSMsgType.PING:
-                await ws_to.ping()
-                continue
+            if on_message is not None:
+                on_message()
 
-            if message_type == WSMsgType.PONG:
-                await ws_to.pong()
+            if sample_rate and messages % sample_rate == 0:
+                self._logger.debug(f"WS message #{messages} received from {source} {message_type=}")
+
+            if message_type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                await self._forward_control(message, ws_to)
                 continue
 
-            self._logger.error(f"Invalid WS message type {message_type}")
-            raise ValueError("Invalid websocket message type")
+            size = len(message.data)
+            total_size += size
+            start = time.perf_counter()
+
+            await self._forward_data(message, ws_to, sender)
+
+            FORWARD_LATENCY.observe(time.perf_counter() - start, source)
+            MESSAGES.inc(source)
+            BYTES.inc(source, value=size)
+
+        self._logger.info(f"Forwarded {messages} messages ({total_size} bytes) from {source}")
 
         await ws_to.close()
+
+    async def wsforward_latest(
+        self,
+        source: str,
+        ws_from: WebSocketLike,
+        ws_to: web.WebSocketResponse,
+        sender: CompressingSender,
+    ) -> None:
+        """Forward with latest frame wins: while the client lags, newer binary frames replace queued ones."""
+        queue = FrameQueue(PROXY_FRAME_QUEUE_SIZE)
+        sending = asyncio.create_task(self._send_queued(source, queue, ws_to, sender))
+        messages = 0
+        total_size = 0
+
+        try:
+            while True:
+                message = await ws_from.receive()
+                message_type = message.type
+
+                if message_type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
+                    break
+
+                if message_type == WSMsgType.ERROR:
+                    self._logger.error(f"WS error from {source}: {ws_from.exception()}")
+                    break
+
+                messages += 1
+
+                # Control frames are queued too (never dropped), to keep their order.
+                if message_type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                    total_size += len(message.data)
+
+                queue.put(message)
+
+                if sending.done():
+                    break
+        except BaseException:
+            sending.cancel()
+            raise
+        finally:
+            # What is still queued is flushed before closing the client.
+            queue.close()
+
+            try:
+                await sending
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                self._logger.error(f"Failed to send messages from {source}: {e}")
+
+        self._logger.info(f"Received {messages} messages ({total_size} bytes) from {source}")
+
+        await ws_to.close()
+
+    async def _send_queued(
+        self, source: str, queue: FrameQueue, ws_to: web.WebSocketResponse, sender: CompressingSender
+    ) -> None:
+        while (message := await queue.get()) is not None:
+            if message.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                await self._forward_control(message, ws_to)
+                continue
+
+            start = time.perf_counter()
+            await sender.send(message.type, message.data)
+            FORWARD_LATENCY.observe(time.perf_counter() - start, source)
+            MESSAGES.inc(source)
+            BYTES.inc(source, value=len(message.data))
+
+    async def _forward_data(self, message: WSMessage, ws_to: WebSocketLike, sender: CompressingSender | None) -> None:
+        if sender is not None:
+            await sender.send(message.type, message.data)
+            return
+
+        if message.type == WSMsgType.TEXT:
+            await ws_to.send_str(message.data)
+            return
+
+        await ws_to.send_bytes(message.data)
+
+    async def _forward_control(self, message: WSMessage, ws_to: WebSocketLike) -> None:
+        message_type = message.type
+
+        if message_type == WSMsgType.PING:
+            await ws_to.ping()
+            return
+
+        if message_type == WSMsgType.PONG:
+            await ws_to.pong()
+            return
+
+        self._logger.error(f"Invalid WS message type {message_type}")
+        raise ValueError("Invalid websocket message type")